@@ -0,0 +1,174 @@
+"""
+Adaptive (AIMD) limit on in-flight Vertex image requests, per process.
+
+IMAGE_GEN_CONCURRENCY used to be a fixed pool size read once at import:
+too low when quota is free, too high in a 429 storm, where every extra
+request in flight is one more 429 and one more retry. The limit now moves
+with what Vertex tells us, the way TCP finds its window:
+
+  additive increase        — each fast 200 while the limit is in use adds
+                             1/limit, so the limit grows by about one per
+                             round of successes.
+  multiplicative decrease  — a 429 or a timeout multiplies it by
+                             IMAGE_CONCURRENCY_BACKOFF, at most once per
+                             cool-down so one storm hitting every request in
+                             flight counts as one signal.
+
+Successes slower than IMAGE_CONCURRENCY_LATENCY_S don't grow the limit.
+5xx alone doesn't shrink it; circuit_breaker handles sick models.
+
+Every Vertex image request (`vertex_client._timed_post`) takes a slot for
+the HTTP request alone and gives it back with the attempt it made, so the
+wizard pool, Template Studio pre-renders and photo personalisation all
+share one limit; vertex_async's event loop takes its slots with
+`acquire_async()`. Rate-limiter queueing and back-off sleeps happen outside
+the slot: a call waiting out a 429 doesn't stop another from using
+quota that is free. Thread pools are sized to IMAGE_CONCURRENCY_MAX and
+the limiter decides how many of their workers are actually talking to
+Vertex. Cache hits never take a slot.
+
+Tunables (env vars):
+  IMAGE_GEN_CONCURRENCY        — starting limit (default 3)
+  IMAGE_CONCURRENCY_MIN        — floor (default 1)
+  IMAGE_CONCURRENCY_MAX        — ceiling, and worker-pool size (default 8)
+  IMAGE_CONCURRENCY_BACKOFF    — decrease factor on 429/timeout (default 0.5)
+  IMAGE_CONCURRENCY_COOLDOWN_S — min seconds between decreases (default 10)
+  IMAGE_CONCURRENCY_LATENCY_S  — successes slower than this don't increase (default 60)
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+MIN_LIMIT = max(1, int(os.environ.get("IMAGE_CONCURRENCY_MIN", "1")))
+MAX_LIMIT = max(MIN_LIMIT, int(os.environ.get("IMAGE_CONCURRENCY_MAX", "8")))
+INITIAL_LIMIT = min(MAX_LIMIT, max(MIN_LIMIT, int(os.environ.get("IMAGE_GEN_CONCURRENCY", "3"))))
+BACKOFF = float(os.environ.get("IMAGE_CONCURRENCY_BACKOFF", "0.5"))
+COOLDOWN_S = float(os.environ.get("IMAGE_CONCURRENCY_COOLDOWN_S", "10"))
+LATENCY_TARGET_S = float(os.environ.get("IMAGE_CONCURRENCY_LATENCY_S", "60"))
+# How often a queued asyncio caller looks for a free slot
+ASYNC_POLL_S = 0.05
+
+_TIMEOUT_STATUSES = ("Timeout", "ReadTimeout", "ConnectTimeout", "WriteTimeout", "PoolTimeout")
+
+_cond = threading.Condition()
+_limit = float(INITIAL_LIMIT)
+_in_flight = 0
+_last_decrease = 0.0
+_stats = {"acquired": 0, "queued": 0, "wait_s": 0.0, "timeouts": 0,
+          "increases": 0, "decreases": 0, "peak_in_flight": 0, "last_decrease_reason": ""}
+
+
+def current_limit() -> int:
+    with _cond:
+        return max(MIN_LIMIT, int(_limit))
+
+
+def _take(t0: float, queued: bool) -> None:
+    # caller holds _cond and has checked there is room
+    global _in_flight
+    _in_flight += 1
+    _stats["acquired"] += 1
+    _stats["peak_in_flight"] = max(_stats["peak_in_flight"], _in_flight)
+    if queued:
+        _stats["queued"] += 1
+        _stats["wait_s"] += time.monotonic() - t0
+
+
+def acquire(timeout: Optional[float] = None) -> bool:
+    """Wait for a slot. False if none freed up within `timeout` seconds."""
+    t0 = time.monotonic()
+    end = None if timeout is None else t0 + timeout
+    with _cond:
+        queued = False
+        while _in_flight >= max(MIN_LIMIT, int(_limit)):
+            queued = True
+            left = None if end is None else end - time.monotonic()
+            if left is not None and left <= 0:
+                _stats["timeouts"] += 1
+                return False
+            _cond.wait(left)
+        _take(t0, queued)
+    return True
+
+
+async def acquire_async(timeout: Optional[float] = None) -> bool:
+    """acquire() for asyncio callers (vertex_async). Polls every
+    ASYNC_POLL_S instead of parking a thread on the condition."""
+    t0 = time.monotonic()
+    end = None if timeout is None else t0 + timeout
+    queued = False
+    while True:
+        with _cond:
+            if _in_flight < max(MIN_LIMIT, int(_limit)):
+                _take(t0, queued)
+                return True
+            left = None if end is None else end - time.monotonic()
+            if left is not None and left <= 0:
+                _stats["timeouts"] += 1
+                return False
+        queued = True
+        await asyncio.sleep(ASYNC_POLL_S if left is None else min(ASYNC_POLL_S, left))
+
+
+def release(attempt=None) -> None:
+    """Give the slot back; `attempt` (a vertex_client.ImageAttempt, or
+    None if the request never went out) is what it saw, and adjusts the
+    limit."""
+    global _in_flight
+    with _cond:
+        _in_flight = max(0, _in_flight - 1)
+        if attempt is not None:
+            _adjust(attempt)
+        _cond.notify_all()
+
+
+def _adjust(attempt) -> None:
+    # caller holds _cond
+    global _limit, _last_decrease
+    throttled = attempt.status == "429"
+    timed_out = attempt.status in _TIMEOUT_STATUSES
+    if throttled or timed_out:
+        now = time.monotonic()
+        if now - _last_decrease < COOLDOWN_S:
+            return
+        old = _limit
+        _limit = max(float(MIN_LIMIT), _limit * BACKOFF)
+        _last_decrease = now
+        _stats["decreases"] += 1
+        _stats["last_decrease_reason"] = "429" if throttled else "timeout"
+        if int(old) != int(_limit):
+            logger.warning(
+                f"adaptive_concurrency: {_stats['last_decrease_reason']} — "
+                f"limit {int(old)} -> {max(MIN_LIMIT, int(_limit))}"
+            )
+        return
+    if attempt.status == "200":
+        if attempt.latency_s > LATENCY_TARGET_S:
+            return
+        # Only grow a limit we are actually using; an idle server learns
+        # nothing about how much more Vertex would take.
+        if _in_flight + 1 < int(_limit):
+            return
+        old = _limit
+        _limit = min(float(MAX_LIMIT), _limit + 1.0 / max(_limit, 1.0))
+        if int(_limit) > int(old):
+            _stats["increases"] += 1
+            logger.info(f"adaptive_concurrency: limit {int(old)} -> {int(_limit)}")
+
+
+def concurrency_stats() -> dict:
+    """Counters for the admin panel."""
+    with _cond:
+        out = dict(_stats)
+        out["limit"] = max(MIN_LIMIT, int(_limit))
+        out["limit_exact"] = round(_limit, 2)
+        out["in_flight"] = _in_flight
+    out["wait_s"] = round(out["wait_s"], 1)
+    out["min"], out["max"] = MIN_LIMIT, MAX_LIMIT
+    return out
@@ -40,8 +40,9 @@ def _rebuild_pdf_bytes(book):
     try:
         from PIL import Image
         from main import create_pdf  # deferred import avoids a circular import
+        import blob_store
         imgs = []
-        for s in (book.get("images") or []):
+        for s in blob_store.resolve_many(book.get("images") or []):
             if isinstance(s, str) and s.startswith("data:image"):
                 raw = base64.b64decode(s.split(",", 1)[1])
                 imgs.append(Image.open(io.BytesIO(raw)).convert("RGB"))
@@ -90,8 +91,8 @@ def render_admin_dashboard():
     )
 
     st.divider()
-    tab_print, tab_resume, tab_log = st.tabs(
-        ["Print requests", "Resume / rebuild PDF", "Event log"]
+    tab_print, tab_resume, tab_log, tab_backend = st.tabs(
+        ["Print requests", "Resume / rebuild PDF", "Event log", "Backend health"]
     )
 
     # ── Print requests ───────────────────────────────────────────────────
@@ -171,3 +172,117 @@ def render_admin_dashboard():
                     "detail": ", ".join(f"{k}={v}" for k, v in d.items())[:90],
                 })
             st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    # ── Backend health ───────────────────────────────────────────────────
+    with tab_backend:
+        st.caption(
+            "Image model circuit breakers. An open breaker means that model / "
+            "endpoint returned too many server errors recently and is being "
+            "skipped in favour of the next fallback model."
+        )
+        try:
+            import circuit_breaker
+            states = circuit_breaker.states()
+        except Exception as e:
+            states = []
+            st.error(f"Breaker state unavailable: {e}")
+        if states:
+            st.markdown("**Current state (this server)**")
+            st.dataframe(states, use_container_width=True, hide_index=True)
+        else:
+            st.info("No image calls made by this server yet.")
+
+        try:
+            import adaptive_concurrency
+            cs = adaptive_concurrency.concurrency_stats()
+            st.markdown("**Image concurrency (this server)**")
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Current limit", cs["limit"], f"range {cs['min']}–{cs['max']}", delta_color="off")
+            c2.metric("In flight", cs["in_flight"], f"peak {cs['peak_in_flight']}", delta_color="off")
+            c3.metric("Increases / decreases", f"{cs['increases']} / {cs['decreases']}",
+                      cs["last_decrease_reason"] and f"last cut: {cs['last_decrease_reason']}",
+                      delta_color="off")
+            c4.metric("Queued for a slot", cs["queued"], f"{cs['wait_s']}s total", delta_color="off")
+        except Exception as e:
+            st.error(f"Concurrency stats unavailable: {e}")
+
+        try:
+            import text_cache
+            tc = text_cache.cache_stats()
+            st.markdown("**Story text cache (this server)**")
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Hit rate", f"{tc['hit_rate']:.0%}", f"{tc['hits']} hits / {tc['misses']} misses",
+                      delta_color="off")
+            c2.metric("Tokens saved", f"{tc['tokens_saved']:,}")
+            c3.metric("Cached responses", tc["entries"])
+        except Exception as e:
+            st.error(f"Text cache stats unavailable: {e}")
+
+        try:
+            import asset_cache
+            ac = asset_cache.cache_stats()
+            st.markdown("**Template asset cache (this server)**")
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Hit rate", f"{ac['hit_rate']:.0%}", f"{ac['hits']} hits / {ac['misses']} misses",
+                      delta_color="off")
+            c2.metric("Resident", f"{ac['bytes'] / 1e6:.1f} MB",
+                      f"of {ac['budget_bytes'] / 1e6:.0f} MB, {ac['entries']} entries", delta_color="off")
+            c3.metric("Evictions", ac["evictions"])
+            c4.metric("Invalidations", ac["invalidations"],
+                      f"{ac['remote_invalidations']} from other servers", delta_color="off")
+        except Exception as e:
+            st.error(f"Asset cache stats unavailable: {e}")
+
+        try:
+            import blob_store
+            bs = blob_store.blob_stats()
+            st.markdown(f"**Image blob store ({bs['backend']}, this server)**")
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Blobs written", bs["puts"], f"{bs['bytes_written'] / 1e6:.1f} MB", delta_color="off")
+            c2.metric("Renditions written", bs["renditions"], f"{bs['dedup']} deduplicated", delta_color="off")
+            c3.metric("Reads", bs["gets"], f"{bs['misses']} missing", delta_color="off")
+            c4.metric("Errors", bs["errors"])
+        except Exception as e:
+            st.error(f"Blob store stats unavailable: {e}")
+
+        try:
+            import retry_budget
+            rb = retry_budget.budget_stats()
+            st.markdown(f"**Vertex retry budget ({rb['mode']})**")
+            st.caption(
+                f"Retries are allowed up to {retry_budget.MIN_RETRIES} + "
+                f"{rb['ratio']:.0%} of successful requests per "
+                f"{retry_budget.WINDOW_S:.0f}s. Exhausted = retries refused."
+            )
+            win = rb["scopes"].get("vertex", {})
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Retries (window)", win.get("retries", 0), f"of {win.get('allowance', retry_budget.MIN_RETRIES)} allowed",
+                      delta_color="off")
+            c2.metric("Successes (window)", win.get("successes", 0))
+            c3.metric("Exhausted (since start)", rb["exhausted"])
+            c4.metric("Retries (since start)", rb["retries"])
+            ex = analytics.backend_events(50, types=(analytics.RETRY_BUDGET_EXHAUSTED,))
+            if ex:
+                st.dataframe(
+                    [{"time": e.get("ts"), **(e.get("details") or {})} for e in ex],
+                    use_container_width=True, hide_index=True,
+                )
+        except Exception as e:
+            st.error(f"Retry budget stats unavailable: {e}")
+
+        evs = analytics.backend_events(200)
+        st.markdown("**Recent breaker transitions (all servers)**")
+        if not evs:
+            st.info("No breaker transitions logged.")
+        else:
+            rows = []
+            for e in evs:
+                d = e.get("details") or {}
+                rows.append({
+                    "time": e.get("ts"),
+                    "model": d.get("model"),
+                    "endpoint": d.get("endpoint"),
+                    "transition": f"{d.get('from_state')} -> {d.get('to_state')}",
+                    "error_rate": d.get("error_rate"),
+                })
+            st.dataframe(rows, use_container_width=True, hide_index=True)
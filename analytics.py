@@ -31,6 +31,10 @@ BOOK_FAILED     = "book_failed"
 DOWNLOAD        = "download"
 PRINT_REQUESTED = "print_requested"
 
+# Backend health event types (not part of the customer funnel)
+BREAKER_TRANSITION = "breaker_transition"
+RETRY_BUDGET_EXHAUSTED = "retry_budget_exhausted"
+
 
 def _conf(key, default=""):
     """Read config from env first, then Streamlit secrets. Never raises."""
@@ -162,6 +166,15 @@ def recent_events(limit=300):
         return []
 
 
+def backend_events(limit=200, types=(BREAKER_TRANSITION,)):
+    """Most recent backend-health events (circuit breaker transitions etc.)."""
+    try:
+        return list(_events().find({"type": {"$in": list(types)}}).sort("ts", -1).limit(limit))
+    except Exception as e:
+        logger.warning(f"backend_events failed: {e}")
+        return []
+
+
 def print_orders(limit=200):
     try:
         from mongo_client import get_db
@@ -186,7 +199,7 @@ def resumable_books(limit=200):
     try:
         from mongo_client import book_history_col
         return list(book_history_col().find(
-            {"images": {"$elemMatch": {"$type": "string", "$regex": "^data:image"}}},
+            {"images": {"$elemMatch": {"$type": "string", "$regex": "^(data:image|blob:)"}}},
             {"_id": 1, "child_name": 1, "title": 1, "metadata": 1,
              "created_at": 1, "user_id": 1},
         ).sort("created_at", -1).limit(limit))
@@ -0,0 +1,166 @@
+"""
+In-process LRU cache of resolved template assets.
+
+Template assets only change when Template Studio renders, yet every
+sneak-peek (`template_flow._sample_page_image`), book assembly and
+preview read them from Mongo (and the blob store) again. This cache keeps
+the resolved data URLs in memory, keyed by
+
+  (template_id, page_number, requested variant key, rendition role)
+
+under a byte budget; least recently used entries are dropped first.
+Pages with no asset yet are cached too (as None), so an incomplete
+template doesn't query Mongo on every preview.
+
+Invalidation is version-stamped per template. `save_asset` bumps the
+template's version here, and every entry carries the version it was read
+under: an entry from an older version is a miss. Readers take the
+version *before* querying Mongo and store under it, so a save that lands
+while a read is in flight can't leave a stale image behind.
+
+Other replicas learn about saves through a watermark: at most every
+ASSET_CACHE_CHECK_S seconds per template, the newest `updated_at` among
+its asset docs is read (one indexed document); if it moved, the version
+is bumped and the template's entries go stale.
+
+Tunables (env vars):
+  ASSET_CACHE_MB       — memory budget in MB (default 64, 0 disables)
+  ASSET_CACHE_CHECK_S  — seconds between watermark checks per template (default 30)
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+BUDGET_BYTES = int(float(os.environ.get("ASSET_CACHE_MB", "64")) * 1024 * 1024)
+CHECK_S = float(os.environ.get("ASSET_CACHE_CHECK_S", "30"))
+
+# Rough size charged for a cached "no asset" entry
+_NONE_BYTES = 64
+
+_MISS = object()
+
+_lock = threading.Lock()
+_entries: "OrderedDict[tuple, tuple]" = OrderedDict()   # key -> (version, value, size)
+_bytes = 0
+_versions: dict = {}     # template_id -> int
+_watermarks: dict = {}   # template_id -> (updated_at, monotonic time checked)
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+          "invalidations": 0, "remote_invalidations": 0, "check_errors": 0}
+
+
+def enabled() -> bool:
+    return BUDGET_BYTES > 0
+
+
+def version(template_id: str) -> int:
+    """Current version of a template's assets; take it before reading
+    Mongo and pass it to put()."""
+    _check_watermark(template_id)
+    with _lock:
+        return _versions.get(template_id, 0)
+
+
+def get(template_id: str, page_number: int, vk: str, role: Optional[str] = None):
+    """Cached value (a data URL, or None for "no asset"), or _MISS."""
+    if not enabled():
+        return _MISS
+    key = (template_id, page_number, vk, role)
+    with _lock:
+        e = _entries.get(key)
+        if e is None or e[0] != _versions.get(template_id, 0):
+            _stats["misses"] += 1
+            return _MISS
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return e[1]
+
+
+def is_miss(value) -> bool:
+    return value is _MISS
+
+
+def put(template_id: str, page_number: int, vk: str, value: Optional[str], ver: int,
+        role: Optional[str] = None) -> None:
+    """Store what was read under version `ver`; dropped if a save has
+    bumped the version since."""
+    global _bytes
+    if not enabled():
+        return
+    size = len(value) if value else _NONE_BYTES
+    if size > BUDGET_BYTES // 4:
+        return   # one huge image shouldn't flush the whole cache
+    key = (template_id, page_number, vk, role)
+    with _lock:
+        if ver != _versions.get(template_id, 0):
+            return
+        old = _entries.pop(key, None)
+        if old is not None:
+            _bytes -= old[2]
+        _entries[key] = (ver, value, size)
+        _bytes += size
+        _stats["stores"] += 1
+        while _bytes > BUDGET_BYTES and _entries:
+            _, (_, _, s) = _entries.popitem(last=False)
+            _bytes -= s
+            _stats["evictions"] += 1
+
+
+def invalidate(template_id: str) -> None:
+    """A template's assets changed (save_asset): older entries go stale."""
+    global _bytes
+    with _lock:
+        _versions[template_id] = _versions.get(template_id, 0) + 1
+        _stats["invalidations"] += 1
+        # Free the memory now rather than waiting for LRU to get to them.
+        for key in [k for k in _entries if k[0] == template_id]:
+            _bytes -= _entries.pop(key)[2]
+
+
+def _check_watermark(template_id: str) -> None:
+    if not enabled():
+        return
+    now = time.monotonic()
+    with _lock:
+        seen = _watermarks.get(template_id)
+        if seen is not None and now - seen[1] < CHECK_S:
+            return
+        # Claim the check so concurrent readers don't all query Mongo
+        _watermarks[template_id] = (seen[0] if seen else None, now)
+    try:
+        from mongo_client import template_assets_col
+        doc = template_assets_col().find_one(
+            {"template_id": template_id}, {"_id": 0, "updated_at": 1},
+            sort=[("updated_at", -1)],
+        )
+        mark = doc.get("updated_at") if doc else None
+    except Exception as e:
+        with _lock:
+            _stats["check_errors"] += 1
+        logger.debug(f"asset_cache watermark check failed: {e}")
+        return
+    with _lock:
+        _watermarks[template_id] = (mark, now)
+        changed = seen is not None and mark != seen[0]
+    if changed:
+        logger.info(f"asset_cache: {template_id} assets changed on another server — invalidating")
+        invalidate(template_id)
+        with _lock:
+            _stats["remote_invalidations"] += 1
+
+
+def cache_stats() -> dict:
+    """Counters for the admin panel."""
+    with _lock:
+        out = dict(_stats)
+        out["entries"] = len(_entries)
+        out["bytes"] = _bytes
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+    out["budget_bytes"] = BUDGET_BYTES
+    return out
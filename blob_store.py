@@ -0,0 +1,426 @@
+"""
+Content-addressed blob store for page images.
+
+Page images used to live inside Mongo documents as ~100KB base64 data
+URLs: `book_history.images`, `book_cache.book_data.pages[].image_url`,
+`image_pool.image_url` and `template_assets.variants.*`. Every read of
+those documents dragged megabytes over the wire — get_asset fetched all
+eight variants to return one — and busy books crept toward the 16MB
+document limit.
+
+The encoded image bytes now go to a blob store, keyed by the SHA-256 of
+those bytes, and documents hold a short reference in place of the data
+URL:
+
+    blob:sha256:<64 hex chars>
+
+Same bytes, same key: storing a page twice (every incremental save in
+the wizard) is a no-op, and a template asset reused across thousands of
+books is stored once. Readers call `resolve()` on whatever they find in
+a document — a ref is fetched and turned back into a data URL, an inline
+data URL (not migrated yet) or http URL is passed through — so only the
+pages a screen actually shows are ever read.
+
+Each new blob also gets small renditions (thumb, card — see
+image_bytes.ROLES) written next to it as `<key>.<role>`, once, at save
+time. `resolve(value, role=...)` returns the smallest one that fits the
+slot; blobs stored before renditions existed get them derived on first
+request. "preview" and "print" deliberately resolve to the original:
+stored page images are already capped at 768px / JPEG q75
+(compress_image_for_storage), below the preview size, so a preview
+rendition would be the same pixels re-encoded at a higher quality —
+bigger, not smaller — and print can't get better than what was stored.
+
+Writes are best-effort: if the store is unreachable, `put_data_url()`
+returns the data URL unchanged and the document keeps it inline, as
+before. scripts/migrate_images_to_blobs.py converts existing documents.
+
+Blobs are never deleted, since any number of documents may share one —
+except scoped ones (`put(..., scope="imgcache")`, key `<scope>-<hex>`),
+which belong to a single owner that removes them with `delete()`.
+
+Backends:
+  gridfs — the `blobs` GridFS bucket in the app's Mongo database (default)
+  disk   — files under BLOB_STORE_DIR, for local development
+  off    — keep images inline (old behaviour)
+
+Tunables (env vars):
+  BLOB_STORE      — gridfs | disk | off (default gridfs)
+  BLOB_STORE_DIR  — root directory for the disk backend (default ./.blobs)
+  BLOB_BUCKET     — GridFS bucket name (default blobs)
+"""
+
+import os
+import base64
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.environ.get("BLOB_STORE", "gridfs").lower()
+STORE_DIR = Path(os.environ.get("BLOB_STORE_DIR", str(Path(__file__).parent / ".blobs")))
+
+REF_PREFIX = "blob:sha256:"
+
+# Renditions (image_bytes.ROLES) stored next to each blob as "<key>.<role>"
+STORED_ROLES = ("thumb", "card")
+
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+_lock = threading.Lock()
+# Keys this process has already written or seen stored; content-addressed,
+# so a known key never needs another exists-check. Scoped keys are left
+# out: their owner may delete() them from any replica.
+_known: set = set()
+_KNOWN_MAX = 50_000
+_stats = {"puts": 0, "dedup": 0, "renditions": 0, "gets": 0, "misses": 0, "errors": 0,
+          "bytes_written": 0}
+
+
+def enabled() -> bool:
+    return BACKEND in ("gridfs", "disk")
+
+
+def is_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+def key_of(ref: str) -> str:
+    return ref[len(REF_PREFIX):]
+
+
+def _mime(data: bytes) -> str:
+    for magic, mime in _MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class _GridFSBackend:
+    def exists(self, key: str) -> bool:
+        from mongo_client import blob_files_col
+        return blob_files_col().find_one({"_id": key}, {"_id": 1}) is not None
+
+    def put(self, key: str, data: bytes) -> None:
+        import gridfs
+        from mongo_client import blobs_bucket
+        try:
+            blobs_bucket().upload_from_stream_with_id(
+                key, key, data, metadata={"content_type": _mime(data)}
+            )
+        except gridfs.errors.FileExists:
+            pass   # another replica stored the same bytes first
+
+    def get(self, key: str) -> Optional[bytes]:
+        import gridfs
+        from mongo_client import blobs_bucket
+        try:
+            return blobs_bucket().open_download_stream(key).read()
+        except gridfs.errors.NoFile:
+            return None
+
+    def delete(self, key: str) -> None:
+        import gridfs
+        from mongo_client import blobs_bucket
+        try:
+            blobs_bucket().delete(key)
+        except gridfs.errors.NoFile:
+            pass
+
+    def get_many(self, keys: List[str]) -> dict:
+        # Straight off the chunks collection: one query for every blob
+        # instead of a files lookup plus a chunk read per blob. GridFS
+        # writes the files document last, so only blobs that have one —
+        # and whose chunks add up to its length — are returned; anything
+        # incomplete (an upload in flight) is left out for get() to retry.
+        from mongo_client import blob_chunks_col, blob_files_col
+        files = {
+            f["_id"]: f for f in blob_files_col().find(
+                {"_id": {"$in": keys}}, {"length": 1, "chunkSize": 1}
+            )
+        }
+        if not files:
+            return {}
+        parts: dict = {}
+        for c in blob_chunks_col().find({"files_id": {"$in": list(files)}}).sort(
+            [("files_id", 1), ("n", 1)]
+        ):
+            parts.setdefault(c["files_id"], []).append((c["n"], bytes(c["data"])))
+        out = {}
+        for k, f in files.items():
+            chunks = parts.get(k, [])
+            length, size = f.get("length", -1), f.get("chunkSize") or 1
+            if ([n for n, _ in chunks] != list(range(-(-length // size)))
+                    or sum(len(d) for _, d in chunks) != length):
+                logger.debug(f"blob_store: {k[:16]}… incomplete in batch read")
+                continue
+            out[k] = b"".join(d for _, d in chunks)
+        return out
+
+
+class _DiskBackend:
+    def _path(self, key: str) -> Path:
+        return STORE_DIR / key[:2] / key[2:]
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def get_many(self, keys: List[str]) -> dict:
+        return {k: d for k in keys if (d := self.get(k)) is not None}
+
+
+_backend = _DiskBackend() if BACKEND == "disk" else _GridFSBackend()
+
+
+# ---------------------------------------------------------------------------
+# Write
+# ---------------------------------------------------------------------------
+
+def _rendition_key(key: str, role: str) -> str:
+    return f"{key}.{role}"
+
+
+def _make_rendition(data: bytes, role: str) -> bytes:
+    from image_bytes import EncodedImage, ROLES
+    max_size, quality = ROLES[role]
+    return EncodedImage(data).rendition(max_size, quality).data
+
+
+def _put_rendition(key: str, role: str, data: bytes) -> Optional[bytes]:
+    """Derive and store one rendition of blob `key`; returns its bytes
+    (the original's if it can't be derived)."""
+    try:
+        out = _make_rendition(data, role)
+    except Exception as e:
+        logger.debug(f"blob_store: {role} rendition failed: {e}")
+        return data
+    try:
+        _backend.put(_rendition_key(key, role), out)
+        with _lock:
+            _stats["renditions"] += 1
+    except Exception as e:
+        logger.debug(f"blob_store: storing {role} rendition failed: {e}")
+    return out
+
+
+def put(data: bytes, renditions: bool = True, scope: str = "") -> str:
+    """Store encoded image bytes; return their ref. Raises on store errors.
+
+    A new blob also gets its STORED_ROLES renditions written alongside,
+    once, so display paths never resize on the way out. A `scope` keeps
+    the blob private to one owner (e.g. image_cache), which may then
+    delete() it without touching blobs that documents refer to."""
+    key = hashlib.sha256(data).hexdigest()
+    if scope:
+        key = f"{scope}-{key}"
+    with _lock:
+        known = not scope and key in _known
+    if known or _backend.exists(key):
+        with _lock:
+            _stats["dedup"] += 1
+    else:
+        _backend.put(key, data)
+        with _lock:
+            _stats["puts"] += 1
+            _stats["bytes_written"] += len(data)
+        if renditions:
+            for role in STORED_ROLES:
+                _put_rendition(key, role, data)
+    if not scope:
+        with _lock:
+            if len(_known) >= _KNOWN_MAX:
+                _known.clear()
+            _known.add(key)
+    return REF_PREFIX + key
+
+
+def delete(ref: str) -> None:
+    """Remove a scoped blob and its renditions (best-effort)."""
+    if not is_ref(ref) or "-" not in key_of(ref):
+        raise ValueError("only scoped blobs can be deleted")
+    key = key_of(ref)
+    with _lock:
+        _known.discard(key)
+    for k in (key,) + tuple(_rendition_key(key, r) for r in STORED_ROLES):
+        try:
+            _backend.delete(k)
+        except Exception as e:
+            logger.debug(f"blob_store: delete {k[:24]}… failed: {e}")
+
+
+def put_data_url(value, renditions: bool = True):
+    """Swap a data URL for a blob ref. Anything else (refs, http URLs,
+    None) comes back unchanged, and so does the data URL itself if the
+    store is off or fails — the caller then stores it inline."""
+    if not enabled() or not isinstance(value, str) or not value.startswith("data:image"):
+        return value
+    try:
+        return put(base64.b64decode(value.split(",", 1)[1]), renditions)
+    except Exception as e:
+        with _lock:
+            _stats["errors"] += 1
+        logger.warning(f"blob_store: put failed, keeping image inline: {e}")
+        return value
+
+
+def offload(values: Iterable) -> list:
+    """put_data_url over a list (e.g. book_history.images); keeps None slots."""
+    return [put_data_url(v) for v in values]
+
+
+# ---------------------------------------------------------------------------
+# Read
+# ---------------------------------------------------------------------------
+
+def _get_key(key: str, quiet: bool = False) -> Optional[bytes]:
+    try:
+        data = _backend.get(key)
+    except Exception as e:
+        with _lock:
+            _stats["errors"] += 1
+        logger.warning(f"blob_store: get failed for {key[:16]}…: {e}")
+        return None
+    with _lock:
+        _stats["gets"] += 1
+        if data is None and not quiet:
+            _stats["misses"] += 1
+    if data is None and not quiet:
+        logger.warning(f"blob_store: {key[:16]}… not found")
+    return data
+
+
+def get(ref: str) -> Optional[bytes]:
+    """Bytes for a ref, or None if missing or unreadable."""
+    if not is_ref(ref):
+        return None
+    return _get_key(key_of(ref))
+
+
+def _stored_role(role: Optional[str]) -> Optional[str]:
+    # Stored images are already ≤768px q75, so "preview" and "print" are
+    # the original blob (see the module docstring).
+    return role if role in STORED_ROLES else None
+
+
+def _role_bytes(key: str, role: str) -> Optional[bytes]:
+    """A stored rendition; blobs written before renditions existed get it
+    derived from the original and stored now (once)."""
+    data = _get_key(_rendition_key(key, role), quiet=True)
+    if data is not None:
+        return data
+    orig = _get_key(key)
+    if orig is None:
+        return None
+    return _put_rendition(key, role, orig)
+
+
+def _inline_rendition(value: str, role: str) -> str:
+    # Not migrated yet: resize in memory rather than ship the full image.
+    try:
+        from image_bytes import EncodedImage, ROLES
+        return EncodedImage.from_data_url(value).rendition(*ROLES[role]).data_url
+    except Exception:
+        return value
+
+
+def resolve(value, role: Optional[str] = None) -> Optional[str]:
+    """Data URL for whatever a document holds: a ref is fetched, inline
+    data URLs and http URLs pass through, anything else is None.
+
+    `role` (see image_bytes.ROLES) asks for the smallest rendition that
+    fits the slot the image is shown in; None is the stored image."""
+    role = _stored_role(role)
+    if is_ref(value):
+        data = _role_bytes(key_of(value), role) if role else get(value)
+        if data is None:
+            return None
+        return _data_url(data)
+    if isinstance(value, str) and value:
+        if role and value.startswith("data:image"):
+            return _inline_rendition(value, role)
+        return value
+    return None
+
+
+def _data_url(data: bytes) -> str:
+    return f"data:{_mime(data)};base64,{base64.b64encode(data).decode()}"
+
+
+def resolve_many(values: Iterable, only: Optional[Iterable[int]] = None,
+                 role: Optional[str] = None) -> List:
+    """resolve() over a list, fetching every ref in one backend read. With
+    `only`, just those positions are fetched and the rest are returned as
+    stored (refs stay refs)."""
+    role = _stored_role(role)
+    values = list(values or [])
+    want = None if only is None else set(only)
+    pick = [i for i in range(len(values)) if want is None or i in want]
+
+    def _k(v):
+        return _rendition_key(key_of(v), role) if role else key_of(v)
+
+    keys = sorted({_k(values[i]) for i in pick if is_ref(values[i])})
+    blobs: dict = {}
+    if keys:
+        try:
+            blobs = _backend.get_many(keys)
+        except Exception as e:
+            with _lock:
+                _stats["errors"] += 1
+            logger.warning(f"blob_store: batched get failed ({e}) — fetching one by one")
+        else:
+            # Keys left out fall back to resolve() below, which counts
+            # any that are really missing.
+            with _lock:
+                _stats["gets"] += len(blobs)
+    out = list(values)
+    for i in pick:
+        v = values[i]
+        if is_ref(v):
+            data = blobs.get(_k(v))
+            # Missing rendition (or failed batch): one-off read, which
+            # backfills renditions for older blobs.
+            out[i] = _data_url(data) if data is not None else resolve(v, role)
+        else:
+            out[i] = resolve(v, role)
+    return out
+
+
+def blob_stats() -> dict:
+    """Counters for the admin panel."""
+    with _lock:
+        out = dict(_stats)
+    out["backend"] = BACKEND
+    return out
@@ -0,0 +1,192 @@
+"""
+Per-(model, endpoint) circuit breakers for Vertex image calls.
+
+When a model starts returning 5xx, every page in every session used to
+retry it three times with 5/15/40s sleeps before moving on, so one sick
+model could add over a minute per page. A breaker watches the recent
+error rate of each (model, endpoint) pair:
+
+  closed     — normal; outcomes are recorded in a sliding window.
+  open       — error rate crossed the threshold; calls skip straight to
+               the next fallback model until the cool-down passes.
+  half_open  — cool-down over; exactly one trial call is let through.
+               Success closes the breaker, failure re-opens it.
+
+Only server-side trouble (5xx, timeouts, connection errors) counts as a
+failure. 429s belong to rate_limiter and 404/403s to model_registry.
+
+Every state transition is logged as a `breaker_transition` analytics
+event so the admin dashboard can show them.
+
+Tunables (env vars):
+  BREAKER_WINDOW_S      — sliding window for the error rate (default 120)
+  BREAKER_MIN_REQUESTS  — outcomes needed in the window before tripping (default 4)
+  BREAKER_ERROR_RATE    — failure fraction that trips the breaker (default 0.5)
+  BREAKER_OPEN_S        — cool-down before the half-open trial (default 60)
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+WINDOW_S = float(os.environ.get("BREAKER_WINDOW_S", "120"))
+MIN_REQUESTS = int(os.environ.get("BREAKER_MIN_REQUESTS", "4"))
+ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+OPEN_S = float(os.environ.get("BREAKER_OPEN_S", "60"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, model: str, endpoint: str):
+        self.model = model
+        self.endpoint = endpoint
+        self.state = CLOSED
+        self.outcomes = deque()     # (monotonic ts, ok)
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.trial_started = 0.0
+        self.lock = threading.Lock()
+
+    def _prune(self, now: float) -> None:
+        while self.outcomes and now - self.outcomes[0][0] > WINDOW_S:
+            self.outcomes.popleft()
+
+    def _error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def allow(self):
+        """Return (allowed, transition) — transition is (from, to) or None."""
+        with self.lock:
+            if self.state == CLOSED:
+                return True, None
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < OPEN_S:
+                    return False, None
+                self.state = HALF_OPEN
+                self.trial_in_flight = True
+                self.trial_started = now
+                return True, (OPEN, HALF_OPEN)
+            # HALF_OPEN: only the single trial call goes through. A trial
+            # that ended without a verdict (429, 404) is replaced after
+            # one cool-down so the breaker can't wedge half-open.
+            if self.trial_in_flight and now - self.trial_started < OPEN_S:
+                return False, None
+            self.trial_in_flight = True
+            self.trial_started = now
+            return True, None
+
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.state == OPEN
+
+    def record(self, ok: bool):
+        """Record an outcome. Returns (from, to) if the state changed."""
+        with self.lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = False
+                self.outcomes.clear()
+                if ok:
+                    self.state = CLOSED
+                    return HALF_OPEN, CLOSED
+                self.state = OPEN
+                self.opened_at = now
+                return HALF_OPEN, OPEN
+            self.outcomes.append((now, ok))
+            self._prune(now)
+            if (
+                self.state == CLOSED
+                and not ok
+                and len(self.outcomes) >= MIN_REQUESTS
+                and self._error_rate() >= ERROR_RATE
+            ):
+                self.state = OPEN
+                self.opened_at = now
+                return CLOSED, OPEN
+            return None
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            self._prune(time.monotonic())
+            return {
+                "model": self.model,
+                "endpoint": self.endpoint,
+                "state": self.state,
+                "window_requests": len(self.outcomes),
+                "error_rate": round(self._error_rate(), 2),
+            }
+
+
+_breakers: dict = {}
+_lock = threading.Lock()
+
+
+def _breaker(model: str, endpoint: str) -> CircuitBreaker:
+    key = (model, endpoint)
+    with _lock:
+        b = _breakers.get(key)
+        if b is None:
+            b = CircuitBreaker(model, endpoint)
+            _breakers[key] = b
+        return b
+
+
+def _log_transition(b: CircuitBreaker, transition) -> None:
+    if not transition:
+        return
+    frm, to = transition
+    logger.warning(f"circuit_breaker: {b.model} @ {b.endpoint} {frm} -> {to}")
+    snap = b.snapshot()
+
+    def _emit():
+        try:
+            import analytics
+            analytics.log_event(
+                analytics.BREAKER_TRANSITION,
+                model=b.model, endpoint=b.endpoint, from_state=frm, to_state=to,
+                error_rate=snap["error_rate"],
+            )
+        except Exception as e:
+            logger.debug(f"breaker event log failed: {e}")
+
+    # Never hold up the image request on the Mongo insert.
+    threading.Thread(target=_emit, daemon=True).start()
+
+
+def allow(model: str, endpoint: str) -> bool:
+    """Whether a call to (model, endpoint) may go out right now."""
+    b = _breaker(model, endpoint)
+    allowed, transition = b.allow()
+    _log_transition(b, transition)
+    return allowed
+
+
+def is_open(model: str, endpoint: str) -> bool:
+    return _breaker(model, endpoint).is_open()
+
+
+def record_success(model: str, endpoint: str) -> None:
+    b = _breaker(model, endpoint)
+    _log_transition(b, b.record(True))
+
+
+def record_failure(model: str, endpoint: str) -> None:
+    b = _breaker(model, endpoint)
+    _log_transition(b, b.record(False))
+
+
+def states() -> list:
+    """Current breaker states in this process (admin dashboard)."""
+    with _lock:
+        breakers = list(_breakers.values())
+    return [b.snapshot() for b in sorted(breakers, key=lambda b: (b.model, b.endpoint))]
@@ -0,0 +1,110 @@
+"""
+Time budgets for book builds.
+
+Image retries are layered and multiply: an outer pass in the caller,
+three attempts per model in vertex_client across several Gemini models,
+two endpoints and Imagen, each request allowed 180s. One failing page
+could hold a build for many minutes while the customer watched a
+spinner.
+
+A Deadline is created once per build (template `_build_and_show`,
+`generate_template_book`, the wizard's Step 2 batch) and handed down.
+Every layer asks it before starting more work:
+
+  can_start()        — is there still room for another request?
+  timeout(cap)       — request timeout, shrunk to what is left
+  sleep(s)           — back-off, cut short so a request still fits after
+  wait_budget(cap)   — how long a quota queue may block
+  child(s)           — a sub-budget (one page) that never outlives its parent
+
+When the budget is spent the call gives up with what it has; builds ship
+the pages that finished and leave the rest for the usual regenerate path.
+
+Tunables (env vars):
+  BOOK_DEADLINE_S      — budget for one book build (default 900)
+  PAGE_DEADLINE_S      — budget for one page image, retries included (default 240)
+  DEADLINE_MIN_CALL_S  — don't start a request with less than this left (default 15)
+"""
+
+import os
+import time
+import asyncio
+from typing import Optional
+
+BOOK_DEADLINE_S = float(os.environ.get("BOOK_DEADLINE_S", "900"))
+PAGE_DEADLINE_S = float(os.environ.get("PAGE_DEADLINE_S", "240"))
+MIN_CALL_S = float(os.environ.get("DEADLINE_MIN_CALL_S", "15"))
+
+
+class Deadline:
+    __slots__ = ("label", "budget_s", "started", "_expires")
+
+    def __init__(self, budget_s: Optional[float] = None, label: str = ""):
+        """budget_s=None (or <= 0) means no limit."""
+        self.label = label
+        self.budget_s = budget_s if budget_s and budget_s > 0 else None
+        self.started = time.monotonic()
+        self._expires = self.started + self.budget_s if self.budget_s else None
+
+    @classmethod
+    def for_book(cls, label: str = "book") -> "Deadline":
+        return cls(BOOK_DEADLINE_S, label)
+
+    def child(self, budget_s: Optional[float] = None, label: str = "") -> "Deadline":
+        """Sub-budget starting now, capped by this one (default PAGE_DEADLINE_S)."""
+        budget = PAGE_DEADLINE_S if budget_s is None else budget_s
+        if self._expires is not None:
+            budget = min(budget, self.remaining()) if budget else self.remaining()
+            budget = max(budget, 0.001)
+        return Deadline(budget, label or self.label)
+
+    def remaining(self) -> float:
+        if self._expires is None:
+            return float("inf")
+        return max(0.0, self._expires - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def can_start(self, min_s: Optional[float] = None) -> bool:
+        return self.remaining() >= (MIN_CALL_S if min_s is None else min_s)
+
+    def timeout(self, cap: float) -> float:
+        return max(1.0, min(cap, self.remaining()))
+
+    def wait_budget(self, cap: float) -> float:
+        """How long we may block (queue, back-off) and still fit a request."""
+        return max(0.0, min(cap, self.remaining() - MIN_CALL_S))
+
+    def sleep(self, seconds: float) -> bool:
+        """Back off for up to `seconds`. False (and no sleep) if there is
+        no time left to make another request afterwards."""
+        room = self.wait_budget(seconds)
+        if room <= 0 and seconds > 0:
+            return False
+        time.sleep(room)
+        return True
+
+    async def sleep_async(self, seconds: float) -> bool:
+        """sleep() for asyncio callers (vertex_async)."""
+        room = self.wait_budget(seconds)
+        if room <= 0 and seconds > 0:
+            return False
+        await asyncio.sleep(room)
+        return True
+
+    def describe(self) -> str:
+        name = self.label or "time"
+        if self.budget_s is None:
+            return f"{name} budget: unlimited"
+        return f"{name} budget {self.budget_s:.0f}s, {self.remaining():.0f}s left"
+
+    def __repr__(self) -> str:
+        return f"Deadline({self.describe()})"
+
+
+# Shared "no limit" instance for callers that weren't given a deadline
+NO_DEADLINE = Deadline(None, "unbounded")
@@ -0,0 +1,127 @@
+"""
+Shared keep-alive HTTP sessions — one connection pool per host.
+
+Every backend call (Vertex, OpenRouter, Cashfree) goes through here so
+repeated calls to the same host reuse an open TCP+TLS connection instead
+of paying a fresh handshake each time. Sessions are created lazily and are
+shared between the image worker threads and every user's session, so they
+must not carry per-request state: urllib3's connection pools are
+thread-safe, and the cookie jar rejects every cookie (a Set-Cookie from
+one call — say a Cashfree order for one customer — would otherwise ride
+along on everyone's next request to that host). Callers pass auth and
+headers per request; nothing is set on the Session itself.
+
+Tunables (env vars):
+  HTTP_POOL_MAXSIZE       — connections kept per host (default: 2 × IMAGE_CONCURRENCY_MAX, min 4)
+  HTTP_CONNECT_TIMEOUT    — seconds to establish a connection (default 10)
+  HTTP_READ_TIMEOUT       — default read timeout when a caller gives none (default 60)
+"""
+
+import os
+import logging
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+_IMAGE_CONCURRENCY_MAX = int(os.environ.get("IMAGE_CONCURRENCY_MAX", "8"))
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "0")) or max(4, 2 * _IMAGE_CONCURRENCY_MAX)
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "60"))
+
+_sessions: dict = {}          # "scheme://host" -> requests.Session
+_requests_by_host: dict = {}  # "scheme://host" -> int
+_lock = threading.Lock()
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url: str) -> requests.Session:
+    """Return the shared Session for the host of `url`, creating it once."""
+    key = _host_key(url)
+    sess = _sessions.get(key)
+    if sess is not None:
+        return sess
+    with _lock:
+        sess = _sessions.get(key)
+        if sess is None:
+            sess = requests.Session()
+            # Shared across users: never store a cookie.
+            sess.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            # Our callers run their own retry loops; keep urllib3's off.
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=0
+            )
+            sess.mount(key, adapter)
+            _sessions[key] = sess
+            logger.info(f"HTTP pool created for {key} (maxsize={POOL_MAXSIZE})")
+        return sess
+
+
+def _timeout(timeout) -> tuple:
+    """Normalise a caller timeout to (connect, read)."""
+    if timeout is None:
+        return (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if isinstance(timeout, tuple):
+        return timeout
+    return (min(CONNECT_TIMEOUT, float(timeout)), float(timeout))
+
+
+def request(method: str, url: str, timeout=None, **kwargs) -> requests.Response:
+    key = _host_key(url)
+    with _lock:
+        _requests_by_host[key] = _requests_by_host.get(key, 0) + 1
+    return get_session(url).request(method, url, timeout=_timeout(timeout), **kwargs)
+
+
+def post(url: str, timeout=None, **kwargs) -> requests.Response:
+    """Drop-in for requests.post that reuses the host's pooled connection."""
+    return request("POST", url, timeout=timeout, **kwargs)
+
+
+def get(url: str, timeout=None, **kwargs) -> requests.Response:
+    """Drop-in for requests.get that reuses the host's pooled connection."""
+    return request("GET", url, timeout=timeout, **kwargs)
+
+
+def _connections_opened(sess: requests.Session) -> Optional[int]:
+    """Total connections urllib3 has opened for this session's pools."""
+    try:
+        total = 0
+        for adapter in sess.adapters.values():
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    total += pool.num_connections
+        return total
+    except Exception:
+        return None
+
+
+def pool_stats() -> dict:
+    """Per-host request and connection counters (admin panel).
+
+    `reused` is requests that went out over an already-open connection.
+    """
+    with _lock:
+        items = list(_sessions.items())
+        counts = dict(_requests_by_host)
+    out = {}
+    for key, sess in items:
+        reqs = counts.get(key, 0)
+        opened = _connections_opened(sess)
+        out[key] = {
+            "requests": reqs,
+            "connections_opened": opened if opened is not None else "?",
+            "reused": max(0, reqs - opened) if opened is not None else "?",
+        }
+    return out
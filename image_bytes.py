@@ -0,0 +1,204 @@
+"""
+Bytes-first image handling for the generation pipeline.
+
+An image used to be converted over and over on its way from Vertex to
+Mongo: base64 JSON → data URL string → decoded bytes → PIL → JPEG bytes →
+base64 → data URL, and the reverse on load. `_save_images_now` re-runs the
+whole PIL → JPEG → base64 leg for every page after each new image, so a
+12-page book re-encoded ~78 full-size images while generating.
+
+`EncodedImage` holds the encoded bytes once, with their format and
+dimensions (read from the header, no pixel decode), and produces a PIL
+image, base64 string or data URL lazily — each at most once. The storage
+rendition (JPEG, ≤768px) is computed once and cached on the object, as
+are the display renditions named in ROLES (thumb, card, preview, print).
+
+Most of the UI still works on PIL images held in session state, so the
+encoding travels with the PIL image: `attach()` pins an EncodedImage to
+the PIL object it was decoded from and `encoded_of()` finds it again.
+Any derived image (convert, resize, copy) is a new object with nothing
+attached, so a stale encoding is never reused.
+"""
+
+import io
+import base64
+import logging
+import threading
+from typing import Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Attribute used to pin an EncodedImage to the PIL image it describes.
+_ATTR = "_encoded_image"
+
+_MIME = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+class EncodedImage:
+    """Encoded image bytes plus lazily derived forms (PIL, base64, data URL)."""
+
+    __slots__ = ("data", "format", "width", "height", "_pil", "_b64", "_renditions", "_lock")
+
+    def __init__(self, data: bytes, format: str = "", width: int = 0, height: int = 0):
+        self.data = data
+        self.format = format
+        self.width = width
+        self.height = height
+        self._pil = None
+        self._b64 = None
+        self._renditions = {}
+        self._lock = threading.Lock()
+        if not (format and width and height):
+            # Image.open only parses the header; pixels are decoded on .load()
+            with Image.open(io.BytesIO(data)) as probe:
+                self.format = format or (probe.format or "PNG")
+                self.width, self.height = probe.size
+
+    # -- constructors -----------------------------------------------------
+
+    @classmethod
+    def from_b64(cls, b64: str) -> "EncodedImage":
+        img = cls(base64.b64decode(b64))
+        img._b64 = b64
+        return img
+
+    @classmethod
+    def from_data_url(cls, url: str) -> Optional["EncodedImage"]:
+        if not url or not isinstance(url, str) or not url.startswith("data:image"):
+            return None
+        return cls.from_b64(url.split(",", 1)[-1])
+
+    @classmethod
+    def from_pil(cls, img: Image.Image, format: str = "JPEG", quality: int = 85) -> "EncodedImage":
+        buf = io.BytesIO()
+        src = img.convert("RGB") if format == "JPEG" else img
+        src.save(buf, format=format, quality=quality, optimize=True)
+        enc = cls(buf.getvalue(), format, *src.size)
+        enc._pil = img if img.mode == "RGB" else None
+        return enc
+
+    # -- derived forms ----------------------------------------------------
+
+    @property
+    def mime_type(self) -> str:
+        return _MIME.get(self.format.upper(), "image/png")
+
+    @property
+    def size(self) -> tuple:
+        return self.width, self.height
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.data).decode()
+        return self._b64
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.b64}"
+
+    @property
+    def pil(self) -> Image.Image:
+        """Decoded RGB image, with this encoding attached to it."""
+        if self._pil is None:
+            img = Image.open(io.BytesIO(self.data)).convert("RGB")
+            attach(img, self)
+            self._pil = img
+        return self._pil
+
+    def rendition(self, max_size: int, quality: int = 75) -> "EncodedImage":
+        """JPEG no larger than max_size on its long side, computed once.
+
+        Returns self when this already is a JPEG that fits, so images loaded
+        from storage are never re-encoded on the way back out.
+        """
+        if self.format.upper() == "JPEG" and max(self.size) <= max_size:
+            return self
+        key = (max_size, quality)
+        with self._lock:
+            hit = self._renditions.get(key)
+        if hit is not None:
+            return hit
+        img = self.pil.copy()
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+        out = EncodedImage.from_pil(img, "JPEG", quality)
+        with self._lock:
+            self._renditions[key] = out
+        return out
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f"EncodedImage({self.format} {self.width}x{self.height}, {len(self.data)} bytes)"
+
+
+def attach(img: Image.Image, enc: EncodedImage) -> Image.Image:
+    """Pin `enc` to `img` so later storage/preview steps can reuse its bytes."""
+    try:
+        setattr(img, _ATTR, enc)
+    except Exception:
+        pass
+    return img
+
+
+def encoded_of(img) -> Optional[EncodedImage]:
+    """The EncodedImage pinned to a PIL image, if any."""
+    if isinstance(img, EncodedImage):
+        return img
+    return getattr(img, _ATTR, None)
+
+
+def ensure_encoded(img: Image.Image, format: str = "JPEG", quality: int = 85) -> EncodedImage:
+    """Pinned encoding of `img`, encoding (and pinning) it once if needed."""
+    enc = encoded_of(img)
+    if enc is None:
+        enc = EncodedImage.from_pil(img, format, quality)
+        attach(img, enc)
+    return enc
+
+
+# Named renditions: (max long side in px, JPEG quality). "print" is the
+# full-size encoding itself. Pick the smallest role that fits the slot:
+#   thumb   — My Books list (80px)
+#   card    — gallery/hero covers, sneak-peek columns (~230–300px)
+#   preview — full-width page cards in the book preview
+#   print   — PDF pages
+ROLES = {
+    "thumb": (160, 70),
+    "card": (480, 75),
+    "preview": (900, 85),
+    "print": (0, 92),
+}
+
+
+def for_role(img, role: str) -> Optional[EncodedImage]:
+    """The `role` rendition of a PIL image (or EncodedImage), computed once
+    and cached on its encoding."""
+    if img is None:
+        return None
+    max_size, quality = ROLES[role]
+    enc = img if isinstance(img, EncodedImage) else ensure_encoded(img, "JPEG", 92)
+    return enc if not max_size else enc.rendition(max_size, quality)
+
+
+def role_data_url(img, role: str) -> Optional[str]:
+    enc = for_role(img, role)
+    return enc.data_url if enc is not None else None
+
+
+def storage_data_url(img, max_size: int = 768, quality: int = 75) -> Optional[str]:
+    """JPEG data URL for Mongo storage; cached, so repeat saves cost nothing."""
+    if img is None:
+        return None
+    # Images from Vertex or storage already carry their bytes; anything
+    # else (placeholders, legacy paths) is encoded once at high quality.
+    return ensure_encoded(img, "JPEG", 92).rendition(max_size, quality).data_url
+
+
+def decode_data_url(url) -> Optional[Image.Image]:
+    """PIL image for a stored data URL, with its bytes attached for re-saving."""
+    enc = EncodedImage.from_data_url(url)
+    return enc.pil if enc is not None else None
@@ -0,0 +1,285 @@
+"""
+Content-addressed cache for generated images.
+
+The same fully-assembled image prompt gets rendered again and again:
+Streamlit reruns, regenerate clicks that revert an edited prompt, and the
+same template page built for many customers. `image_pool` only dedupes
+template pages by (template, page, age group, gender). This cache sits in
+front of `vertex_client.generate_image` and is keyed on a hash of
+everything that determines the output:
+
+  - the final prompt (style modifiers and instructions are already in it),
+  - the image model list it would be sent to,
+  - a digest of the reference photo(s), if any.
+
+Two tiers:
+
+  memory — per-process LRU bounded by a byte budget; entries expire after
+           IMAGE_CACHE_MEM_TTL.
+  mongo  — opt-in. The image bytes go to the blob store (blob_store.py,
+           in the private "imgcache" scope) and the `image_cache`
+           collection holds only the ref and metadata. Entries expire
+           IMAGE_CACHE_TTL_DAYS after their last use, and the cache is
+           trimmed least-recently-used-first whenever it grows past its
+           byte budget; both passes delete the blob with the document, so
+           there is no TTL index (it would orphan the blobs).
+
+Deliberate regenerations pass force_fresh=True: the lookup is skipped and
+the new image replaces the cached one.
+
+Tunables (env vars):
+  IMAGE_CACHE             — "0" disables the cache entirely (default on)
+  IMAGE_CACHE_MEM_MB      — in-process byte budget (default 64)
+  IMAGE_CACHE_MEM_TTL     — in-process entry lifetime, seconds (default 3600)
+  IMAGE_CACHE_MONGO       — "1" adds the shared Mongo/blob tier (default off)
+  IMAGE_CACHE_MONGO_MB    — shared tier byte budget (default 256)
+  IMAGE_CACHE_TTL_DAYS    — Mongo entry lifetime since last use (default 30)
+"""
+
+import os
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("IMAGE_CACHE", "1").lower() not in ("0", "false", "no")
+MEM_BUDGET = int(float(os.environ.get("IMAGE_CACHE_MEM_MB", "64")) * 1024 * 1024)
+MEM_TTL_S = float(os.environ.get("IMAGE_CACHE_MEM_TTL", "3600"))
+USE_MONGO = os.environ.get("IMAGE_CACHE_MONGO", "0").lower() in ("1", "true", "yes")
+MONGO_BUDGET = int(float(os.environ.get("IMAGE_CACHE_MONGO_MB", "256")) * 1024 * 1024)
+TTL_DAYS = float(os.environ.get("IMAGE_CACHE_TTL_DAYS", "30"))
+
+# Hits only refresh `last_used` in Mongo this often per entry
+_TOUCH_INTERVAL_S = 3600
+# The Mongo byte total is recomputed (and trimmed) every this many puts
+_TRIM_EVERY = 25
+# Blob scope for cached payloads: private to this cache, so trimming may
+# delete them without touching blobs that documents refer to
+_BLOB_SCOPE = "imgcache"
+
+_mem: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (stored_at, entry dict)
+_mem_bytes = 0
+_lock = threading.Lock()
+_puts_since_trim = 0
+_stats = {"mem_hits": 0, "mongo_hits": 0, "misses": 0, "bypassed": 0, "puts": 0,
+          "evictions": 0, "bytes_served": 0}
+
+
+def _digest_refs(reference_image_b64) -> str:
+    if not reference_image_b64:
+        return ""
+    refs = reference_image_b64 if isinstance(reference_image_b64, list) else [reference_image_b64]
+    h = hashlib.sha256()
+    for r in refs:
+        h.update(hashlib.sha256((r or "").encode()).digest())
+    return h.hexdigest()
+
+
+def cache_key(prompt: str, models: str, reference_image_b64=None) -> str:
+    """Content address for one image request."""
+    h = hashlib.sha256()
+    for part in (prompt or "", models or "", _digest_refs(reference_image_b64)):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _mem_get(key: str) -> Optional[dict]:
+    with _lock:
+        hit = _mem.get(key)
+        if hit is None:
+            return None
+        stored_at, entry = hit
+        if time.monotonic() - stored_at > MEM_TTL_S:
+            _mem_drop(key)
+            return None
+        _mem.move_to_end(key)
+        return entry
+
+
+def _mem_drop(key: str) -> None:
+    # caller holds _lock
+    global _mem_bytes
+    _, entry = _mem.pop(key)
+    _mem_bytes -= entry["size"]
+
+
+def _mem_put(key: str, entry: dict) -> None:
+    global _mem_bytes
+    if entry["size"] > MEM_BUDGET:
+        return
+    with _lock:
+        if key in _mem:
+            _mem_drop(key)
+        _mem[key] = (time.monotonic(), entry)
+        _mem_bytes += entry["size"]
+        while _mem_bytes > MEM_BUDGET and _mem:
+            _mem_drop(next(iter(_mem)))
+            _stats["evictions"] += 1
+
+
+def _col():
+    from mongo_client import image_cache_col
+    return image_cache_col()
+
+
+def get(key: str) -> Optional[dict]:
+    """Cached entry {data_b64, mime_type, model, size} or None."""
+    if not ENABLED:
+        return None
+    entry = _mem_get(key)
+    if entry is not None:
+        with _lock:
+            _stats["mem_hits"] += 1
+            _stats["bytes_served"] += entry["size"]
+        return entry
+    if USE_MONGO:
+        try:
+            # Expired docs wait for the next trim pass; they are misses now
+            doc = _col().find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        except Exception as e:
+            logger.debug(f"image_cache mongo get failed: {e}")
+            doc = None
+        raw = _payload(doc) if doc else None
+        if raw:
+            entry = {
+                "data_b64": base64.b64encode(raw).decode(),
+                "mime_type": doc.get("mime_type", "image/png"),
+                "model": doc.get("model", ""),
+                "size": len(raw),
+            }
+            _mem_put(key, entry)
+            with _lock:
+                _stats["mongo_hits"] += 1
+                _stats["bytes_served"] += entry["size"]
+            _touch(key, doc)
+            return entry
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+
+def _payload(doc: dict) -> Optional[bytes]:
+    if doc.get("ref"):
+        import blob_store
+        return blob_store.get(doc["ref"])   # None (a miss) if the blob is gone
+    if doc.get("data"):
+        return bytes(doc["data"])           # written before payloads moved to blobs
+    return None
+
+
+def note_bypass() -> None:
+    with _lock:
+        _stats["bypassed"] += 1
+
+
+def _touch(key: str, doc: dict) -> None:
+    last = doc.get("last_used")
+    if last is not None and last.tzinfo is None:
+        last = last.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    if last is not None and (now - last).total_seconds() < _TOUCH_INTERVAL_S:
+        return
+    try:
+        _col().update_one(
+            {"_id": key},
+            {"$set": {"last_used": now, "expires_at": now + timedelta(days=TTL_DAYS)},
+             "$inc": {"hits": 1}},
+        )
+    except Exception as e:
+        logger.debug(f"image_cache touch failed: {e}")
+
+
+def put(key: str, data_b64: str, mime_type: str = "image/png", model: str = "") -> None:
+    """Store a freshly generated image in both tiers (best-effort)."""
+    global _puts_since_trim
+    if not ENABLED or not data_b64:
+        return
+    raw = base64.b64decode(data_b64)
+    entry = {"data_b64": data_b64, "mime_type": mime_type, "model": model, "size": len(raw)}
+    _mem_put(key, entry)
+    with _lock:
+        _stats["puts"] += 1
+        _puts_since_trim += 1
+        trim = _puts_since_trim >= _TRIM_EVERY
+        if trim:
+            _puts_since_trim = 0
+    if not USE_MONGO:
+        return
+    import blob_store
+    if not blob_store.enabled():
+        return
+    try:
+        ref = blob_store.put(raw, renditions=False, scope=_BLOB_SCOPE)
+    except Exception as e:
+        logger.debug(f"image_cache blob put failed: {e}")
+        return
+    now = datetime.now(timezone.utc)
+    try:
+        _col().replace_one(
+            {"_id": key},
+            {"ref": ref, "mime_type": mime_type, "model": model, "size": len(raw),
+             "created_at": now, "last_used": now, "hits": 0,
+             "expires_at": now + timedelta(days=TTL_DAYS)},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.debug(f"image_cache mongo put failed: {e}")
+        return
+    if trim:
+        threading.Thread(target=_trim_mongo, daemon=True, name="image-cache-trim").start()
+
+
+def _drop_entries(col, docs: list) -> int:
+    """Delete cache docs and then their blobs; returns how many went."""
+    import blob_store
+    if not docs:
+        return 0
+    col.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+    for d in docs:
+        if d.get("ref"):
+            blob_store.delete(d["ref"])
+    return len(docs)
+
+
+def _trim_mongo() -> None:
+    """Drop expired entries, then least-recently-used ones until the cache
+    fits its budget."""
+    try:
+        col = _col()
+        now = datetime.now(timezone.utc)
+        expired = _drop_entries(col, list(col.find({"expires_at": {"$lt": now}}, {"ref": 1})))
+        total = next(col.aggregate([{"$group": {"_id": None, "n": {"$sum": "$size"}}}]), {}).get("n", 0)
+        victims = []
+        if total > MONGO_BUDGET:
+            excess = total - MONGO_BUDGET
+            for d in col.find({}, {"size": 1, "ref": 1}).sort("last_used", 1):
+                victims.append(d)
+                excess -= d.get("size", 0)
+                if excess <= 0:
+                    break
+        dropped = expired + _drop_entries(col, victims)
+        if dropped:
+            with _lock:
+                _stats["evictions"] += dropped
+            logger.info(f"image_cache: trimmed {dropped} entries ({expired} expired) from Mongo")
+    except Exception as e:
+        logger.debug(f"image_cache trim failed: {e}")
+
+
+def cache_stats() -> dict:
+    """Counters for the admin panel."""
+    with _lock:
+        out = dict(_stats)
+        out["mem_entries"] = len(_mem)
+        out["mem_mb"] = round(_mem_bytes / 1024 / 1024, 1)
+    lookups = out["mem_hits"] + out["mongo_hits"] + out["misses"]
+    out["hit_rate"] = round((out["mem_hits"] + out["mongo_hits"]) / lookups, 2) if lookups else 0.0
+    out["mode"] = ("mongo+memory" if USE_MONGO else "memory") if ENABLED else "off"
+    return out
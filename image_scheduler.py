@@ -0,0 +1,227 @@
+"""
+Pipelined per-page image scheduler for the custom-story wizard.
+
+Step 2 used to start only once the whole story had been generated and
+approved, then submit every page to a fresh thread pool and block until
+all of them finished. Story writing and illustration ran back to back.
+
+A PageImageScheduler lives in the user's session across reruns and takes
+pages one at a time — as they stream out of the story model, when the
+story is approved, or when a page is edited — and dispatches each image
+job straight away on a bounded pool. Each job is tagged with a key over
+its page's prompt and the worker's positional args (style, reference
+photos, ...), i.e. everything that changes the picture; keyword args are
+per-dispatch context (deadlines, hedging) and are not part of it.
+Submitting a page again with the same key is a no-op; with a different
+one the stale job is cancelled (dropped if still queued, its result
+discarded if already running) and a new one is issued.
+
+Speculative submissions (pages queued before the reader reaches Step 2)
+are capped at `max_speculative` unfinished jobs; the rest are simply
+submitted when Step 2 asks for them.
+
+When Step 2 renders, it asks for the jobs it needs: pages rendered
+speculatively are already done or in flight, and only the rest are
+submitted. Results are taken exactly once, so a page the user rejects
+is re-rendered rather than served the same image again.
+
+Template builds (`template_flow._build_and_show`) use a short-lived one
+to fill pages Template Studio hasn't pre-rendered yet.
+
+The pool is shut down by shutdown() (new story, logout) or, for a
+session that is simply abandoned, when the scheduler is garbage-collected.
+
+Workers must not touch st.* — they run off the script thread.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _feed(h, value) -> None:
+    if isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for v in value:
+            _feed(h, v)
+        h.update(b"]")
+    else:
+        h.update(("" if value is None else str(value)).encode())
+        h.update(b"\0")
+
+
+def job_key(prompt: str, *args) -> str:
+    """Identity of a render: the prompt plus the worker's positional args."""
+    h = hashlib.sha256()
+    _feed(h, [prompt or "", *args])
+    return h.hexdigest()[:16]
+
+
+class JobCancelled(Exception):
+    """Yielded by as_completed() for a page whose job was cancelled or
+    reissued with another prompt before it finished."""
+
+    def __init__(self, idx: int, reason: str):
+        super().__init__(f"page {idx + 1} {reason} before it finished")
+        self.idx = idx
+        self.reason = reason
+
+
+class _Job:
+    __slots__ = ("key", "future", "submitted_at", "speculative")
+
+    def __init__(self, key: str, future: Future, speculative: bool = False):
+        self.key = key
+        self.future = future
+        self.submitted_at = time.monotonic()
+        self.speculative = speculative
+
+
+class PageImageScheduler:
+    def __init__(self, worker: Callable, max_workers: int = 3,
+                 max_speculative: Optional[int] = None):
+        """`worker(prompt, *args, **kwargs)` renders one page; its return
+        value is handed back untouched by take()/as_completed()."""
+        self._worker = worker
+        self._max_workers = max(1, int(max_workers))
+        self._max_speculative = self._max_workers if max_speculative is None else max(0, int(max_speculative))
+        self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="page-img")
+        # Abandoned sessions never call shutdown(); don't leak their threads.
+        weakref.finalize(self, self._pool.shutdown, wait=False, cancel_futures=True)
+        self._jobs: Dict[int, _Job] = {}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "reused": 0, "cancelled": 0, "reissued": 0,
+                       "speculative_skipped": 0}
+
+    def submit(self, idx: int, prompt: str, *args, speculative: bool = False, **kwargs) -> bool:
+        """Ensure page `idx` is being rendered from `prompt` and `args`.
+
+        Returns True if a new job was dispatched, False if a job with the
+        same key already exists — or, for a speculative submit, if the
+        speculative cap is reached.
+        """
+        key = job_key(prompt, *args)
+        with self._lock:
+            job = self._jobs.get(idx)
+            if job is not None and job.key == key:
+                self._stats["reused"] += 1
+                return False
+            if speculative:
+                live = sum(1 for j in self._jobs.values()
+                           if j.speculative and not j.future.done() and j is not job)
+                if live >= self._max_speculative:
+                    self._stats["speculative_skipped"] += 1
+                    return False
+            if job is not None:
+                job.future.cancel()
+                self._stats["reissued"] += 1
+                logger.info(f"image_scheduler: page {idx + 1} prompt changed — reissuing")
+            fut = self._pool.submit(self._worker, prompt, *args, **kwargs)
+            self._jobs[idx] = _Job(key, fut, speculative)
+            self._stats["submitted"] += 1
+        return True
+
+    def cancel(self, idx: int) -> None:
+        with self._lock:
+            job = self._jobs.pop(idx, None)
+            if job is not None:
+                job.future.cancel()
+                self._stats["cancelled"] += 1
+
+    def reset(self) -> None:
+        """Drop every job (new story)."""
+        with self._lock:
+            for job in self._jobs.values():
+                job.future.cancel()
+            self._stats["cancelled"] += len(self._jobs)
+            self._jobs.clear()
+
+    def retain(self, indices) -> None:
+        """Cancel jobs for pages that no longer exist (story got shorter)."""
+        keep = set(indices)
+        for idx in [i for i in list(self._jobs) if i not in keep]:
+            self.cancel(idx)
+
+    def take(self, idx: int, prompt: str, *args):
+        """Result for `idx` if its job for `prompt` / `args` has finished,
+        else None. A taken result is forgotten."""
+        with self._lock:
+            job = self._jobs.get(idx)
+            if job is None or job.key != job_key(prompt, *args) or not job.future.done():
+                return None
+            del self._jobs[idx]
+        return job.future.result()
+
+    def as_completed(self, items: List[Tuple[int, str]], *args, until=None,
+                     **kwargs) -> Iterator[Tuple[int, object]]:
+        """Submit whatever `items` (idx, prompt) still need, then yield
+        (idx, result) as each finishes — already-finished pages first.
+
+        A worker exception is yielded in place of the result, and so is a
+        JobCancelled for a page that is cancelled or resubmitted with
+        another prompt meanwhile. With `until` (a deadlines.Deadline) the
+        wait stops once it expires; unfinished jobs stay in flight.
+        """
+        for idx, prompt in items:
+            self.submit(idx, prompt, *args, **kwargs)
+        want = {idx: job_key(prompt, *args) for idx, prompt in items}
+        while want:
+            if until is not None and until.expired():
+                logger.warning(f"image_scheduler: {until.describe()} — {len(want)} page(s) unfinished")
+                return
+            gone = []
+            with self._lock:
+                futs = {}
+                for idx, key in want.items():
+                    job = self._jobs.get(idx)
+                    if job is None or job.future.cancelled():
+                        gone.append((idx, "was cancelled"))
+                    elif job.key != key:
+                        gone.append((idx, "was reissued with a new prompt"))
+                    else:
+                        futs[job.future] = idx
+            for idx, reason in gone:
+                want.pop(idx)
+                yield idx, JobCancelled(idx, reason)
+            if not futs:
+                continue
+            done, _ = wait(list(futs), return_when=FIRST_COMPLETED,
+                           timeout=None if until is None else until.remaining())
+            for fut in done:
+                idx = futs[fut]
+                with self._lock:
+                    job = self._jobs.get(idx)
+                    if job is None or job.future is not fut:
+                        continue
+                    del self._jobs[idx]
+                want.pop(idx, None)
+                if fut.cancelled():
+                    yield idx, JobCancelled(idx, "was cancelled")
+                    continue
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    result = e
+                yield idx, result
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if not j.future.done())
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["in_flight"] = sum(1 for j in self._jobs.values() if not j.future.done())
+            out["ready"] = sum(1 for j in self._jobs.values() if j.future.done())
+            out["max_workers"] = self._max_workers
+        return out
+
+    def shutdown(self) -> None:
+        self.reset()
+        self._pool.shutdown(wait=False, cancel_futures=True)
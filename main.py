@@ -14,7 +14,13 @@ import logging
 from pathlib import Path
 from typing import List, Dict, Optional
 from reportlab.lib.units import inch
-import requests
+import adaptive_concurrency
+import blob_store
+import deadlines
+import http_pool
+import image_bytes
+from image_scheduler import JobCancelled
+import retry_budget
 from datetime import datetime, timedelta
 
 # Import age-specific prompts from the editable prompts file
@@ -77,6 +83,9 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+
+# Overridable so load tests can point at scripts/stub_backends.py
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -86,7 +95,6 @@ from reportlab.lib.colors import HexColor, black, white
 from PIL import Image
 import io
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Page configuration
 st.set_page_config(
@@ -301,51 +309,42 @@ def _assemble_image_prompt(page: dict, visual_anchor: str, book_format: dict = N
 
 
 def compress_pil_images_for_storage(images: list, max_size: int = 768, quality: int = 75) -> list:
-    """Compress a list of PIL Images to base64 JPEG data URLs for Supabase storage."""
+    """Compress a list of PIL Images to base64 JPEG data URLs for Supabase storage.
+
+    The storage encoding is cached on each image (see image_bytes), so the
+    per-image saves during generation only encode the new page.
+    """
     result = []
     for img in images:
         if img is None:
             result.append(None)
             continue
         try:
-            buf = io.BytesIO()
-            img_copy = img.convert("RGB")
-            img_copy.thumbnail((max_size, max_size), Image.LANCZOS)
-            img_copy.save(buf, format="JPEG", quality=quality, optimize=True)
-            b64 = base64.b64encode(buf.getvalue()).decode()
-            result.append(f"data:image/jpeg;base64,{b64}")
+            result.append(image_bytes.storage_data_url(img, max_size, quality))
         except Exception as e:
             logger.warning(f"Image compression failed: {e}")
             result.append(None)
     return result
 
 
-def _make_cover_thumbnail(img, max_size: int = 300, quality: int = 70) -> str:
-    """Create a small base64 JPEG thumbnail from a PIL Image for cover display."""
+def _make_cover_thumbnail(img) -> str:
+    """Cover for gallery cards: the image's "card" rendition, as a data URL."""
     if img is None:
         return ""
     try:
-        buf = io.BytesIO()
-        img_copy = img.convert("RGB")
-        img_copy.thumbnail((max_size, max_size), Image.LANCZOS)
-        img_copy.save(buf, format="JPEG", quality=quality, optimize=True)
-        b64 = base64.b64encode(buf.getvalue()).decode()
-        return f"data:image/jpeg;base64,{b64}"
+        return image_bytes.role_data_url(img, "card")
     except Exception:
         return ""
 
 
 def decode_stored_images(images_data: list) -> list:
-    """Decode a list of base64 data URLs back to PIL Images."""
+    """Decode stored images (blob refs or base64 data URLs) back to PIL Images."""
     result = []
-    for url in (images_data or []):
-        if url and isinstance(url, str) and url.startswith("data:image"):
-            try:
-                raw = base64.b64decode(url.split(",", 1)[-1])
-                result.append(Image.open(io.BytesIO(raw)).convert("RGB"))
-            except Exception:
-                result.append(None)
-        else:
+    # One batched blob read for the whole book instead of one per page
+    for url in blob_store.resolve_many(images_data or []):
+        try:
+            result.append(image_bytes.decode_data_url(url))
+        except Exception:
             result.append(None)
     return result
 
@@ -397,6 +396,17 @@ def create_visual_anchor(child_name: str, age: int, gender: str, physical_desc:
     return base_anchor
 
 
+def _text_cache_scope() -> str:
+    """Per-user scope for text_cache; anonymous sessions get their own."""
+    uid = get_current_user_id()
+    if uid:
+        return uid
+    if "_text_cache_scope" not in st.session_state:
+        import uuid as _uuid
+        st.session_state._text_cache_scope = f"anon:{_uuid.uuid4().hex}"
+    return st.session_state._text_cache_scope
+
+
 def _stringify_keys(d):
     """Convert dict with integer keys to string keys for MongoDB compatibility."""
     if not isinstance(d, dict):
@@ -415,7 +425,7 @@ def _save_images_now() -> None:
         return
     try:
         from mongo_client import book_history_col
-        images_for_db = compress_pil_images_for_storage(imgs)
+        images_for_db = blob_store.offload(compress_pil_images_for_storage(imgs))
         journey_state = {
             "story_approved": st.session_state.get("story_approved", False),
             "all_images_approved": st.session_state.get("all_images_approved", False),
@@ -426,7 +436,9 @@ def _save_images_now() -> None:
         }
         book_history_col().update_one(
             {"_id": existing_id, "user_id": user_id},
-            {"$set": {"images": images_for_db, "metadata.journey_state": journey_state}},
+            {"$set": {"images": images_for_db,
+                      "image_fingerprints": _fingerprints_for_storage(imgs),
+                      "metadata.journey_state": journey_state}},
         )
         logger.info(f"Images saved incrementally: {len(images_for_db)} entries")
     except Exception as _e:
@@ -462,9 +474,9 @@ def save_story(story_data: Dict, child_name: str, metadata: Dict = None):
                 import uuid as _uuid
                 col = book_history_col()
                 story_for_db = json.loads(json.dumps(story_data))
-                images_for_db = compress_pil_images_for_storage(
+                images_for_db = blob_store.offload(compress_pil_images_for_storage(
                     st.session_state.get("generated_images", [])
-                ) if st.session_state.get("generated_images") else []
+                )) if st.session_state.get("generated_images") else []
 
                 existing_id = st.session_state.get("current_book_history_id")
                 if existing_id:
@@ -477,6 +489,7 @@ def save_story(story_data: Dict, child_name: str, metadata: Dict = None):
                         "user_id": user_id,
                         "story_data": story_for_db,
                         "images": images_for_db,
+                        "image_fingerprints": _fingerprints_for_storage(gen_imgs),
                         "cover_thumbnail": cover_thumb,
                         "metadata.timestamp": timestamp,
                         "metadata.journey_state": journey_state,
@@ -507,6 +520,7 @@ def save_story(story_data: Dict, child_name: str, metadata: Dict = None):
                         "cover_thumbnail": cover_thumb,
                         "story_data": story_for_db,
                         "images": images_for_db,
+                        "image_fingerprints": _fingerprints_for_storage(gen_imgs),
                         "is_private": has_ref_photo,
                         "metadata": {**(metadata or {}), "timestamp": timestamp, "journey_state": journey_state},
                         "created_at": datetime.utcnow(),
@@ -670,6 +684,30 @@ def load_story(filepath) -> Dict:
                 st.code(traceback.format_exc())
         return None
 
+def _book_covers(rows: list, role: str) -> list:
+    """Cover data URL per book_history row (projected with cover_thumbnail
+    and `images: {"$slice": 1}`): the first page's `role` rendition, read
+    for every row in one batch, else the stored cover thumbnail."""
+    firsts = [
+        next((im for im in (r.get("images") or [])
+              if isinstance(im, str) and im.startswith(("data:image", "blob:"))), None)
+        for r in rows
+    ]
+    resolved = blob_store.resolve_many(
+        firsts, only=[i for i, f in enumerate(firsts) if blob_store.is_ref(f)], role=role,
+    )
+    out = []
+    for row, first, res in zip(rows, firsts, resolved):
+        cover = row.get("cover_thumbnail")
+        if blob_store.is_ref(first) and res:
+            out.append(res)
+        elif isinstance(cover, str) and cover.startswith("data:image"):
+            out.append(cover)
+        else:
+            out.append(blob_store.resolve(first, role) or "")
+    return out
+
+
 def get_story_history():
     """Get list of all saved stories, combining MongoDB and local files."""
     user_id = get_current_user_id()
@@ -687,7 +725,8 @@ def get_story_history():
                  "template_id": 1, "template_name": 1, "created_at": 1, "metadata": 1,
                  "cover_thumbnail": 1, "images": {"$slice": 1}}
             ).sort("created_at", DESCENDING).limit(100))
-            for row in rows:
+            # 80px slots: the first page's thumb rendition
+            for row, cover in zip(rows, _book_covers(rows, "thumb")):
                 created = row.get("created_at")
                 ts_display = created.strftime("%Y%m%d_%H%M%S") if created else ""
                 stories.append({
@@ -699,9 +738,7 @@ def get_story_history():
                     "book_type": row.get("book_type", "custom"),
                     "template_id": row.get("template_id"),
                     "template_name": row.get("template_name"),
-                    "cover_thumbnail": row.get("cover_thumbnail") or next(
-                        (im for im in (row.get("images") or [])
-                         if isinstance(im, str) and im.startswith("data:image")), ""),
+                    "cover_thumbnail": cover,
                 })
             if stories:
                 logger.info(f"Loaded {len(stories)} stories from MongoDB")
@@ -741,6 +778,7 @@ def reset_story_state():
     st.session_state.current_book_history_id = None
     st.session_state.generated_images = []
     st.session_state.image_generation_errors = {}
+    _drop_page_image_scheduler()
     st.session_state.pdf_path = None
     st.session_state.story_approved = False
     st.session_state.image_approvals = {}
@@ -858,7 +896,8 @@ def regenerate_story_from_page(api_key: str, existing_story: Dict, start_page: i
 CRITICAL: Output ONLY the JSON, no additional text before or after."""
 
         from vertex_client import call_gemini_text
-        response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.8)
+        response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.8,
+                                         cache_scope=_text_cache_scope())
         if response_text is None:
             st.error("❌ Could not regenerate story. Check your API key or Vertex AI credentials.")
             return None
@@ -911,7 +950,7 @@ def list_available_models(api_key: str):
     try:
         url = "https://generativelanguage.googleapis.com/v1beta/models"
         params = {"key": api_key}
-        response = requests.get(url, params=params)
+        response = http_pool.get(url, params=params)
         response.raise_for_status()
         result = response.json()
         models = []
@@ -1007,7 +1046,8 @@ CURRENT STORY (for reference — edit this, don't copy it):
 Now write the revised story JSON:"""
 
         from vertex_client import call_gemini_text
-        response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.9, max_tokens=32768)
+        response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.9, max_tokens=32768,
+                                         cache_scope=_text_cache_scope())
         if response_text is None:
             st.error("❌ Could not edit story. Check your API key or Vertex AI credentials.")
             return None
@@ -1099,7 +1139,8 @@ Return the COMPLETE story JSON with:
 Output ONLY valid JSON, no markdown, no explanations."""
         
         from vertex_client import call_gemini_text
-        response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.8)
+        response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.8,
+                                         cache_scope=_text_cache_scope())
         if response_text is None:
             st.error("❌ Could not regenerate story. Check your API key or Vertex AI credentials.")
             return None
@@ -1146,13 +1187,27 @@ Output ONLY valid JSON, no markdown, no explanations."""
                 st.code(traceback.format_exc())
         return None
 
+# Stream the story (streamGenerateContent) when the caller can use pages
+# as they arrive. STORY_STREAMING=0 forces the single blocking call.
+STORY_STREAMING = os.getenv("STORY_STREAMING", "1").lower() not in ("0", "false", "no")
+
+
 def generate_story_with_gemini(api_key: str, child_name: str, age: int, gender: str,
                                physical_desc: str, problem: str, language: str,
                                family_structure: str = "", hero_trait: str = "", character_choice: str = "",
                                story_type: str = "Behavioral/Problem-solving",
                                image_style: str = "Cartoon/Animated (3D Pixar Style)",
-                               format_id: str = None) -> Dict:
-    """Generate story using Gemini API via REST."""
+                               format_id: str = None, on_page=None, on_restart=None) -> Dict:
+    """Generate story using Gemini API via REST.
+
+    With on_page, the story is streamed and on_page(index, page_dict, header)
+    is called for each page as soon as it is complete (on the calling
+    thread); index is the page's position in the story and header holds
+    the top-level fields seen so far (visual_anchor, …). The fully parsed
+    story is still returned at the end. If streaming fails it falls back to
+    a blocking call, whose story may differ: on_restart() is called first
+    if any pages were delivered, so the caller can discard them.
+    """
     try:
         logger.info(f"Generating story for {child_name}, age {age}, problem: {problem[:50]}..., format={format_id}")
         # Create visual anchor (incorporate character style)
@@ -1183,18 +1238,32 @@ def generate_story_with_gemini(api_key: str, child_name: str, age: int, gender:
         logger.info(f"Using age-specific prompt for age {age}, format {format_id}")
 
         from vertex_client import call_gemini_text
-        response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.7)
-        if response_text is None:
-            st.error("❌ Could not generate story. Check your API key or Vertex AI credentials.")
-            return None
-
-        # Try to extract JSON if wrapped in markdown code blocks
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-
-        story_data = json.loads(response_text)
+        from story_stream import StoryStreamParser, strip_fences
+        response_text = None
+        story_data = None
+        if on_page is not None and STORY_STREAMING:
+            from vertex_client import stream_gemini_text
+            parser = StoryStreamParser()
+            try:
+                for chunk in stream_gemini_text(prompt, temperature=0.7, cache_scope=_text_cache_scope()):
+                    for idx, page in parser.feed(chunk):
+                        on_page(idx, page, parser.header())
+                response_text = parser.buf
+                logger.info(f"Story streamed: {len(parser.pages)} pages delivered incrementally")
+            except Exception as e:
+                logger.warning(f"Story streaming failed, falling back to blocking call: {e}")
+                if parser.pages and on_restart is not None:
+                    on_restart()
+            else:
+                story_data = parser.finish()
+        if story_data is None:
+            response_text = call_gemini_text(prompt, api_key=api_key, temperature=0.7,
+                                             cache_scope=_text_cache_scope())
+            if response_text is None:
+                st.error("❌ Could not generate story. Check your API key or Vertex AI credentials.")
+                return None
+            # The model sometimes wraps the JSON in markdown code fences
+            story_data = json.loads(strip_fences(response_text))
 
         # Keep visual_anchor at story level; strip any pre-assembled image_prompt —
         # image prompts are assembled lazily in Step 2 just before each image is generated.
@@ -1231,11 +1300,14 @@ def generate_story_with_gemini(api_key: str, child_name: str, age: int, gender:
 # generate_image_with_imagen below, which has st.* hooks for inline UI updates.
 # ---------------------------------------------------------------------------
 
-# Max parallel image requests. 3 is conservative for Gemini Tier-1 (~10 IPM):
-# 3 in flight × ~20s per image ≈ ~9 RPM peak, safely under the limit. Override
-# with the IMAGE_GEN_CONCURRENCY env var if your tier allows more.
+# Parallel image requests are capped by adaptive_concurrency, which starts
+# at IMAGE_GEN_CONCURRENCY (default 3, conservative for Gemini Tier-1) and
+# moves between IMAGE_CONCURRENCY_MIN/MAX with observed 429s and latency.
+# Worker pools are sized to the ceiling; the limiter gates each HTTP
+# request (not the whole call), so workers waiting on the rate limiter or
+# backing off don't hold a slot.
 import os as _os_imggen
-IMAGE_GEN_CONCURRENCY = int(_os_imggen.environ.get("IMAGE_GEN_CONCURRENCY", "3"))
+IMAGE_POOL_WORKERS = adaptive_concurrency.MAX_LIMIT
 
 
 def _generate_image_threadsafe(
@@ -1245,12 +1317,21 @@ def _generate_image_threadsafe(
     reference_image_b64,
     openrouter_key: str,
     _outer_attempts: int = 2,
+    hedge: bool = False,
+    force_fresh: bool = False,
+    deadline=None,
 ):
     """Pure function — never touches st.*. Returns (PIL.Image | None, error_str | None).
 
+    hedge=True opts the customer-facing wizard batch into hedged Vertex
+    requests (a backup model is tried when the primary is unusually slow).
+    force_fresh=True skips the generated-image cache (see image_cache).
+    deadline (deadlines.Deadline) caps the page, retries included; no
+    further pass starts once it is spent.
+
     Retry layers (outer → inner):
       _outer_attempts (this fn)  → up to 2 full passes, 5s apart
-        vertex_client.call_gemini_image    → up to 3 attempts per model,
+        vertex_client.generate_image       → up to 3 attempts per model,
                                               8s/20s/45s on 429, 4s/10s/25s on
                                               5xx, 2s/5s/10s on network errors,
                                               honours Retry-After header
@@ -1259,15 +1340,26 @@ def _generate_image_threadsafe(
     So a single page is only marked failed after Gemini's full retry budget,
     Imagen's full budget, OpenRouter's 3 models, then ONE more full pass
     5s later. In practice that's ~30+ attempts across backends per page
-    before we give up.
+    before we give up — or earlier, when the deadline runs out. Every
+    retry (the second pass here, the per-model retries in vertex_client)
+    also needs a token from the shared retry_budget.
     """
+    deadline = deadline or deadlines.NO_DEADLINE
     last_err = None
     for _pass in range(max(1, _outer_attempts)):
         if _pass > 0:
+            # A second full pass is the costliest retry we make; skip it
+            # when the shared retry budget says Vertex is struggling.
+            if not retry_budget.try_retry("vertex", what="wizard outer pass"):
+                last_err = f"{last_err} | retry budget exhausted" if last_err else "Retry budget exhausted"
+                break
             # Brief pause before the second full pass. Gemini transients
             # almost always clear within a few seconds.
-            time.sleep(5)
+            if not deadline.sleep(5):
+                logger.info(f"_generate_image_threadsafe: skipping outer pass — {deadline.describe()}")
+                break
             logger.info(f"_generate_image_threadsafe: outer retry pass {_pass+1}/{_outer_attempts}")
+        res = None
         try:
             # Upgrade cartoon styles to face-preserving portrait when refs are present.
             has_ref = bool(
@@ -1323,47 +1415,211 @@ def _generate_image_threadsafe(
                 f"{no_text_instruction}"
             )
 
-            from vertex_client import call_gemini_image
-            data_url = call_gemini_image(
-                style_prompt, api_key=api_key, reference_image_b64=reference_image_b64
+            from vertex_client import generate_image
+            res = generate_image(
+                style_prompt, reference_image_b64=reference_image_b64, hedge=hedge,
+                force_fresh=force_fresh, deadline=deadline,
             )
-            if data_url:
-                image_bytes = base64.b64decode(data_url.split(",", 1)[1])
-                return Image.open(io.BytesIO(image_bytes)).convert("RGB"), None
-
-            # Vertex-only — no OpenRouter fallback. Pull real per-backend
-            # errors out of vertex_client's thread-
-            # local so the user sees what actually failed instead of a
-            # generic 'No image returned from any backend'.
-            try:
-                from vertex_client import get_last_image_errors as _glie
-                _detail = _glie()
-            except Exception:
-                _detail = []
-            if _detail:
-                last_err = " | ".join(str(e)[:160] for e in _detail[:2])
-            else:
-                last_err = "No image returned from any backend"
+            if res.ok:
+                # Decoded once; the original bytes stay attached to the PIL
+                # image so saving it later doesn't re-encode from pixels.
+                return res.image.pil, None
+
+            # Vertex-only — no OpenRouter fallback. Surface the real
+            # per-backend errors from the call result so the user sees what
+            # actually failed instead of a generic 'No image returned from
+            # any backend'.
+            last_err = res.error_summary() or "No image returned from any backend"
+            if res.deadline_exceeded:
+                break
             # Fall through to next outer pass (if any)
             continue
         except Exception as e:
             # Vertex-only — include backend-level errors when present — they're
             # usually more diagnostic than the outer exception text.
-            try:
-                from vertex_client import get_last_image_errors as _glie2
-                _detail2 = _glie2()
-            except Exception:
-                _detail2 = []
-            if _detail2:
-                last_err = str(e) + " | " + " | ".join(
-                    str(x)[:120] for x in _detail2[:2]
-                )
+            if res is not None and res.errors:
+                last_err = str(e) + " | " + res.error_summary(width=120)
             else:
                 last_err = str(e)
             continue
     return None, last_err or "All backends failed after retries"
 
 
+# Step 2 is pipelined (see image_scheduler): pages are queued for
+# illustration as they stream in and on approval/refine, not only once the
+# reader reaches Step 2. IMAGE_PIPELINE=0 restores render-on-Step-2 only.
+IMAGE_PIPELINE = _os_imggen.environ.get("IMAGE_PIPELINE", "1").lower() not in ("0", "false", "no")
+# Most pages rendered ahead of Step 2 at once; the rest wait for Step 2.
+IMAGE_PIPELINE_MAX = int(_os_imggen.environ.get("IMAGE_PIPELINE_MAX", str(IMAGE_POOL_WORKERS)))
+
+
+def _render_page_job(prompt, api_key, image_style, reference_image_b64, openrouter_key,
+                     book_deadline=None, hedge=True, vertex_cfg=None):
+    """image_scheduler worker: one wizard page, hedged like the old batch
+    unless it is a speculative render (hedge=False).
+
+    The page budget starts when the job runs, not while it waits in the
+    queue, and never outlives the Step 2 batch's book deadline. The
+    worker can't see st.session_state, so the sidebar's Vertex settings
+    come in as `vertex_cfg` (vertex_client.session_config())."""
+    from vertex_client import use_config
+    with use_config(vertex_cfg):
+        return _generate_image_threadsafe(
+            api_key, prompt, image_style, reference_image_b64, openrouter_key, hedge=hedge,
+            deadline=(book_deadline or deadlines.NO_DEADLINE).child(label="page"),
+        )
+
+
+def _page_image_scheduler():
+    from image_scheduler import PageImageScheduler
+    sched = st.session_state.get("_page_image_scheduler")
+    if sched is None:
+        sched = PageImageScheduler(_render_page_job, IMAGE_POOL_WORKERS,
+                                   max_speculative=IMAGE_PIPELINE_MAX)
+        st.session_state._page_image_scheduler = sched
+    return sched
+
+
+def _drop_page_image_scheduler() -> None:
+    """New story or logout: cancel queued renders and stop the pool."""
+    sched = st.session_state.pop("_page_image_scheduler", None)
+    if sched is not None:
+        sched.shutdown()
+
+
+def _page_job_args(api_key: str) -> tuple:
+    """Worker args after the prompt, resolved on the script thread."""
+    style = (
+        st.session_state.get("wiz_image_style")
+        or st.session_state.get("image_style", "Cartoon/Animated (3D Pixar Style)")
+    )
+    return (
+        api_key,
+        style,
+        st.session_state.get("wiz_reference_photos_b64") or None,
+        st.session_state.get("openrouter_api_key", "") or "",
+    )
+
+
+def _page_image_prompt(idx: int, page: dict, visual_anchor: str, secondary_characters: list,
+                       book_format: dict) -> str:
+    if idx in st.session_state.get("edited_image_prompts", {}):
+        return st.session_state.edited_image_prompts[idx]
+    return _assemble_image_prompt(page, visual_anchor, book_format, secondary_characters)
+
+
+def _pipeline_pages(api_key: str, indexed_pages, visual_anchor: str, secondary_characters: list) -> None:
+    """Queue (idx, page) pairs for illustration; changed prompts are reissued."""
+    if not IMAGE_PIPELINE:
+        return
+    try:
+        from vertex_client import is_vertex_configured, session_config
+        if not is_vertex_configured():
+            return
+        sched = _page_image_scheduler()
+        fmt = _resolve_book_format()
+        args = _page_job_args(api_key)
+        vertex_cfg = session_config()
+        for idx, page in indexed_pages:
+            # Speculative: not hedged, and capped so a long story doesn't
+            # fill the pool before the reader has approved anything.
+            sched.submit(idx, _page_image_prompt(idx, page, visual_anchor, secondary_characters, fmt),
+                         *args, speculative=True, hedge=False, vertex_cfg=vertex_cfg)
+    except Exception as e:
+        logger.warning(f"Image pipeline submit failed: {e}")
+
+
+def _pipeline_story(api_key: str) -> None:
+    """Queue every page of the current story still missing an image
+    (after generate/refine/approve)."""
+    story = st.session_state.get("generated_story") or {}
+    pages = story.get("pages", [])
+    if not pages or not IMAGE_PIPELINE:
+        return
+    imgs = st.session_state.get("generated_images") or []
+    todo = [(i, p) for i, p in enumerate(pages) if i >= len(imgs) or imgs[i] is None]
+    _pipeline_pages(api_key, todo, story.get("visual_anchor", ""),
+                    story.get("secondary_characters", []))
+    _page_image_scheduler().retain(range(len(pages)))
+
+
+# ── Per-page image fingerprints ───────────────────────────────────────────
+# Every generated page image carries a fingerprint of what produced it: the
+# assembled prompt, the image style and the reference photo(s). It rides on
+# the PIL object (like image_bytes' encoded bytes) and is persisted next to
+# `images` in book_history as `image_fingerprints`. After a refine, rewrite,
+# reorder or delete, images whose page still has the same fingerprint are
+# kept (following their page if it moved) and only the rest are re-rendered.
+
+def _image_fingerprint(prompt: str, image_style: str, reference_image_b64=None) -> str:
+    refs = reference_image_b64 if isinstance(reference_image_b64, list) else [reference_image_b64 or ""]
+    h = hashlib.sha256()
+    for part in [prompt or "", image_style or ""] + [hashlib.sha256(r.encode()).hexdigest() for r in refs if r]:
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()[:24]
+
+
+def _tag_image(img, fingerprint: str):
+    if img is not None and fingerprint:
+        try:
+            img._prompt_fingerprint = fingerprint
+        except Exception:
+            pass
+    return img
+
+
+def _fingerprint_of(img) -> str:
+    return getattr(img, "_prompt_fingerprint", "") if img is not None else ""
+
+
+def _fingerprints_for_storage(imgs) -> list:
+    return [_fingerprint_of(img) or None for img in (imgs or [])]
+
+
+def _restore_fingerprints(imgs, fingerprints) -> None:
+    for img, fp in zip(imgs or [], fingerprints or []):
+        _tag_image(img, fp)
+
+
+def _story_fingerprints(api_key: str = "") -> list:
+    """Fingerprint of every page of the current story, as Step 2 would render it."""
+    story = st.session_state.get("generated_story") or {}
+    va, sc = story.get("visual_anchor", ""), story.get("secondary_characters", [])
+    fmt = _resolve_book_format()
+    _, style, ref, _ = _page_job_args(api_key)
+    return [
+        _image_fingerprint(_page_image_prompt(idx, page, va, sc, fmt), style, ref)
+        for idx, page in enumerate(story.get("pages", []))
+    ]
+
+
+def _carry_over_images(old_images, old_approvals=None) -> int:
+    """After the story changed, keep each old image whose fingerprint still
+    matches a page (at that page's new index); everything else is left for
+    Step 2 to render. Returns how many images were kept."""
+    by_fp = {}
+    for i, img in enumerate(old_images or []):
+        fp = _fingerprint_of(img)
+        if fp and fp not in by_fp:
+            ok = (old_approvals or {}).get(i, (old_approvals or {}).get(str(i)))
+            by_fp[fp] = (img, ok)
+    if not by_fp:
+        return 0
+    new_images, approvals = [], {}
+    for idx, fp in enumerate(_story_fingerprints()):
+        img, ok = by_fp.pop(fp, (None, None))
+        new_images.append(img)
+        if img is not None and ok is not None:
+            approvals[idx] = ok
+    kept = sum(1 for img in new_images if img is not None)
+    if kept:
+        st.session_state.generated_images = new_images
+        st.session_state.image_approvals = approvals
+    logger.info(f"Story edit: kept {kept}/{len(new_images)} page images, re-rendering the rest")
+    return kept
+
+
 def generate_image_with_imagen(
     api_key: str,
     prompt: str,
@@ -1371,8 +1627,12 @@ def generate_image_with_imagen(
     image_style: str = None,
     image_index: int = None,
     reference_image_b64: str = None,
+    force_fresh: bool = False,
 ) -> Image.Image:
-    """Generate image via Vertex AI (primary) or Google AI API (fallback)."""
+    """Generate image via Vertex AI (primary) or Google AI API (fallback).
+
+    force_fresh=True skips the generated-image cache (explicit regenerate).
+    """
     try:
         if image_index is not None and image_index in st.session_state.image_generation_errors:
             del st.session_state.image_generation_errors[image_index]
@@ -1447,7 +1707,8 @@ def generate_image_with_imagen(
         )
 
         from vertex_client import call_gemini_image
-        data_url = call_gemini_image(style_prompt, api_key=api_key, reference_image_b64=reference_image_b64)
+        data_url = call_gemini_image(style_prompt, api_key=api_key, reference_image_b64=reference_image_b64,
+                                     force_fresh=force_fresh)
         if data_url:
             image_bytes = base64.b64decode(data_url.split(",", 1)[1])
             image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
@@ -1467,11 +1728,12 @@ def generate_image_with_imagen(
             "attempt": retry_count + 1,
         }
 
-        if retry_count < 1:
+        if retry_count < 1 and retry_budget.try_retry("vertex", what="generate_image_with_imagen"):
             logger.info("Retrying image generation...")
             st.warning(f"⚠️ Image generation failed, retrying... ({str(e)[:100]})")
             time.sleep(2)
-            return generate_image_with_imagen(api_key, prompt, retry_count + 1, image_style, image_index, reference_image_b64)
+            return generate_image_with_imagen(api_key, prompt, retry_count + 1, image_style, image_index, reference_image_b64,
+                                              force_fresh=force_fresh)
 
         # Vertex-only — no OpenRouter fallback.
         if image_index is not None:
@@ -1497,8 +1759,8 @@ def generate_image_with_openrouter(openrouter_key: str, prompt: str, image_style
     for model in models:
         try:
             logger.info(f"Trying OpenRouter image generation with model: {model}")
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
+            response = http_pool.post(
+                f"{OPENROUTER_BASE_URL}/chat/completions",
                 headers={
                     "Authorization": f"Bearer {openrouter_key}",
                     "Content-Type": "application/json",
@@ -1534,7 +1796,7 @@ def generate_image_with_openrouter(openrouter_key: str, prompt: str, image_style
                             img_bytes = base64.b64decode(b64)
                             return Image.open(io.BytesIO(img_bytes))
                         elif img_url:
-                            img_resp = requests.get(img_url, timeout=30)
+                            img_resp = http_pool.get(img_url, timeout=30)
                             if img_resp.status_code == 200:
                                 return Image.open(io.BytesIO(img_resp.content))
 
@@ -1586,10 +1848,11 @@ def create_pdf(
     styles = getSampleStyleSheet()
 
     def _draw_image(img, x, y, w, h):
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        c.drawImage(ImageReader(buf), x, y, width=w, height=h, preserveAspectRatio=True)
+        # The print rendition is the image's own encoding (the bytes Vertex
+        # returned, or one high-quality JPEG), not a fresh PNG per page.
+        enc = image_bytes.for_role(img, "print")
+        c.drawImage(ImageReader(io.BytesIO(enc.data)), x, y, width=w, height=h,
+                    preserveAspectRatio=True)
 
     def _fit(img, box_w, box_h):
         iw, ih = img.size
@@ -1808,15 +2071,13 @@ def create_pdf(
 # Diffrun-style book preview helpers
 # ---------------------------------------------------------------------------
 
-def _pil_to_data_url(img: Image.Image, max_w: int = 900) -> str:
-    """Return a JPEG base64 data-URL suitable for embedding in HTML."""
-    buf = io.BytesIO()
-    copy = img.copy()
-    if copy.width > max_w:
-        ratio = max_w / copy.width
-        copy = copy.resize((max_w, int(copy.height * ratio)), Image.LANCZOS)
-    copy.save(buf, format="JPEG", quality=85, optimize=True)
-    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()
+def _pil_to_data_url(img: Image.Image, role: str = "preview") -> str:
+    """Return a JPEG base64 data-URL suitable for embedding in HTML.
+
+    The `role` rendition (see image_bytes.ROLES) is cached per image, so
+    Streamlit reruns don't re-encode every page card.
+    """
+    return image_bytes.role_data_url(img, role)
 
 
 def _render_page_card(img: Image.Image, text: str, page_num: int, total_pages: int) -> None:
@@ -1929,6 +2190,7 @@ def _load_gallery_book(doc_id: str) -> None:
         # Restore images — only keep valid (non-None) ones
         saved_imgs = row.get("images", [])
         decoded = decode_stored_images(saved_imgs) if saved_imgs else []
+        _restore_fingerprints(decoded, row.get("image_fingerprints"))
         valid_images = [img for img in decoded if img is not None]
         st.session_state.generated_images = valid_images
 
@@ -1970,22 +2232,13 @@ def _real_book_covers_for_hero(n: int = 2) -> list:
         rows = list(
             book_history_col().find(
                 {
-                    "images": {"$elemMatch": {"$type": "string", "$regex": "^data:image"}},
+                    "images": {"$elemMatch": {"$type": "string", "$regex": "^(data:image|blob:)"}},
                     "is_private": {"$ne": True},
                 },
                 {"cover_thumbnail": 1, "images": {"$slice": 1}},
             ).sort("created_at", -1).limit(n * 4)
         )
-        for row in rows:
-            cover = row.get("cover_thumbnail")
-            if not (isinstance(cover, str) and cover.startswith("data:image")):
-                cover = next(
-                    (
-                        im for im in (row.get("images") or [])
-                        if isinstance(im, str) and im.startswith("data:image")
-                    ),
-                    "",
-                )
+        for cover in _book_covers(rows, "card"):
             if cover and cover not in out:
                 out.append(cover)
             if len(out) >= n:
@@ -2002,7 +2255,7 @@ def render_gallery():
         col = book_history_col()
         books = list(col.find(
             {
-                "images": {"$elemMatch": {"$type": "string", "$regex": "^data:image"}},
+                "images": {"$elemMatch": {"$type": "string", "$regex": "^(data:image|blob:)"}},
                 "is_private": {"$ne": True},
             },
             {"_id": 1, "child_name": 1, "story_data": 1, "metadata": 1, "created_at": 1,
@@ -2024,6 +2277,7 @@ def render_gallery():
         return
 
     cols = st.columns(4)
+    covers = _book_covers(books, "card")
     for i, book in enumerate(books):
         with cols[i % 4]:
             doc_id = book.get("_id", "")
@@ -2034,10 +2288,7 @@ def render_gallery():
             lang = meta.get("language", "")
             created = book.get("created_at")
             date_str = created.strftime("%b %Y") if created else ""
-            cover = book.get("cover_thumbnail", "")
-            if not (cover and cover.startswith("data:image")):
-                cover = next((im for im in (book.get("images") or [])
-                              if isinstance(im, str) and im.startswith("data:image")), "")
+            cover = covers[i]
             if cover and cover.startswith("data:image"):
                 cover_html = f'<img src="{cover}" style="width:100%;height:230px;object-fit:cover;border-radius:10px 10px 0 0;">'
             else:
@@ -2806,6 +3057,7 @@ def _auto_resume_in_progress_book(force: bool = False) -> bool:
         # Restore images — only valid (non-None) ones
         saved_imgs = in_progress.get("images", [])
         decoded = decode_stored_images(saved_imgs) if saved_imgs else []
+        _restore_fingerprints(decoded, in_progress.get("image_fingerprints"))
         st.session_state.generated_images = decoded or []
 
         st.session_state.story_approved = journey_state.get("story_approved", False)
@@ -3223,6 +3475,7 @@ def main():
             pass
         # Clear auto-resume flag so the next user starts clean
         st.session_state.pop("_auto_resumed", None)
+        _drop_page_image_scheduler()
 
     # Google OIDC: mirror st.user into our session after st.login()
     if not is_authenticated():
@@ -3561,6 +3814,7 @@ def main():
                                             "journey_state": meta.get("journey_state", {}),
                                             "metadata": meta,
                                             "images": row.get("images", []),
+                                            "image_fingerprints": row.get("image_fingerprints", []),
                                         }
                                         st.session_state.current_book_history_id = story_info["db_id"]
                                 except Exception as load_err:
@@ -3644,6 +3898,7 @@ def main():
                                         if not story_data.get("template_id"):
                                             saved_imgs = loaded_data.get("images", [])
                                             decoded = decode_stored_images(saved_imgs) if saved_imgs else []
+                                            _restore_fingerprints(decoded, loaded_data.get("image_fingerprints"))
                                             # Only keep valid (non-None) images
                                             valid_decoded = [img for img in decoded if img is not None]
                                             st.session_state.generated_images = valid_decoded if valid_decoded else []
@@ -3818,6 +4073,27 @@ def main():
                 except Exception as _e:
                     st.error(f"Diagnostics unavailable: {_e}")
 
+            # Generation backend health (token cache, HTTP pools, ...)
+            with st.expander("⚡ Backend health"):
+                try:
+                    from vertex_client import vertex_diagnostics
+                    for _k, _v in vertex_diagnostics().items():
+                        st.write(f"**{_k}:** {_v}")
+                    import model_registry
+                    _models = model_registry.snapshot()
+                    if _models:
+                        st.caption("Image model availability (learned)")
+                        st.dataframe(_models, use_container_width=True, hide_index=True)
+                    _pools = http_pool.pool_stats()
+                    if _pools:
+                        st.caption("HTTP connection pools")
+                        st.dataframe(
+                            [{"host": _h, **_c} for _h, _c in _pools.items()],
+                            use_container_width=True, hide_index=True,
+                        )
+                except Exception as _e:
+                    st.error(f"Diagnostics unavailable: {_e}")
+
             st.divider()
 
             # Vertex AI is the ONLY image / text backend. Gemini API key
@@ -4013,13 +4289,42 @@ def main():
         st.session_state.all_images_approved = False
         st.session_state.generated_images = []
         st.session_state._loaded_from_history = False  # allow auto-generation for fresh stories
+        _drop_page_image_scheduler()
+
+        # Pages are shown as they stream in, so the reader sees page 1
+        # within seconds instead of staring at a spinner for the whole story.
+        _stream_box = st.empty()
+        _streamed_pages = []
+
+        def _show_streamed_page(idx, page, header=None):
+            _streamed_pages.append(page)
+            # Start illustrating this page while the rest is being written
+            # (only once the visual_anchor it depends on has streamed in).
+            if header and header.get("visual_anchor"):
+                # image_prompt is stripped from parsed stories; match that
+                _lean = {k: v for k, v in page.items() if k != "image_prompt"}
+                _pipeline_pages(api_key, [(idx, _lean)],
+                                header["visual_anchor"], header.get("secondary_characters", []))
+            with _stream_box.container():
+                st.caption(f"✍️ Writing your story… {len(_streamed_pages)} page(s) so far")
+                for _p in _streamed_pages[-3:]:
+                    st.markdown(f"**Page {_p.get('page_number', '')}** — {_p.get('text', '')}")
+
+        def _restart_streamed_pages():
+            # The stream broke off; the blocking retry writes a new story,
+            # so the pages shown and queued so far no longer apply.
+            _streamed_pages.clear()
+            _stream_box.empty()
+            _drop_page_image_scheduler()
 
         with st.spinner("🔄 Generating your personalized story..."):
             story_data = generate_story_with_gemini(
                 api_key, child_name, age, gender, physical_desc, problem, language,
                 family_structure, hero_trait, character_choice, story_type, image_style,
-                format_id=format_id,
+                format_id=format_id, on_page=_show_streamed_page,
+                on_restart=_restart_streamed_pages,
             )
+            _stream_box.empty()
 
             if not story_data:
                 st.error("Failed to generate story. Please try again.")
@@ -4035,6 +4340,7 @@ def main():
             st.session_state.all_images_approved = False
             st.session_state.pdf_path = None
             st.session_state.pdf_generation_key = None
+            _pipeline_story(api_key)
 
             # Save story to history
             metadata = {
@@ -4116,6 +4422,7 @@ def main():
             st.session_state.just_approved_story = True
             if st.session_state.generated_story and st.session_state.current_child_name:
                 save_story(st.session_state.generated_story, st.session_state.current_child_name)
+            _pipeline_story(api_key)
             st.rerun()
 
         def _open_regen_form():
@@ -4175,6 +4482,8 @@ def main():
                     "page you'd like to change."
                 )
                 return
+            _old_imgs = st.session_state.generated_images
+            _old_ok = st.session_state.image_approvals
             st.session_state.generated_story = refined
             st.session_state.generated_images = []
             st.session_state.image_approvals = {}
@@ -4183,6 +4492,8 @@ def main():
             st.session_state.pdf_generation_key = None
             st.session_state.edited_story_pages = {}
             st.session_state.edited_image_prompts = {}
+            _carry_over_images(_old_imgs, _old_ok)
+            _pipeline_story(api_key)
             st.session_state.story_approved = False
             st.session_state.pop("_regen_with_context_open", None)
             st.success(f"Rewrote the story — {changed} of {len(orig_pages)} pages changed.")
@@ -4294,10 +4605,13 @@ def main():
                             _esp[i], _esp[i - 1] = _esp.get(i - 1, ""), _esp.get(i, "")
                             _eip = st.session_state.edited_image_prompts
                             _eip[i], _eip[i - 1] = _eip.get(i - 1, ""), _eip.get(i, "")
-                            # Image order is now stale
+                            # Images follow their pages (by fingerprint)
+                            _old_imgs = st.session_state.generated_images
+                            _old_ok = st.session_state.image_approvals
                             st.session_state.generated_images = []
                             st.session_state.image_approvals = {}
                             st.session_state.all_images_approved = False
+                            _carry_over_images(_old_imgs, _old_ok)
                             st.rerun()
 
                     # Move Down
@@ -4312,9 +4626,12 @@ def main():
                             _esp[i], _esp[i + 1] = _esp.get(i + 1, ""), _esp.get(i, "")
                             _eip = st.session_state.edited_image_prompts
                             _eip[i], _eip[i + 1] = _eip.get(i + 1, ""), _eip.get(i, "")
+                            _old_imgs = st.session_state.generated_images
+                            _old_ok = st.session_state.image_approvals
                             st.session_state.generated_images = []
                             st.session_state.image_approvals = {}
                             st.session_state.all_images_approved = False
+                            _carry_over_images(_old_imgs, _old_ok)
                             st.rerun()
 
                     # Rewrite from this page on
@@ -4352,9 +4669,12 @@ def main():
                                     continue
                                 new_eip[k - 1 if k > i else k] = v
                             st.session_state.edited_image_prompts = new_eip
+                            _old_imgs = st.session_state.generated_images
+                            _old_ok = st.session_state.image_approvals
                             st.session_state.generated_images = []
                             st.session_state.image_approvals = {}
                             st.session_state.all_images_approved = False
+                            _carry_over_images(_old_imgs, _old_ok)
                             st.rerun()
 
                 # ── Admin only: image prompt editor in an expander ──────
@@ -4411,6 +4731,8 @@ def main():
                                         language,
                                     )
                                     if regenerated_story:
+                                        _old_imgs = st.session_state.generated_images
+                                        _old_ok = st.session_state.image_approvals
                                         st.session_state.generated_story = regenerated_story
                                         st.session_state.generated_images = []
                                         st.session_state.image_approvals = {}
@@ -4421,6 +4743,8 @@ def main():
                                         st.session_state.edited_image_prompts = {
                                             k: v for k, v in st.session_state.edited_image_prompts.items() if k < i
                                         }
+                                        _carry_over_images(_old_imgs, _old_ok)
+                                        _pipeline_story(api_key)
                                         st.session_state.pdf_path = None
                                         st.session_state.pdf_generation_key = None
                                         st.session_state.story_approved = False
@@ -4492,6 +4816,8 @@ def main():
                                     "Try being more specific — name the page or the change."
                                 )
                             else:
+                                _old_imgs = st.session_state.generated_images
+                                _old_ok = st.session_state.image_approvals
                                 st.session_state.generated_story = refined_story
                                 st.session_state.generated_images = []
                                 st.session_state.image_approvals = {}
@@ -4500,6 +4826,8 @@ def main():
                                 st.session_state.pdf_generation_key = None
                                 st.session_state.edited_story_pages = {}
                                 st.session_state.edited_image_prompts = {}
+                                _carry_over_images(_old_imgs, _old_ok)
+                                _pipeline_story(api_key)
                                 st.session_state.story_approved = False
                                 st.success(
                                     f"✅ Refined — {changed_count} of {len(original_pages)} pages updated."
@@ -4884,7 +5212,14 @@ def main():
                         _sc = st.session_state.generated_story.get("secondary_characters", [])
                         image_prompt = _assemble_image_prompt(page, _va, _resolve_book_format(), _sc)
                     logger.info(f"Regenerating image for page {regenerate_idx + 1} with prompt: {image_prompt[:150]}...")
-                    img = generate_image_with_imagen(api_key, image_prompt, image_index=regenerate_idx)
+                    # The regenerate button means "give me a different
+                    # picture" — never hand back the cached one, edited
+                    # prompt or not.
+                    img = generate_image_with_imagen(
+                        api_key, image_prompt, image_index=regenerate_idx, force_fresh=True,
+                    )
+                    _, _style, _ref, _ = _page_job_args(api_key)
+                    _tag_image(img, _image_fingerprint(image_prompt, _style, _ref))
                     # ALWAYS replace at the correct index - ensure list is large enough
                     while len(st.session_state.generated_images) <= regenerate_idx:
                         st.session_state.generated_images.append(None)
@@ -4948,26 +5283,22 @@ def main():
                         while len(st.session_state.generated_images) < gen_limit:
                             st.session_state.generated_images.append(None)
 
-                        # Resolve session-dependent inputs ONCE on the main thread
-                        _eff_style = (
-                            st.session_state.get("wiz_image_style")
-                            or st.session_state.get("image_style", "Cartoon/Animated (3D Pixar Style)")
-                        )
-                        _ref_b64 = st.session_state.get("wiz_reference_photos_b64") or None
-                        _or_key = st.session_state.get("openrouter_api_key", "") or ""
+                        # Resolve session-dependent inputs ONCE on the main
+                        # thread — the same args the pipeline submits with,
+                        # so pages already queued keep their job.
+                        from vertex_client import session_config
+                        _job_args = _page_job_args(api_key)
+                        _, _eff_style, _ref_b64, _ = _job_args
+                        _vertex_cfg = session_config()
                         _va = st.session_state.generated_story.get("visual_anchor", "")
                         _sc = st.session_state.generated_story.get("secondary_characters", [])
                         _fmt = _resolve_book_format()
 
                         # Build (idx, prompt) pairs
-                        jobs = []
-                        for idx in missing_indices:
-                            page = pages[idx]
-                            if idx in st.session_state.edited_image_prompts:
-                                p = st.session_state.edited_image_prompts[idx]
-                            else:
-                                p = _assemble_image_prompt(page, _va, _fmt, _sc)
-                            jobs.append((idx, p))
+                        jobs = [
+                            (idx, _page_image_prompt(idx, pages[idx], _va, _sc, _fmt))
+                            for idx in missing_indices
+                        ]
 
                         if jobs:
                             st.markdown(
@@ -5015,73 +5346,100 @@ def main():
 
                             done = 0
                             errors = {}
+                            # Pages queued earlier (while the story streamed,
+                            # on approval) are already done or in flight; the
+                            # scheduler only dispatches the rest.
+                            _sched = _page_image_scheduler()
+                            _job_prompts = dict(jobs)
                             logger.info(
                                 f"Parallel image gen: {len(jobs)} jobs, "
-                                f"max_workers={IMAGE_GEN_CONCURRENCY}"
+                                f"concurrency={adaptive_concurrency.current_limit()}/{IMAGE_POOL_WORKERS}, "
+                                f"scheduler={_sched.stats()}"
                             )
-                            with ThreadPoolExecutor(max_workers=IMAGE_GEN_CONCURRENCY) as _pool:
-                                fut_to_idx = {
-                                    _pool.submit(
-                                        _generate_image_threadsafe,
-                                        api_key, prompt, _eff_style, _ref_b64, _or_key,
-                                    ): idx
-                                    for idx, prompt in jobs
-                                }
-                                for fut in as_completed(fut_to_idx):
-                                    idx = fut_to_idx[fut]
-                                    try:
-                                        img, err = fut.result()
-                                    except Exception as e:
-                                        img, err = None, str(e)
-                                    if img is not None:
-                                        st.session_state.generated_images[idx] = img
-                                        # Render the finished image into its
-                                        # placeholder — user sees it instantly.
-                                        with placeholders[idx].container():
-                                            st.image(
-                                                img,
-                                                caption=f"Page {idx+1}",
-                                                use_container_width=True,
-                                            )
-                                    else:
-                                        st.session_state.generated_images[idx] = Image.new(
-                                            "RGB", (384, 512), color=(200, 200, 200)
+                            # One budget for the whole batch: a sick backend
+                            # can't hold the book hostage; pages still out
+                            # when it runs out are marked failed below.
+                            _book_deadline = deadlines.Deadline.for_book("wizard book")
+                            _finished = set()
+                            for idx, result in _sched.as_completed(
+                                jobs, *_job_args,
+                                book_deadline=_book_deadline, until=_book_deadline,
+                                vertex_cfg=_vertex_cfg,
+                            ):
+                                _finished.add(idx)
+                                if isinstance(result, tuple):
+                                    img, err = result
+                                elif isinstance(result, JobCancelled):
+                                    img, err = None, f"Stopped — {result}. Regenerate this page to try again."
+                                else:
+                                    img, err = None, str(result)
+                                if img is not None:
+                                    st.session_state.generated_images[idx] = _tag_image(
+                                        img, _image_fingerprint(_job_prompts[idx], _eff_style, _ref_b64)
+                                    )
+                                    # Render the finished image into its
+                                    # placeholder — user sees it instantly.
+                                    with placeholders[idx].container():
+                                        st.image(
+                                            image_bytes.role_data_url(img, "card"),
+                                            caption=f"Page {idx+1}",
+                                            use_container_width=True,
                                         )
-                                        errors[idx] = {
-                                            "error": err or "Unknown",
-                                            "full_error": err or "Unknown",
-                                            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                                            "attempt": 1,
-                                        }
-                                        logger.error(f"Image gen failed for page {idx+1}: {err}")
-                                        with placeholders[idx].container():
-                                            st.markdown(
-                                                f"<div style='background:#fef2f2;"
-                                                f"border:2px solid #fca5a5;"
-                                                f"border-radius:12px;padding:24px;"
-                                                f"text-align:center;color:#991b1b;"
-                                                f"font-size:13px;min-height:220px;"
-                                                f"display:flex;flex-direction:column;"
-                                                f"justify-content:center;'>"
-                                                f"<div style='font-size:28px;'>⚠️</div>"
-                                                f"<div style='margin-top:8px;font-weight:600;'>"
-                                                f"Page {idx+1} failed</div>"
-                                                f"<div style='margin-top:4px;font-size:11px;line-height:1.35;"
-                                                f"word-wrap:break-word;text-align:left;"
-                                                f"background:rgba(255,255,255,0.5);"
-                                                f"padding:6px;border-radius:4px;"
-                                                f"max-height:120px;overflow:auto;'>"
-                                                f"{(err or 'Unknown')[:600]}</div>"
-                                                f"<div style='margin-top:6px;font-size:11px;'>"
-                                                f"You can regenerate it below.</div>"
-                                                f"</div>",
-                                                unsafe_allow_html=True,
-                                            )
-                                    done += 1
-                                    progress.progress(
-                                        done / len(jobs),
-                                        text=f"{done} / {len(jobs)} done",
+                                else:
+                                    st.session_state.generated_images[idx] = Image.new(
+                                        "RGB", (384, 512), color=(200, 200, 200)
                                     )
+                                    errors[idx] = {
+                                        "error": err or "Unknown",
+                                        "full_error": err or "Unknown",
+                                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                        "attempt": 1,
+                                    }
+                                    logger.error(f"Image gen failed for page {idx+1}: {err}")
+                                    with placeholders[idx].container():
+                                        st.markdown(
+                                            f"<div style='background:#fef2f2;"
+                                            f"border:2px solid #fca5a5;"
+                                            f"border-radius:12px;padding:24px;"
+                                            f"text-align:center;color:#991b1b;"
+                                            f"font-size:13px;min-height:220px;"
+                                            f"display:flex;flex-direction:column;"
+                                            f"justify-content:center;'>"
+                                            f"<div style='font-size:28px;'>⚠️</div>"
+                                            f"<div style='margin-top:8px;font-weight:600;'>"
+                                            f"Page {idx+1} failed</div>"
+                                            f"<div style='margin-top:4px;font-size:11px;line-height:1.35;"
+                                            f"word-wrap:break-word;text-align:left;"
+                                            f"background:rgba(255,255,255,0.5);"
+                                            f"padding:6px;border-radius:4px;"
+                                            f"max-height:120px;overflow:auto;'>"
+                                            f"{(err or 'Unknown')[:600]}</div>"
+                                            f"<div style='margin-top:6px;font-size:11px;'>"
+                                            f"You can regenerate it below.</div>"
+                                            f"</div>",
+                                            unsafe_allow_html=True,
+                                        )
+                                done += 1
+                                progress.progress(
+                                    done / len(jobs),
+                                    text=f"{done} / {len(jobs)} done",
+                                )
+
+                            for idx, _ in jobs:
+                                if idx in _finished:
+                                    continue
+                                _sched.cancel(idx)
+                                err = f"Timed out — {_book_deadline.describe()}. Regenerate this page to try again."
+                                st.session_state.generated_images[idx] = Image.new(
+                                    "RGB", (384, 512), color=(200, 200, 200)
+                                )
+                                errors[idx] = {
+                                    "error": err,
+                                    "full_error": err,
+                                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                    "attempt": 1,
+                                }
+                                placeholders[idx].warning(f"Page {idx+1}: {err}")
 
                             # Merge errors into session state
                             for idx, info in errors.items():
@@ -5120,7 +5478,8 @@ def main():
                         if new_text != page.get("text", ""):
                             st.session_state.edited_story_pages[i] = new_text
                             st.session_state.generated_story["pages"][i]["text"] = new_text
-                        st.image(st.session_state.generated_images[i], use_container_width=True)
+                        st.image(image_bytes.role_data_url(st.session_state.generated_images[i], "preview"),
+                                 use_container_width=True)
                         if i in st.session_state.image_generation_errors:
                             err = st.session_state.image_generation_errors[i]
                             st.error("⚠️ Image Generation Failed")
@@ -5451,7 +5810,7 @@ def main():
             img_col, txt_col = st.columns([1, 1])
             with img_col:
                 if img is not None:
-                    st.image(img, use_container_width=True)
+                    st.image(image_bytes.role_data_url(img, "card"), use_container_width=True)
                 else:
                     st.markdown(
                         "<div style='background:#f0f0f0;border-radius:8px;padding:40px;"
@@ -0,0 +1,221 @@
+"""
+Learned model-availability map for Vertex image models.
+
+`call_gemini_image` walks a long fallback list of models, each on a global
+and a regional endpoint. Several of those (preview/GA names not enabled in
+our project) answer 404 every time, so probing them on every page wasted a
+round-trip per dead pair per image. This registry remembers which
+(project, model, endpoint) pairs returned 404 / 403 and when each last
+succeeded, so dead pairs are skipped until their TTL lapses. Once it does,
+the pair is re-probed in a background thread — never inline on a customer's
+page — and only put back in rotation if the probe finds it alive.
+
+Optional shared mode: set MODEL_REGISTRY_MONGO=1 to persist entries in the
+`model_availability` collection so every replica benefits from what one
+replica learned. Local reads re-sync from Mongo at most once a minute.
+
+Tunables (env vars):
+  MODEL_REGISTRY_DEAD_TTL  — seconds a 404/403 pair is skipped (default 21600 = 6h)
+  MODEL_REGISTRY_MONGO     — "1" to share the registry through Mongo
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEAD_TTL_S = int(os.environ.get("MODEL_REGISTRY_DEAD_TTL", "21600"))
+USE_MONGO = os.environ.get("MODEL_REGISTRY_MONGO", "").lower() in ("1", "true", "yes")
+_MONGO_SYNC_S = 60
+# Successes are only re-written to Mongo this often per pair, so a healthy
+# model doesn't cost one Mongo write per image.
+_SUCCESS_WRITE_INTERVAL_S = 600
+
+STATUS_OK = "ok"
+STATUS_NOT_FOUND = "not_found"
+STATUS_FORBIDDEN = "forbidden"
+
+_entries: dict = {}        # (project, model, endpoint) -> entry dict
+_probing: set = set()      # keys with a background re-probe in flight
+_lock = threading.Lock()
+_last_mongo_sync = 0.0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _doc_id(key: tuple) -> str:
+    return "|".join(key)
+
+
+def _new_entry() -> dict:
+    return {
+        "status": STATUS_OK,
+        "dead_until": 0.0,
+        "last_success": None,
+        "last_failure": None,
+        "detail": "",
+        "_written_at": 0.0,
+    }
+
+
+def _persist(key: tuple, entry: dict) -> None:
+    if not USE_MONGO:
+        return
+    try:
+        from mongo_client import model_availability_col
+        model_availability_col().update_one(
+            {"_id": _doc_id(key)},
+            {"$set": {
+                "project": key[0], "model": key[1], "endpoint": key[2],
+                "status": entry["status"],
+                "dead_until": entry["dead_until"],
+                "last_success": entry["last_success"],
+                "last_failure": entry["last_failure"],
+                "detail": entry["detail"],
+                "updated_at": _now(),
+            }},
+            upsert=True,
+        )
+        entry["_written_at"] = time.time()
+    except Exception as e:
+        logger.debug(f"model_registry persist failed: {e}")
+
+
+def _sync_from_mongo() -> None:
+    global _last_mongo_sync
+    if not USE_MONGO or time.time() - _last_mongo_sync < _MONGO_SYNC_S:
+        return
+    _last_mongo_sync = time.time()
+    try:
+        from mongo_client import model_availability_col
+        docs = list(model_availability_col().find({}))
+    except Exception as e:
+        logger.debug(f"model_registry sync failed: {e}")
+        return
+    with _lock:
+        for d in docs:
+            key = (d.get("project", ""), d.get("model", ""), d.get("endpoint", ""))
+            entry = _entries.setdefault(key, _new_entry())
+            # Another replica's view wins when it is newer than ours.
+            theirs = max(filter(None, [d.get("last_success"), d.get("last_failure")]), default=None)
+            ours = max(filter(None, [entry["last_success"], entry["last_failure"]]), default=None)
+            if ours is None or (theirs is not None and _aware(theirs) > ours):
+                entry["status"] = d.get("status", STATUS_OK)
+                entry["dead_until"] = float(d.get("dead_until") or 0.0)
+                entry["last_success"] = _aware(d.get("last_success"))
+                entry["last_failure"] = _aware(d.get("last_failure"))
+                entry["detail"] = d.get("detail", "")
+
+
+def _aware(dt: Optional[datetime]) -> Optional[datetime]:
+    # pymongo hands back naive UTC datetimes unless tz_aware is set
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def record_success(project: str, model: str, endpoint: str) -> None:
+    key = (project, model, endpoint)
+    with _lock:
+        entry = _entries.setdefault(key, _new_entry())
+        was_dead = entry["status"] != STATUS_OK
+        entry["status"] = STATUS_OK
+        entry["dead_until"] = 0.0
+        entry["last_success"] = _now()
+        stale_write = time.time() - entry["_written_at"] > _SUCCESS_WRITE_INTERVAL_S
+    if was_dead:
+        logger.info(f"model_registry: {model} @ {endpoint} is available again")
+    if was_dead or stale_write:
+        _persist(key, entry)
+
+
+def record_unavailable(project: str, model: str, endpoint: str,
+                       status_code: int, detail: str = "") -> None:
+    """Mark a pair dead after a 404 (not enabled) or 403 (no permission)."""
+    key = (project, model, endpoint)
+    with _lock:
+        entry = _entries.setdefault(key, _new_entry())
+        entry["status"] = STATUS_FORBIDDEN if status_code == 403 else STATUS_NOT_FOUND
+        entry["dead_until"] = time.time() + DEAD_TTL_S
+        entry["last_failure"] = _now()
+        entry["detail"] = (detail or f"HTTP {status_code}")[:200]
+    logger.info(
+        f"model_registry: {model} @ {endpoint} marked {entry['status']} "
+        f"for {DEAD_TTL_S}s"
+    )
+    _persist(key, entry)
+
+
+def is_dead(project: str, model: str, endpoint: str,
+            probe: Optional[Callable[[], int]] = None) -> bool:
+    """True if the pair is known-dead and should be skipped.
+
+    When a dead pair's TTL has lapsed and a `probe` is given, it is
+    re-probed in a background thread (the pair stays skipped until the
+    probe reports it alive). `probe` returns the HTTP status it saw.
+    Without a probe, a lapsed pair is simply handed back to the caller.
+    """
+    _sync_from_mongo()
+    key = (project, model, endpoint)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry["status"] == STATUS_OK:
+            return False
+        if time.time() < entry["dead_until"]:
+            return True
+        if probe is None:
+            return False
+        if key in _probing:
+            return True
+        _probing.add(key)
+    threading.Thread(
+        target=_run_probe, args=(key, probe), daemon=True,
+        name=f"model-probe-{model}",
+    ).start()
+    return True
+
+
+def _run_probe(key: tuple, probe: Callable[[], int]) -> None:
+    try:
+        status = probe()
+        if status in (403, 404):
+            record_unavailable(*key, status_code=status, detail=f"re-probe: HTTP {status}")
+        else:
+            # Anything else (200, 400, 429, 5xx) means the model exists for
+            # this project — let real traffic decide whether it is healthy.
+            record_success(*key)
+    except Exception as e:
+        logger.debug(f"model_registry probe {key} failed: {e}")
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None:
+                # Network trouble: try again after a short back-off.
+                entry["dead_until"] = time.time() + min(DEAD_TTL_S, 300)
+    finally:
+        with _lock:
+            _probing.discard(key)
+
+
+def snapshot() -> list:
+    """Registry contents as rows for the admin sidebar."""
+    _sync_from_mongo()
+    now = time.time()
+    rows = []
+    with _lock:
+        for (project, model, endpoint), e in sorted(_entries.items()):
+            dead_for = int(e["dead_until"] - now) if e["status"] != STATUS_OK else 0
+            rows.append({
+                "model": model,
+                "endpoint": endpoint,
+                "status": e["status"] + (" (probing)" if (project, model, endpoint) in _probing else ""),
+                "skip_for_s": max(0, dead_for),
+                "last_success": e["last_success"].strftime("%Y-%m-%d %H:%M") if e["last_success"] else "",
+                "detail": e["detail"][:80],
+            })
+    return rows
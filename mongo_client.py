@@ -1,6 +1,7 @@
 """
 MongoDB client — single shared MongoClient, lazy-initialised.
 Collections: users, book_history, book_cache, image_pool
+(plus the `blobs` GridFS bucket for page images)
 """
 
 import os
@@ -81,8 +82,54 @@ def events_col() -> Collection:
     return get_db()["events"]
 
 
+def model_availability_col() -> Collection:
+    """Shared Vertex model-availability registry (see model_registry.py)."""
+    return get_db()["model_availability"]
+
+
+def rate_limits_col() -> Collection:
+    """Per-model, per-minute request counters shared by all replicas
+    (see rate_limiter.py). Expired windows are removed by a TTL index."""
+    return get_db()["rate_limits"]
+
+
+def image_cache_col() -> Collection:
+    """Content-addressed generated-image cache (see image_cache.py)."""
+    return get_db()["image_cache"]
+
+
+def retry_budget_col() -> Collection:
+    """Per-scope, per-minute success/retry counters shared by all replicas
+    (see retry_budget.py). Expired windows are removed by a TTL index."""
+    return get_db()["retry_budget"]
+
+
+def blobs_bucket():
+    """GridFS bucket holding content-addressed page images (see blob_store.py)."""
+    import gridfs
+    return gridfs.GridFSBucket(get_db(), bucket_name=os.getenv("BLOB_BUCKET", "blobs"))
+
+
+def blob_files_col() -> Collection:
+    """File documents of the blobs bucket; `_id` is the SHA-256 key."""
+    return get_db()[f"{os.getenv('BLOB_BUCKET', 'blobs')}.files"]
+
+
+def blob_chunks_col() -> Collection:
+    """Chunk documents of the blobs bucket, for batched reads."""
+    return get_db()[f"{os.getenv('BLOB_BUCKET', 'blobs')}.chunks"]
+
+
 def ensure_indexes() -> None:
     """Create indexes on first startup (idempotent)."""
+    try:
+        # image_cache used to expire through a TTL index, which deleted the
+        # docs but orphaned their blobs; its trim pass expires them now.
+        info = image_cache_col().index_information().get("expires_at_1") or {}
+        if "expireAfterSeconds" in info:
+            image_cache_col().drop_index("expires_at_1")
+    except Exception:
+        pass
     try:
         users_col().create_index("email", unique=True)
         book_history_col().create_index([("user_id", 1), ("created_at", DESCENDING)])
@@ -99,8 +146,14 @@ def ensure_indexes() -> None:
         template_assets_col().create_index(
             [("template_id", 1), ("page_number", 1)], unique=True
         )
+        template_assets_col().create_index([("template_id", 1), ("rendered_variants", 1)])
+        template_assets_col().create_index([("template_id", 1), ("updated_at", DESCENDING)])
         events_col().create_index([("ts", DESCENDING)])
         events_col().create_index("type")
         events_col().create_index("email")
+        rate_limits_col().create_index("expires_at", expireAfterSeconds=0)
+        image_cache_col().create_index("expires_at")
+        image_cache_col().create_index("last_used")
+        retry_budget_col().create_index("expires_at", expireAfterSeconds=0)
     except Exception:
         pass
@@ -5,6 +5,7 @@ Configure via env vars or Streamlit secrets:
   CASHFREE_APP_ID      — App ID (Key ID)
   CASHFREE_SECRET_KEY  — Secret Key
   CASHFREE_ENV         — "sandbox" (default) or "production"
+  CASHFREE_BASE_URL    — optional API host override (local stub server)
   APP_BASE_URL         — public URL of the app (used as payment return URL)
 
 Pricing tiers (INR): basic template 149, personalized 249, premium print 699.
@@ -20,6 +21,8 @@ from pathlib import Path
 from typing import Optional
 from dotenv import load_dotenv
 
+import http_pool
+
 env_path = Path(__file__).parent / ".env"
 if env_path.exists():
     load_dotenv(env_path)
@@ -81,6 +84,8 @@ def _cf_cfg() -> dict:
     if env not in ("sandbox", "production"):
         env = "sandbox"
     base = "https://api.cashfree.com" if env == "production" else "https://sandbox.cashfree.com"
+    # CASHFREE_BASE_URL points at a stand-in (scripts/stub_backends.py)
+    base = _conf("CASHFREE_BASE_URL").rstrip("/") or base
     return {"app_id": app_id, "secret": secret, "env": env, "base": base}
 
 
@@ -307,7 +312,7 @@ def create_cashfree_order(
     }
 
     try:
-        r = requests.post(
+        r = http_pool.post(
             f"{c['base']}/pg/orders",
             headers=_headers(),
             json=payload,
@@ -351,7 +356,7 @@ def verify_cashfree_order(order_id: str) -> str:
         return "ERROR"
     c = _cf_cfg()
     try:
-        r = requests.get(
+        r = http_pool.get(
             f"{c['base']}/pg/orders/{order_id}",
             headers=_headers(),
             timeout=15,
@@ -531,7 +536,7 @@ def create_payment_link(
         payload["link_meta"] = {"return_url": return_url}
 
     try:
-        r = requests.post(f"{c['base']}/pg/links", headers=_headers(), json=payload, timeout=30)
+        r = http_pool.post(f"{c['base']}/pg/links", headers=_headers(), json=payload, timeout=30)
         try:
             data = r.json()
         except ValueError:
@@ -648,7 +653,7 @@ def check_payment_status(link_id: str) -> str:
         return "ERROR"
     c = _cf_cfg()
     try:
-        r = requests.get(
+        r = http_pool.get(
             f"{c['base']}/pg/links/{link_id}", headers=_headers(), timeout=15
         )
         data = r.json()
@@ -0,0 +1,261 @@
+"""
+Process-wide token-bucket rate limiter for Vertex image requests.
+
+Rate limiting used to be purely reactive: wait for a 429, then sleep inside
+whichever thread saw it while every other thread and Streamlit session kept
+hitting the same quota. Now every image request first takes a token from
+its model's bucket (requests-per-minute), so callers queue for quota
+instead of burning retries. A 429 penalises the whole bucket, which makes
+every caller back off together rather than just the unlucky one.
+
+All image paths go through `vertex_client.call_gemini_image`, so the
+wizard's `_generate_image_threadsafe` pool, `generate_assets_for_template`
+and `personalize_book_with_photo` share these buckets automatically;
+vertex_async queues on the same buckets through `acquire_async()`.
+
+Optional shared mode: set RATE_LIMIT_MONGO=1 and each request must also
+claim a slot in a per-model, per-minute counter in the `rate_limits`
+collection, so several app replicas split one project quota (models with
+no rpm limit skip it). 429 penalties stay local to the replica that saw
+them.
+
+Tunables (env vars):
+  VERTEX_IMAGE_RPM            — default requests/minute per model (default 0 = no limit;
+                                penalties after a 429 still apply)
+  VERTEX_IMAGE_RPM_OVERRIDES  — JSON map of model -> rpm, e.g. '{"gemini-2.5-flash-image": 30}'
+  VERTEX_IMAGE_BURST          — tokens a bucket can bank while idle (default 3)
+  RATE_LIMIT_MAX_WAIT         — max seconds a caller queues before giving up (default 180)
+  RATE_LIMIT_STAGGER_S        — gap between callers released after a penalty when the
+                                model has no rpm limit (default 2)
+  RATE_LIMIT_MONGO            — "1" to coordinate through Mongo
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RPM = int(os.environ.get("VERTEX_IMAGE_RPM", "0"))
+BURST = int(os.environ.get("VERTEX_IMAGE_BURST", "3"))
+MAX_WAIT_S = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "180"))
+STAGGER_S = float(os.environ.get("RATE_LIMIT_STAGGER_S", "2"))
+USE_MONGO = os.environ.get("RATE_LIMIT_MONGO", "").lower() in ("1", "true", "yes")
+
+try:
+    _RPM_OVERRIDES = json.loads(os.environ.get("VERTEX_IMAGE_RPM_OVERRIDES", "") or "{}")
+except ValueError:
+    logger.warning("VERTEX_IMAGE_RPM_OVERRIDES is not valid JSON — ignoring")
+    _RPM_OVERRIDES = {}
+
+
+def rpm_for(model: str) -> int:
+    """Requests/minute for `model`; 0 means no limit."""
+    return max(0, int(_RPM_OVERRIDES.get(model, DEFAULT_RPM)))
+
+
+class TokenBucket:
+    """Thread-safe token bucket. Tokens may go negative: each reservation
+    beyond the available tokens queues behind the ones before it.
+
+    rpm=0 is an unlimited bucket that only enforces penalties. Callers
+    that arrive during a penalty are released one at a time when it ends
+    — one token's worth apart (STAGGER_S for an unlimited bucket) — so
+    the queue doesn't hit the model all at once and earn another 429."""
+
+    def __init__(self, rpm: int, burst: int):
+        self.unlimited = rpm <= 0
+        self.rate = rpm / 60.0
+        self.spacing = STAGGER_S if self.unlimited else 1.0 / self.rate
+        self.capacity = float(max(1, min(burst, rpm))) if not self.unlimited else 0.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.next_release = 0.0
+        self.penalized_at = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token; return how many seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            if now < max(self.blocked_until, self.next_release):
+                # Penalised, or still draining the queue it built up: one
+                # caller per spacing, starting when the penalty ends.
+                start = max(self.blocked_until, self.next_release)
+                self.next_release = start + self.spacing
+                if not self.unlimited:
+                    # That caller's token is spent when it goes; the bucket
+                    # refills from empty after the queue has drained.
+                    self.tokens, self.updated = 0.0, self.next_release
+                return start - now
+            if self.unlimited:
+                return 0.0
+            self._refill(now)
+            self.tokens -= 1.0
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def cancel(self) -> None:
+        """Hand back a token reserved by a caller that decided not to wait."""
+        with self.lock:
+            if not self.unlimited:
+                self.tokens = min(self.capacity, self.tokens + 1.0)
+
+    def penalize(self, seconds: float) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0.0)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.penalized_at = now
+
+
+_buckets: dict = {}
+_lock = threading.Lock()
+_stats = {"acquired": 0, "queued": 0, "wait_s": 0.0, "timeouts": 0, "penalties": 0}
+
+
+def _bucket(model: str) -> TokenBucket:
+    with _lock:
+        b = _buckets.get(model)
+        if b is None:
+            b = TokenBucket(rpm_for(model), BURST)
+            _buckets[model] = b
+        return b
+
+
+def _token_waits(model: str, deadline: float):
+    """acquire()'s queueing as a generator: yields each wait, returns
+    whether a token was granted before `deadline` (monotonic). Closing it
+    mid-wait hands the token back."""
+    bucket = _bucket(model)
+    waited = 0.0
+    while True:
+        reserved_at = time.monotonic()
+        wait = bucket.reserve()
+        if reserved_at + wait > deadline:
+            bucket.cancel()
+            with _lock:
+                _stats["timeouts"] += 1
+            logger.warning(f"rate_limiter: {model} queue wait {wait:.0f}s exceeds "
+                           f"{max(0.0, deadline - reserved_at):.0f}s")
+            return False
+        if wait <= 0:
+            break
+        logger.info(f"rate_limiter: {model} queued {wait:.1f}s for a token")
+        try:
+            yield wait
+        except GeneratorExit:
+            bucket.cancel()
+            raise
+        waited += wait
+        # A 429 while we slept: our slot predates the penalty, so queue
+        # again behind it instead of going out with everyone else.
+        if bucket.penalized_at <= reserved_at:
+            break
+    with _lock:
+        _stats["acquired"] += 1
+        if waited > 0:
+            _stats["queued"] += 1
+            _stats["wait_s"] += waited
+    return True
+
+
+def acquire(model: str, timeout: Optional[float] = None) -> bool:
+    """Block until `model` has quota. False if the wait would exceed `timeout`."""
+    deadline = time.monotonic() + (MAX_WAIT_S if timeout is None else timeout)
+    waits = _token_waits(model, deadline)
+    try:
+        while True:
+            time.sleep(next(waits))
+    except StopIteration as done:
+        if not done.value:
+            return False
+    if USE_MONGO and rpm_for(model) > 0:
+        return _acquire_shared(model, deadline)
+    return True
+
+
+async def acquire_async(model: str, timeout: Optional[float] = None) -> bool:
+    """acquire() for asyncio callers (vertex_async): queues on the same
+    bucket without holding a thread. A cancelled caller's token goes back."""
+    deadline = time.monotonic() + (MAX_WAIT_S if timeout is None else timeout)
+    waits = _token_waits(model, deadline)
+    try:
+        while True:
+            await asyncio.sleep(next(waits))
+    except StopIteration as done:
+        if not done.value:
+            return False
+    except asyncio.CancelledError:
+        waits.close()
+        raise
+    if USE_MONGO and rpm_for(model) > 0:
+        return await asyncio.to_thread(_acquire_shared, model, deadline)
+    return True
+
+
+def penalize(model: str, seconds: float) -> None:
+    """Stop handing out tokens for `model` for `seconds` (after a 429)."""
+    _bucket(model).penalize(seconds)
+    with _lock:
+        _stats["penalties"] += 1
+
+
+def _acquire_shared(model: str, deadline: float) -> bool:
+    """Claim a slot in the cross-replica per-minute window for `model`."""
+    try:
+        from pymongo.errors import DuplicateKeyError
+        from mongo_client import rate_limits_col
+    except Exception:
+        return True
+    rpm = rpm_for(model)
+    while True:
+        now = datetime.now(timezone.utc)
+        window = now.replace(second=0, microsecond=0)
+        try:
+            # Only counts a slot we actually get: once the window is full
+            # the filter stops matching and the upsert collides with the
+            # existing _id instead of bumping n past the limit.
+            rate_limits_col().update_one(
+                {"_id": f"{model}|{window.isoformat()}", "n": {"$lt": rpm}},
+                {"$inc": {"n": 1},
+                 "$setOnInsert": {"model": model, "expires_at": window + timedelta(minutes=5)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            pass   # window full
+        except Exception as e:
+            # Coordination is best-effort: never block generation on Mongo.
+            logger.debug(f"rate_limiter shared acquire failed: {e}")
+            return True
+        wait = (window + timedelta(minutes=1) - now).total_seconds()
+        if time.monotonic() + wait > deadline:
+            with _lock:
+                _stats["timeouts"] += 1
+            return False
+        with _lock:
+            _stats["queued"] += 1
+            _stats["wait_s"] += wait
+        time.sleep(wait)
+
+
+def limiter_stats() -> dict:
+    """Counters for the admin panel."""
+    with _lock:
+        out = dict(_stats)
+        out["wait_s"] = round(out["wait_s"], 1)
+        out["mode"] = "mongo" if USE_MONGO else "local"
+        out["models"] = len(_buckets)
+    return out
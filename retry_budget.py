@@ -0,0 +1,220 @@
+"""
+Process-wide retry budget for Vertex calls.
+
+Retries are layered: vertex_client retries each model up to three times,
+`_generate_image_threadsafe` and the template builders make a second full
+pass, `generate_image_with_imagen` retries itself. When Vertex degrades,
+every session multiplies its traffic through those loops at exactly the
+moment the backend can least take it.
+
+Every retry loop now asks this module first. Retries are allowed only
+while, within the last RETRY_BUDGET_WINDOW_S seconds,
+
+  retries < RETRY_BUDGET_MIN + RETRY_BUDGET_RATIO × successful requests
+
+so in steady state retries add at most ~20% on top of real traffic, and
+a small floor keeps a quiet server (or a cold start) able to ride out an
+odd blip. A denied retry makes the caller fall through to its next model
+or give up on the page; the denial is counted as `exhausted` and the
+first denial in each window is logged as a `retry_budget_exhausted`
+analytics event for the admin dashboard.
+
+Optional shared mode: set RETRY_BUDGET_MONGO=1 and each replica adds its
+counts to per-minute documents in the `retry_budget` collection every
+RETRY_BUDGET_SYNC_S seconds, and decides on the fleet-wide totals, so
+twenty busy replicas can't each spend their own allowance on a sick
+backend. Coordination is best-effort; on a Mongo error the local view is
+used.
+
+Tunables (env vars):
+  RETRY_BUDGET_RATIO     — retries allowed per successful request (default 0.2)
+  RETRY_BUDGET_MIN       — retries always allowed per window (default 10)
+  RETRY_BUDGET_WINDOW_S  — sliding window, seconds (default 60)
+  RETRY_BUDGET_MONGO     — "1" to coordinate through Mongo
+  RETRY_BUDGET_SYNC_S    — how often shared counts are pushed/pulled (default 5)
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.2"))
+MIN_RETRIES = int(os.environ.get("RETRY_BUDGET_MIN", "10"))
+WINDOW_S = float(os.environ.get("RETRY_BUDGET_WINDOW_S", "60"))
+USE_MONGO = os.environ.get("RETRY_BUDGET_MONGO", "").lower() in ("1", "true", "yes")
+SYNC_S = float(os.environ.get("RETRY_BUDGET_SYNC_S", "5"))
+
+_lock = threading.Lock()
+_windows: dict = {}   # scope -> {"ok": deque[ts], "retry": deque[ts]}
+_pending: dict = {}   # scope -> {"ok": n, "retry": n} not yet pushed to Mongo
+_shared: dict = {}    # scope -> {"ok": n, "retry": n, "at": monotonic} fleet totals
+_last_event: dict = {}  # scope -> monotonic time of the last exhaustion event
+_stats = {"successes": 0, "retries": 0, "exhausted": 0, "sync_errors": 0}
+
+
+def _window(scope: str) -> dict:
+    w = _windows.get(scope)
+    if w is None:
+        w = {"ok": deque(), "retry": deque()}
+        _windows[scope] = w
+    return w
+
+
+def _prune(w: dict, now: float) -> None:
+    cutoff = now - WINDOW_S
+    for dq in w.values():
+        while dq and dq[0] < cutoff:
+            dq.popleft()
+
+
+def _note(scope: str, kind: str) -> None:
+    # caller holds _lock
+    now = time.monotonic()
+    w = _window(scope)
+    w[kind].append(now)
+    _prune(w, now)
+    if USE_MONGO:
+        p = _pending.setdefault(scope, {"ok": 0, "retry": 0})
+        p[kind] += 1
+
+
+def record_success(scope: str = "vertex") -> None:
+    """A request in `scope` succeeded; it earns RATIO of a retry."""
+    with _lock:
+        _note(scope, "ok")
+        _stats["successes"] += 1
+    _maybe_sync(scope)
+
+
+def _counts(scope: str) -> tuple:
+    # caller holds _lock
+    w = _window(scope)
+    _prune(w, time.monotonic())
+    ok, retries = len(w["ok"]), len(w["retry"])
+    shared = _shared.get(scope)
+    if USE_MONGO and shared is not None:
+        # Fleet totals already include what this replica pushed; add only
+        # what it hasn't pushed yet.
+        p = _pending.get(scope, {"ok": 0, "retry": 0})
+        ok = max(ok, shared["ok"] + p["ok"])
+        retries = max(retries, shared["retry"] + p["retry"])
+    return ok, retries
+
+
+def allowance(scope: str = "vertex") -> int:
+    with _lock:
+        ok, _ = _counts(scope)
+    return int(MIN_RETRIES + RATIO * ok)
+
+
+def try_retry(scope: str = "vertex", what: str = "") -> bool:
+    """Claim one retry in `scope`. False when the budget is exhausted —
+    the caller should move on instead of retrying."""
+    _maybe_sync(scope)
+    with _lock:
+        ok, retries = _counts(scope)
+        if retries < MIN_RETRIES + RATIO * ok:
+            _note(scope, "retry")
+            _stats["retries"] += 1
+            return True
+        _stats["exhausted"] += 1
+        now = time.monotonic()
+        first = now - _last_event.get(scope, -WINDOW_S) >= WINDOW_S
+        if first:
+            _last_event[scope] = now
+    if first:
+        logger.warning(
+            f"retry_budget: {scope} exhausted ({retries} retries vs {ok} successes "
+            f"in {WINDOW_S:.0f}s){' — ' + what if what else ''}"
+        )
+        _emit_exhausted(scope, ok, retries, what)
+    return False
+
+
+def _emit_exhausted(scope: str, ok: int, retries: int, what: str) -> None:
+    def _emit():
+        try:
+            import analytics
+            analytics.log_event(
+                analytics.RETRY_BUDGET_EXHAUSTED,
+                scope=scope, successes=ok, retries=retries, caller=what or None,
+            )
+        except Exception as e:
+            logger.debug(f"retry budget event log failed: {e}")
+
+    # Never hold up the caller on the Mongo insert.
+    threading.Thread(target=_emit, daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Mongo coordination
+# ---------------------------------------------------------------------------
+
+def _minute_ids(scope: str, now: datetime) -> list:
+    cur = now.replace(second=0, microsecond=0)
+    n = max(1, int(-(-WINDOW_S // 60)))   # whole minutes covering the window
+    return [f"{scope}|{(cur - timedelta(minutes=i)).isoformat()}" for i in range(n + 1)]
+
+
+def _maybe_sync(scope: str) -> None:
+    if not USE_MONGO:
+        return
+    with _lock:
+        shared = _shared.get(scope)
+        if shared is not None and time.monotonic() - shared["at"] < SYNC_S:
+            return
+        # Claim this sync so concurrent callers don't all hit Mongo
+        _shared[scope] = dict(shared or {"ok": 0, "retry": 0}, at=time.monotonic())
+        delta = _pending.pop(scope, {"ok": 0, "retry": 0})
+    try:
+        from mongo_client import retry_budget_col
+        col = retry_budget_col()
+        now = datetime.now(timezone.utc)
+        ids = _minute_ids(scope, now)
+        if delta["ok"] or delta["retry"]:
+            col.update_one(
+                {"_id": ids[0]},
+                {"$inc": {"ok": delta["ok"], "retry": delta["retry"]},
+                 "$setOnInsert": {"scope": scope,
+                                  "expires_at": now.replace(second=0, microsecond=0)
+                                  + timedelta(seconds=WINDOW_S + 300)}},
+                upsert=True,
+            )
+        totals = {"ok": 0, "retry": 0}
+        for d in col.find({"_id": {"$in": ids}}):
+            totals["ok"] += int(d.get("ok", 0))
+            totals["retry"] += int(d.get("retry", 0))
+        with _lock:
+            _shared[scope] = dict(totals, at=time.monotonic())
+    except Exception as e:
+        # Put the counts back so they're pushed next time.
+        with _lock:
+            p = _pending.setdefault(scope, {"ok": 0, "retry": 0})
+            p["ok"] += delta["ok"]
+            p["retry"] += delta["retry"]
+            _stats["sync_errors"] += 1
+        logger.debug(f"retry_budget sync failed: {e}")
+
+
+def budget_stats() -> dict:
+    """Counters for the admin panel (since process start, plus the
+    current window per scope)."""
+    with _lock:
+        out = dict(_stats)
+        scopes = {}
+        for scope in list(_windows):
+            ok, retries = _counts(scope)
+            scopes[scope] = {
+                "successes": ok,
+                "retries": retries,
+                "allowance": int(MIN_RETRIES + RATIO * ok),
+            }
+    out["scopes"] = scopes
+    out["mode"] = "mongo" if USE_MONGO else "local"
+    out["ratio"] = RATIO
+    return out
@@ -75,9 +75,23 @@ def main() -> None:
         total_pages = len(pages)
 
         # Build a {page_number: [variant_keys...]} map for this template
+        # Keys only: `rendered_variants` where save_asset maintains it, else
+        # the variants map's keys listed server-side — no image data read.
         status: dict[int, list[str]] = {}
-        for doc in col.find({"template_id": t_id}, {"page_number": 1, "variants": 1}):
-            status[doc["page_number"]] = sorted((doc.get("variants") or {}).keys())
+        for doc in col.aggregate([
+            {"$match": {"template_id": t_id}},
+            {"$project": {
+                "page_number": 1,
+                "keys": {"$ifNull": [
+                    "$rendered_variants",
+                    {"$map": {
+                        "input": {"$objectToArray": {"$ifNull": ["$variants", {}]}},
+                        "in": "$$this.k",
+                    }},
+                ]},
+            }},
+        ]):
+            status[doc["page_number"]] = sorted(doc.get("keys") or [])
 
         pages_with_any = sum(1 for pg in pages if status.get(pg["page_number"]))
 
@@ -0,0 +1,197 @@
+"""Move inline base64 page images out of Mongo documents into the blob store.
+
+Rewrites, in place, every `data:image/...;base64,...` string in
+
+  - book_history.images[]
+  - book_cache.book_data.pages[].image_url
+  - image_pool.image_url
+  - template_assets.variants.*
+
+to a `blob:sha256:<hex>` reference, after writing the decoded bytes to the
+`blobs` GridFS bucket (same layout the app's blob_store.py uses: file
+`_id` = SHA-256 of the bytes). The app reads both forms, so this can run
+while it is live and can be interrupted and re-run at any time: blobs are
+content-addressed, and a document is only rewritten if none of the images
+it is converting changed since they were read (skipped ones are counted —
+just run it again).
+
+    pip install pymongo
+    python scripts/migrate_images_to_blobs.py             # dry run — counts only
+    python scripts/migrate_images_to_blobs.py --apply     # actually migrates
+    python scripts/migrate_images_to_blobs.py --apply --only template_assets
+
+For a local dev database using the disk backend, pass
+`--backend disk --dir ./.blobs` (match BLOB_STORE_DIR).
+
+The connection comes from env vars: MONGODB_URI (required), MONGODB_DB,
+BLOB_BUCKET.
+
+    MONGODB_URI='mongodb+srv://...' python scripts/migrate_images_to_blobs.py
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+MONGODB_URI = os.environ.get("MONGODB_URI", "")
+MONGODB_DB = os.environ.get("MONGODB_DB", "children_book_generator")
+BLOB_BUCKET = os.environ.get("BLOB_BUCKET", "blobs")
+
+REF_PREFIX = "blob:sha256:"
+DATA_URL = "^data:image"
+
+
+def _is_data_url(v) -> bool:
+    return isinstance(v, str) and v.startswith("data:image")
+
+
+class Store:
+    """Writes blobs the way blob_store.py does, remembering what exists."""
+
+    def __init__(self, db, backend: str, root: str):
+        self.backend = backend
+        self.root = Path(root)
+        self.known = set()
+        self.written = 0
+        self.bytes_written = 0
+        if backend == "gridfs":
+            import gridfs
+            self.bucket = gridfs.GridFSBucket(db, bucket_name=BLOB_BUCKET)
+            self.files = db[f"{BLOB_BUCKET}.files"]
+
+    def _exists(self, key: str) -> bool:
+        if self.backend == "disk":
+            return (self.root / key[:2] / key[2:]).exists()
+        return self.files.find_one({"_id": key}, {"_id": 1}) is not None
+
+    def put(self, data_url: str, apply: bool) -> str:
+        data = base64.b64decode(data_url.split(",", 1)[1])
+        key = hashlib.sha256(data).hexdigest()
+        if key not in self.known and not self._exists(key):
+            if apply:
+                if self.backend == "disk":
+                    path = self.root / key[:2] / key[2:]
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = path.with_name(path.name + ".tmp")
+                    tmp.write_bytes(data)
+                    os.replace(tmp, path)
+                else:
+                    import gridfs
+                    try:
+                        self.bucket.upload_from_stream_with_id(
+                            key, key, data, metadata={"content_type": data_url[5:].split(";", 1)[0]}
+                        )
+                    except gridfs.errors.FileExists:
+                        pass
+            self.written += 1
+            self.bytes_written += len(data)
+        self.known.add(key)
+        return REF_PREFIX + key
+
+
+def _paths_book_history(doc):
+    for i, v in enumerate(doc.get("images") or []):
+        yield f"images.{i}", v
+
+
+def _paths_book_cache(doc):
+    for i, p in enumerate((doc.get("book_data") or {}).get("pages") or []):
+        if isinstance(p, dict):
+            yield f"book_data.pages.{i}.image_url", p.get("image_url")
+
+
+def _paths_image_pool(doc):
+    yield "image_url", doc.get("image_url")
+
+
+def _paths_template_assets(doc):
+    for k, v in (doc.get("variants") or {}).items():
+        yield f"variants.{k}", v
+
+
+# (collection, query for docs that still hold inline images, projection, path walker)
+TARGETS = [
+    ("template_assets", {}, {"variants": 1}, _paths_template_assets),
+    ("image_pool", {"image_url": {"$regex": DATA_URL}}, {"image_url": 1}, _paths_image_pool),
+    ("book_cache", {"book_data.pages.image_url": {"$regex": DATA_URL}},
+     {"book_data.pages.image_url": 1}, _paths_book_cache),
+    ("book_history", {"images": {"$elemMatch": {"$type": "string", "$regex": DATA_URL}}},
+     {"images": 1}, _paths_book_history),
+]
+
+
+def migrate(db, store: Store, name: str, query: dict, projection: dict, walk, apply: bool) -> None:
+    col = db[name]
+    docs = changed = skipped = images = 0
+    inline_bytes = 0
+    for doc in col.find(query, projection).batch_size(20):
+        docs += 1
+        sets, guard = {}, {"_id": doc["_id"]}
+        for path, value in walk(doc):
+            if _is_data_url(value):
+                sets[path] = store.put(value, apply)
+                guard[path] = value
+                inline_bytes += len(value)
+        if not sets:
+            continue
+        images += len(sets)
+        if apply:
+            res = col.update_one(guard, {"$set": sets})
+            if res.matched_count:
+                changed += 1
+            else:
+                skipped += 1   # written by the app meanwhile; next run picks it up
+        else:
+            changed += 1
+    verb = "migrated" if apply else "would migrate"
+    print(f"    {name:16s} docs scanned: {docs:6d}   {verb}: {changed:6d} docs / "
+          f"{images} images ({inline_bytes / 1e6:.1f} MB inline)"
+          + (f"   skipped (changed meanwhile): {skipped}" if skipped else ""))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    ap.add_argument("--apply", action="store_true", help="write blobs and rewrite documents")
+    ap.add_argument("--only", choices=[t[0] for t in TARGETS], action="append",
+                    help="limit to one collection (repeatable)")
+    ap.add_argument("--backend", choices=["gridfs", "disk"],
+                    default=os.environ.get("BLOB_STORE", "gridfs"))
+    ap.add_argument("--dir", default=os.environ.get("BLOB_STORE_DIR", ".blobs"),
+                    help="root directory for --backend disk")
+    args = ap.parse_args()
+
+    if not MONGODB_URI:
+        print("ERROR: MONGODB_URI is not set.  Export the cluster's connection string first.")
+        sys.exit(1)
+    try:
+        from pymongo import MongoClient
+    except ImportError:
+        print("ERROR: pymongo not installed.  pip install pymongo")
+        sys.exit(1)
+    client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=10000)
+    client.admin.command("ping")
+    db = client[MONGODB_DB]
+    store = Store(db, args.backend, args.dir)
+
+    print("=" * 78)
+    print(f"  Target DB:  {MONGODB_DB}")
+    print(f"  Blobs:      {args.backend}" + (f" ({args.dir})" if args.backend == "disk" else f" (bucket {BLOB_BUCKET})"))
+    print(f"  Mode:       {'APPLY (will rewrite documents)' if args.apply else 'DRY RUN (read-only)'}")
+    print("=" * 78)
+    for name, query, projection, walk in TARGETS:
+        if args.only and name not in args.only:
+            continue
+        migrate(db, store, name, query, projection, walk, args.apply)
+    print("-" * 78)
+    print(f"  Blobs {'written' if args.apply else 'to write'}: {store.written} "
+          f"({store.bytes_written / 1e6:.1f} MB), {len(store.known)} distinct images")
+    if not args.apply:
+        print("  Dry run only. Re-run with --apply to migrate.")
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    main()
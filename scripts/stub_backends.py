@@ -0,0 +1,343 @@
+"""
+Local stand-in for the paid backends the app calls: Vertex AI, OpenRouter
+and Cashfree. Lets you load-test and benchmark the generation pipeline
+without spending quota.
+
+Only the request shapes this codebase actually sends are implemented:
+
+  Vertex   POST .../models/<model>:generateContent        (text + image)
+           POST .../models/<model>:streamGenerateContent  (text, alt=sse)
+           POST .../models/<model>:predict                (Imagen)
+  OpenRouter  POST /api/v1/chat/completions
+  Cashfree POST /pg/orders, GET /pg/orders/<id>,
+           POST /pg/links,  GET /pg/links/<id>
+
+Responses are canned: a generated PNG for image calls and a small story
+JSON for text calls. Latency and failures are configurable per backend
+class (image / text / payments) so runs are repeatable.
+
+Point the app at it with env vars (see scripts/README.md):
+
+  VERTEX_BASE_URL=http://127.0.0.1:8089  VERTEX_STUB_TOKEN=stub
+  VERTEX_PROJECT_ID=stub-project
+  OPENROUTER_BASE_URL=http://127.0.0.1:8089/api/v1
+  CASHFREE_BASE_URL=http://127.0.0.1:8089  CASHFREE_APP_ID=x CASHFREE_SECRET_KEY=x
+
+Standard library only — no app imports.
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+_MODEL_RE = re.compile(r"/models/([^/:]+):(generateContent|streamGenerateContent|predict)$")
+
+CONFIG = {
+    # Latency specs: "fixed:S", "uniform:A,B", "normal:MEAN,SD", "lognormal:MEDIAN,SIGMA"
+    "latency": {"image": "lognormal:12,0.4", "text": "lognormal:6,0.3", "payments": "fixed:0.2"},
+    # Probability of answering 429 / 5xx, per backend class
+    "p429": {"image": 0.0, "text": 0.0, "payments": 0.0},
+    "p5xx": {"image": 0.0, "text": 0.0, "payments": 0.0},
+    # Models that always answer 404 (not enabled in the project)
+    "dead_models": [],
+    # Retry-After seconds sent with 429s (0 = omit the header)
+    "retry_after": 0,
+    "pages": 12,
+    # Status Cashfree reports for orders/links: PAID, ACTIVE, EXPIRED
+    "payment_status": "PAID",
+}
+
+_stats_lock = threading.Lock()
+_stats: dict = {}
+_images: list = []
+
+
+# ---------------------------------------------------------------------------
+# Canned payloads
+# ---------------------------------------------------------------------------
+
+def _png(width: int, height: int, tint: tuple, noise: bool) -> bytes:
+    """Minimal RGB PNG. noise=True makes it incompressible (real-image sized)."""
+    rows = []
+    for y in range(height):
+        if noise:
+            rows.append(b"\x00" + os.urandom(width * 3))
+        else:
+            g = y * 255 // max(1, height - 1)
+            rows.append(b"\x00" + bytes((tint[0], g, tint[2])) * width)
+    raw = zlib.compress(b"".join(rows), 6)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+
+def _build_images(size: int, noise: bool) -> None:
+    tints = [(240, 0, 120), (60, 0, 220), (250, 0, 40), (20, 0, 160)]
+    _images[:] = [base64.b64encode(_png(size, size, t, noise)).decode() for t in tints]
+
+
+def _story_text() -> str:
+    pages = [
+        {
+            "page_number": i + 1,
+            "text": f"Stub page {i + 1}: the hero takes another brave step.",
+            "shot_type": "mid_shot_character",
+            "primary_subject": "The hero in a sunny meadow",
+            "characters_in_scene": [],
+            "visual_description": f"Mid shot of the hero in a sunny meadow, scene {i + 1}.",
+        }
+        for i in range(int(CONFIG["pages"]))
+    ]
+    return json.dumps({
+        "title": "The Stub Adventure",
+        "visual_anchor": "A cheerful child in a red t-shirt",
+        "secondary_characters": [],
+        "pages": pages,
+    })
+
+
+# ---------------------------------------------------------------------------
+# Latency / fault injection
+# ---------------------------------------------------------------------------
+
+def _sample_latency(spec: str) -> float:
+    kind, _, args = spec.partition(":")
+    vals = [float(v) for v in args.split(",") if v.strip()] or [0.0]
+    if kind == "uniform":
+        return random.uniform(vals[0], vals[-1])
+    if kind == "normal":
+        return max(0.0, random.gauss(vals[0], vals[1] if len(vals) > 1 else 0.0))
+    if kind == "lognormal":
+        return random.lognormvariate(math.log(max(vals[0], 1e-3)), vals[1] if len(vals) > 1 else 0.0)
+    return vals[0]
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        _stats[key] = _stats.get(key, 0) + 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "StubBackends/1.0"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            sys.stderr.write("%s %s\n" % (self.address_string(), fmt % args))
+
+    # -- plumbing -------------------------------------------------------
+
+    def _body(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        if not n:
+            return {}
+        try:
+            return json.loads(self.rfile.read(n) or b"{}")
+        except ValueError:
+            return {}
+
+    def _send(self, status: int, obj, headers: dict = None) -> None:
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _inject(self, cls: str, model: str = "") -> bool:
+        """Sleep for the class latency and maybe answer with a fault.
+        Returns True if a fault response was sent."""
+        time.sleep(_sample_latency(CONFIG["latency"].get(cls, "fixed:0")))
+        _count(f"{cls}_requests")
+        if model and model in CONFIG["dead_models"]:
+            _count(f"{cls}_404")
+            self._send(404, {"error": {"code": 404, "message": f"Publisher model {model} not found."}})
+            return True
+        roll = random.random()
+        if roll < CONFIG["p429"].get(cls, 0.0):
+            _count(f"{cls}_429")
+            headers = {"Retry-After": str(CONFIG["retry_after"])} if CONFIG["retry_after"] else {}
+            self._send(429, {"error": {"code": 429, "message": "Resource exhausted (stub)."}}, headers)
+            return True
+        if roll < CONFIG["p429"].get(cls, 0.0) + CONFIG["p5xx"].get(cls, 0.0):
+            code = random.choice((500, 503))
+            _count(f"{cls}_{code}")
+            self._send(code, {"error": {"code": code, "message": "Internal error (stub)."}})
+            return True
+        return False
+
+    # -- routes ---------------------------------------------------------
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/_stub/stats":
+            with _stats_lock:
+                return self._send(200, {"stats": dict(_stats), "config": CONFIG})
+        m = re.match(r"^/pg/(orders|links)/([^/]+)$", path)
+        if m:
+            if self._inject("payments"):
+                return
+            status = CONFIG["payment_status"]
+            if m.group(1) == "orders":
+                return self._send(200, {"order_id": m.group(2), "order_status": status})
+            return self._send(200, {"link_id": m.group(2), "link_status": status})
+        self._send(404, {"error": f"stub: no route for GET {path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self._body()
+        if path == "/_stub/config":
+            for k, v in body.items():
+                if isinstance(CONFIG.get(k), dict) and isinstance(v, dict):
+                    CONFIG[k].update(v)
+                elif k in CONFIG:
+                    CONFIG[k] = v
+            return self._send(200, CONFIG)
+        if path == "/_stub/reset":
+            with _stats_lock:
+                _stats.clear()
+            return self._send(200, {"ok": True})
+
+        m = _MODEL_RE.search(path)
+        if m:
+            model, method = m.groups()
+            if method == "predict":
+                return self._predict(model)
+            modalities = (body.get("generationConfig") or {}).get("responseModalities") or []
+            if "IMAGE" in modalities:
+                return self._gemini_image(model)
+            if method == "streamGenerateContent":
+                return self._gemini_stream(model)
+            return self._gemini_text(model)
+        if path.endswith("/chat/completions"):
+            return self._openrouter(body)
+        if path == "/pg/orders":
+            if self._inject("payments"):
+                return
+            oid = body.get("order_id") or f"order_{int(time.time() * 1000)}"
+            return self._send(200, {"order_id": oid, "order_status": "ACTIVE",
+                                    "payment_session_id": f"session_{oid}"})
+        if path == "/pg/links":
+            if self._inject("payments"):
+                return
+            lid = body.get("link_id") or f"link_{int(time.time() * 1000)}"
+            host = self.headers.get("Host", "127.0.0.1")
+            return self._send(200, {"link_id": lid, "link_status": "ACTIVE",
+                                    "link_url": f"http://{host}/pay/{lid}"})
+        self._send(404, {"error": f"stub: no route for POST {path}"})
+
+    def _gemini_image(self, model: str):
+        if self._inject("image", model):
+            return
+        data = random.choice(_images)
+        self._send(200, {"candidates": [{"content": {"role": "model", "parts": [
+            {"inlineData": {"mimeType": "image/png", "data": data}}]}}]})
+
+    def _predict(self, model: str):
+        if self._inject("image", model):
+            return
+        self._send(200, {"predictions": [
+            {"bytesBase64Encoded": random.choice(_images), "mimeType": "image/png"}]})
+
+    def _gemini_text(self, model: str):
+        if self._inject("text", model):
+            return
+        self._send(200, {"candidates": [{"content": {"role": "model", "parts": [
+            {"text": _story_text()}]}}]})
+
+    def _gemini_stream(self, model: str):
+        """Story text as server-sent events in small chunks (alt=sse)."""
+        if self._inject("text", model):
+            return
+        text = _story_text()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        step = 200
+        for i in range(0, len(text), step):
+            event = {"candidates": [{"content": {"role": "model", "parts": [{"text": text[i:i + step]}]}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(0.05)
+        self.close_connection = True
+
+    def _openrouter(self, body: dict):
+        if self._inject("image", body.get("model", "")):
+            return
+        url = f"data:image/png;base64,{random.choice(_images)}"
+        self._send(200, {"choices": [{"message": {"role": "assistant", "content": [
+            {"type": "image_url", "image_url": {"url": url}}]}}]})
+
+
+def _parse_class_map(s: str, cast=float) -> dict:
+    """'image=0.1,text=0.05' -> {"image": 0.1, "text": 0.05}"""
+    out = {}
+    for item in filter(None, (s or "").split(",")):
+        k, _, v = item.partition("=")
+        out[k.strip()] = cast(v.strip())
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--image-latency", help="e.g. lognormal:12,0.4 or fixed:0.5")
+    ap.add_argument("--text-latency")
+    ap.add_argument("--payments-latency")
+    ap.add_argument("--p429", default="", help="per class, e.g. image=0.1,text=0.02")
+    ap.add_argument("--p5xx", default="", help="per class, e.g. image=0.05")
+    ap.add_argument("--dead-models", default="", help="comma-separated models that always 404")
+    ap.add_argument("--retry-after", type=int, default=0)
+    ap.add_argument("--pages", type=int, default=12, help="pages in the canned story")
+    ap.add_argument("--payment-status", default="PAID")
+    ap.add_argument("--image-size", type=int, default=1024)
+    ap.add_argument("--noise", action="store_true",
+                    help="incompressible images (~3 MB at 1024px) to exercise bandwidth")
+    ap.add_argument("--seed", type=int, help="seed latency/fault RNG for repeatable runs")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+
+    for cls in ("image", "text", "payments"):
+        spec = getattr(args, f"{cls}_latency")
+        if spec:
+            CONFIG["latency"][cls] = spec
+    CONFIG["p429"].update(_parse_class_map(args.p429))
+    CONFIG["p5xx"].update(_parse_class_map(args.p5xx))
+    CONFIG["dead_models"] = [m.strip() for m in args.dead_models.split(",") if m.strip()]
+    CONFIG["retry_after"] = args.retry_after
+    CONFIG["pages"] = args.pages
+    CONFIG["payment_status"] = args.payment_status.upper()
+    if args.seed is not None:
+        random.seed(args.seed)
+    _build_images(args.image_size, args.noise)
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.verbose = args.verbose
+    print(f"stub backends on http://{args.host}:{args.port} — config: {json.dumps(CONFIG)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
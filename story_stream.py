@@ -0,0 +1,126 @@
+"""
+Incremental parser for streamed story JSON.
+
+With `vertex_client.stream_gemini_text` the story arrives in chunks of a
+few hundred characters. StoryStreamParser is fed those chunks and hands
+back each entry of the top-level "pages" array — with its position in the
+array — as soon as its closing brace arrives, so the wizard can show page
+1 (and queue its image) while the model is still writing the later pages.
+An entry that doesn't parse is skipped but keeps its position, so the
+pages after it still line up with the final story.
+
+The scanner only tracks string/escape state and bracket depth; it never
+backtracks, so feeding a whole story costs one pass over the text. It
+ignores anything before the "pages" key (```json fences, title,
+visual_anchor). The complete document is still parsed once at the end by
+finish(), which stays the source of truth.
+"""
+
+import json
+import logging
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def strip_fences(text: str) -> str:
+    """Drop ```json … ``` wrapping the model sometimes adds."""
+    if "```json" in text:
+        return text.split("```json")[1].split("```")[0].strip()
+    if "```" in text:
+        return text.split("```")[1].split("```")[0].strip()
+    return text.strip()
+
+
+class StoryStreamParser:
+    def __init__(self):
+        self.buf = ""
+        self.pages: List[dict] = []
+        self._count = 0          # page objects closed so far, parsable or not
+        self._pos = 0            # next character to scan
+        self._in_pages = False   # inside the "pages" array
+        self._depth = 0          # bracket depth relative to the pages array
+        self._in_str = False
+        self._esc = False
+        self._obj_start = -1     # start of the page object being read
+        self._done = False       # pages array closed
+        self._header = None
+
+    def feed(self, chunk: str) -> List[Tuple[int, dict]]:
+        """Add text; return (position, page) for each page completed by it,
+        in order."""
+        self.buf += chunk
+        if self._done:
+            return []
+        if not self._in_pages and not self._find_pages_array():
+            return []
+        out = []
+        buf, i, n = self.buf, self._pos, len(self.buf)
+        while i < n:
+            ch = buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    # closing bracket of the pages array itself
+                    self._done = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and ch == "}" and self._obj_start >= 0:
+                    page = self._decode(buf[self._obj_start:i + 1])
+                    if page is not None:
+                        self.pages.append(page)
+                        out.append((self._count, page))
+                    self._count += 1
+                    self._obj_start = -1
+            i += 1
+        self._pos = i
+        return out
+
+    def _find_pages_array(self) -> bool:
+        key = self.buf.find('"pages"')
+        if key < 0:
+            return False
+        bracket = self.buf.find("[", key)
+        if bracket < 0:
+            return False
+        self._in_pages = True
+        self._pos = bracket + 1
+        return True
+
+    @staticmethod
+    def _decode(raw: str) -> Optional[dict]:
+        try:
+            page = json.loads(raw)
+        except ValueError as e:
+            logger.debug(f"story_stream: skipping unparsable page: {e}")
+            return None
+        return page if isinstance(page, dict) else None
+
+    def header(self) -> dict:
+        """Top-level fields written before "pages" (title, visual_anchor,
+        secondary_characters), or {} until they are all in."""
+        if self._header is None and self._in_pages:
+            head = self.buf[:self.buf.find('"pages"')].rstrip().rstrip(",")
+            start = head.find("{")
+            try:
+                self._header = json.loads(head[start:] + "}") if start >= 0 else {}
+            except ValueError:
+                self._header = {}
+        return self._header or {}
+
+    def finish(self) -> dict:
+        """Parse the complete response (raises ValueError if it isn't JSON)."""
+        return json.loads(strip_fences(self.buf))
@@ -16,7 +16,11 @@ from template_data import personalize_template_text, personalize_template_image_
 from PIL import Image
 import io
 import logging
-import requests
+import blob_store
+import deadlines
+import http_pool
+import retry_budget
+from image_bytes import EncodedImage
 import json
 import time
 import hashlib
@@ -35,17 +39,14 @@ logger = logging.getLogger(__name__)
 # ---------------------------------------------------------------------------
 
 def compress_image_for_storage(data_url: str, max_size: int = 768, quality: int = 75) -> str:
-    """Resize and JPEG-compress a base64 data URL for compact Supabase storage."""
+    """Resize and JPEG-compress a base64 data URL for compact Supabase storage.
+
+    Already-compact JPEGs are passed through without a decode/re-encode.
+    """
     if not data_url or not data_url.startswith("data:image"):
         return data_url
     try:
-        b64 = data_url.split(",", 1)[1]
-        img = Image.open(io.BytesIO(base64.b64decode(b64))).convert("RGB")
-        img.thumbnail((max_size, max_size), Image.LANCZOS)
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=quality, optimize=True)
-        compressed = base64.b64encode(buf.getvalue()).decode()
-        return f"data:image/jpeg;base64,{compressed}"
+        return EncodedImage.from_data_url(data_url).rendition(max_size, quality).data_url
     except Exception as e:
         logger.warning(f"Image compression failed: {e}")
         return data_url
@@ -80,7 +81,7 @@ def get_shared_pool_image(template_id: str, page_number: int, age_group: str, ge
         doc = image_pool_col().find_one({"prompt_hash": ph}, {"image_url": 1})
         if doc:
             logger.info(f"Shared pool HIT: template={template_id} page={page_number} age={age_group} gender={gender}")
-            return doc["image_url"]
+            return blob_store.resolve(doc["image_url"])
     except Exception as e:
         logger.warning(f"Shared pool lookup failed: {e}")
     return None
@@ -95,7 +96,7 @@ def get_any_pool_image_for_page(template_id: str, page_number: int) -> Optional[
             {"image_url": 1},
         )
         if doc:
-            return doc["image_url"]
+            return blob_store.resolve(doc["image_url"])
     except Exception:
         pass
     return None
@@ -114,7 +115,7 @@ def save_to_shared_pool(template_id: str, page_number: int, age_group: str, gend
             "page_number": page_number,
             "age_group": age_group,
             "gender": gender.lower(),
-            "image_url": compressed,
+            "image_url": blob_store.put_data_url(compressed),
             "created_at": datetime.utcnow(),
         })
         logger.info(f"Saved to shared pool: hash={ph}")
@@ -137,7 +138,15 @@ def get_cached_template_book(user_id: str, template_id: str, child_name: str, ge
         )
         if doc:
             logger.info(f"Cache hit for template {template_id}, child {child_name}")
-            return doc["book_data"]
+            book = doc["book_data"]
+            pages = book.get("pages", [])
+            urls = [p.get("image_url") for p in pages]
+            # Every page ref in one backend read
+            refs = [i for i, u in enumerate(urls) if blob_store.is_ref(u)]
+            resolved = blob_store.resolve_many(urls, only=refs)
+            for i in refs:
+                pages[i]["image_url"] = resolved[i]
+            return book
     except Exception as e:
         logger.warning(f"Could not query book cache: {e}")
     return None
@@ -150,7 +159,9 @@ def save_template_book_to_cache(user_id: str, template_id: str, child_name: str,
         book_to_store = json.loads(json.dumps(book_data))
         for page in book_to_store.get("pages", []):
             if page.get("image_url"):
-                page["image_url"] = compress_image_for_storage(page["image_url"])
+                page["image_url"] = blob_store.put_data_url(
+                    compress_image_for_storage(page["image_url"])
+                )
         book_to_store.pop("reference_image_base64", None)
 
         book_cache_col().update_one(
@@ -190,6 +201,9 @@ if env_path.exists():
 else:
     load_dotenv()
 
+# Overridable so load tests can point at scripts/stub_backends.py
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+
 
 # Built-in default templates we seed into Supabase if missing
 # Include the existing "When I Grow Up" template plus 4 new ones = 5 total templates
@@ -2602,9 +2616,12 @@ def generate_template_book(api_key: str, book_data: Dict):
         book_paid = st.session_state.get("current_book_payment_status") == "paid"
         gen_limit = total_pages if (_is_admin or book_paid) else FREE_IMAGES_PER_BOOK
 
-        import time as _time
         _images_generated_since_pause = 0
         _preview_container = st.container()
+        # Whole-book budget; pages left when it runs out ship without an
+        # image and can be regenerated from the preview.
+        book_deadline = deadlines.Deadline.for_book("template book")
+        out_of_time = 0
 
         for idx, page in enumerate(pages):
             status_text.text(f"Generating page {idx + 1} of {total_pages}: {page['profession_title']}")
@@ -2623,19 +2640,26 @@ def generate_template_book(api_key: str, book_data: Dict):
 
             if not image_url:
                 # Enforce payment gate: only generate images up to gen_limit
-                if idx < gen_limit:
+                if idx < gen_limit and not book_deadline.can_start():
+                    out_of_time += 1
+                elif idx < gen_limit:
                     # Retry logic: 2 attempts with a SHORT 8s pause on failure.
                     # Hard rate-limit responses (429) are handled by exponential
                     # backoff inside vertex_client — we don't need a global
                     # proactive sleep here. The old 60s-every-3-images pause
                     # cost 4 minutes on a 12-page book for no real benefit.
+                    page_deadline = book_deadline.child(label=f"page {idx + 1}")
                     for _attempt in range(2):
-                        image_url = generate_page_image(api_key, personalized_image_prompt, reference_image_base64, openrouter_key=openrouter_key)
+                        image_url = generate_page_image(api_key, personalized_image_prompt, reference_image_base64,
+                                                        openrouter_key=openrouter_key, deadline=page_deadline)
                         if image_url:
                             break
                         if _attempt == 0:
+                            if not retry_budget.try_retry("vertex", what="generate_template_book"):
+                                break
                             status_text.text(f"Retrying page {idx + 1}…")
-                            _time.sleep(8)
+                            if not page_deadline.sleep(8):
+                                break
 
                     if image_url and use_shared_pool:
                         save_to_shared_pool(template_id, page['page_number'], age_group, gender, image_url)
@@ -2653,10 +2677,18 @@ def generate_template_book(api_key: str, book_data: Dict):
             # Show image progressively as it's generated
             if image_url:
                 with _preview_container:
-                    st.image(image_url, caption=f"Page {page['page_number']}: {page['profession_title']}", width=300)
+                    st.image(blob_store.resolve(image_url, role="card"),
+                             caption=f"Page {page['page_number']}: {page['profession_title']}", width=300)
 
             progress_bar.progress((idx + 1) / total_pages)
 
+        if out_of_time:
+            logger.warning(f"generate_template_book: {book_deadline.describe()}, {out_of_time} page(s) skipped")
+            st.warning(
+                f"⏱️ Image generation is running slowly right now — {out_of_time} page(s) "
+                "were left without an illustration. Use Regenerate on those pages to try again."
+            )
+
         # Inform non-admin users about payment requirement
         if not _is_admin and not book_paid and total_pages > FREE_IMAGES_PER_BOOK:
             generated_count = len([p for p in generated_book['pages'] if p.get('image_url')])
@@ -2801,11 +2833,55 @@ def convert_uploaded_file_to_base64(uploaded_file) -> str:
         return None
 
 
-def generate_page_image(api_key: str, prompt: str, reference_image_base64: Optional[str] = None, openrouter_key: str = "") -> Optional[str]:
+def generate_page_image(api_key: str, prompt: str, reference_image_base64: Optional[str] = None, openrouter_key: str = "",
+                        hedge: bool = False, force_fresh: bool = False, deadline=None) -> Optional[str]:
     """Generate a single image using Gemini API with optional reference image.
 
     Falls back to OpenRouter (Gemini models) when the primary call fails.
+    hedge=True opts customer-facing builds into hedged Vertex requests.
+    force_fresh=True skips the generated-image cache (explicit regenerate).
+    deadline (deadlines.Deadline) bounds the page, fallback included.
+    Returns a data URL or None; see generate_page_image_result for details.
     """
+    return generate_page_image_result(api_key, prompt, reference_image_base64, openrouter_key,
+                                      hedge=hedge, force_fresh=force_fresh, deadline=deadline).data_url
+
+
+def generate_page_image_result(api_key: str, prompt: str, reference_image_base64: Optional[str] = None,
+                               openrouter_key: str = "", hedge: bool = False, force_fresh: bool = False,
+                               deadline=None):
+    """Like generate_page_image, but returns the vertex_client.ImageCallResult
+    (model, endpoint, attempts, wall time) so callers can log or aggregate it."""
+    enhanced_prompt = _page_image_prompt(prompt, reference_image_base64)
+    deadline = deadline or deadlines.NO_DEADLINE
+    t0 = time.time()
+    res = _call_gemini_image_api(api_key, enhanced_prompt, reference_image_base64, hedge=hedge,
+                                 force_fresh=force_fresh, deadline=deadline)
+    return _with_openrouter_fallback(res, openrouter_key, enhanced_prompt, deadline, t0)
+
+
+def iter_page_image_results(prompts: List[str], reference_image_base64: Optional[str] = None,
+                            openrouter_key: str = "", hedge: bool = False, deadline=None):
+    """generate_page_image_result for a batch of pages, rendered together
+    on vertex_async's event loop instead of one thread per page. Yields
+    (index, ImageCallResult) in the order pages finish, on the calling
+    thread. `deadline` is the batch's; each page gets a child of it when
+    it starts. The OpenRouter fallback for failed pages runs here, on the
+    calling thread, while the rest keep rendering."""
+    from contextlib import closing
+    from vertex_async import iter_images
+    deadline = deadline or deadlines.NO_DEADLINE
+    enhanced = [_page_image_prompt(p, reference_image_base64) for p in prompts]
+    with closing(iter_images(enhanced, reference_image_base64, hedge=hedge, deadline=deadline)) as results:
+        for i, res in results:
+            if not res.ok:
+                res = _with_openrouter_fallback(res, openrouter_key, enhanced[i], deadline, time.time())
+            yield i, res
+
+
+def _page_image_prompt(prompt: str, reference_image_base64: Optional[str] = None) -> str:
+    """The page prompt as sent to the image model: no-text guard, style
+    and, with a reference photo, the likeness note."""
     no_text_instruction = "CRITICAL: NO TEXT in this image. No words, letters, numbers, speech bubbles, captions, signs, or labels. Pure illustration only."
     if "cartoon animated" in prompt.lower() or "cel-shaded" in prompt.lower():
         style_modifiers = "Children's book art, high quality, bold clean outlines, smooth cel shading"
@@ -2818,44 +2894,57 @@ def generate_page_image(api_key: str, prompt: str, reference_image_base64: Optio
             "skin tone, hair color, hair style, eye color, and overall appearance. "
             "Keep the child recognizable across all pages."
         )
-    enhanced_prompt = f"{no_text_instruction}. {prompt}.{likeness_note} {style_modifiers}. {no_text_instruction}"
+    return f"{no_text_instruction}. {prompt}.{likeness_note} {style_modifiers}. {no_text_instruction}"
 
-    result_url = _call_gemini_image_api(api_key, enhanced_prompt, reference_image_base64)
-    if result_url:
-        return result_url
 
-    # --- OpenRouter fallback (Gemini models, no ChatGPT/DALL-E) ---
-    if openrouter_key:
+def _with_openrouter_fallback(res, openrouter_key: str, enhanced_prompt: str, deadline, t0: float):
+    """`res` if it has an image, else try OpenRouter (Gemini models, no
+    ChatGPT/DALL-E) and fill `res` in from that."""
+    if res.ok:
+        return res
+    if openrouter_key and deadline.can_start():
         logger.info("Gemini image API failed, trying OpenRouter fallback")
-        result_url = _call_openrouter_image(openrouter_key, enhanced_prompt)
-        if result_url:
-            return result_url
+        result_url = _call_openrouter_image(openrouter_key, enhanced_prompt, deadline)
+        if result_url and "," in result_url:
+            header, data = result_url.split(",", 1)
+            res.data_b64 = data
+            res.mime_type = header[5:].split(";", 1)[0] or "image/png"
+            res.model, res.endpoint = "openrouter", "openrouter"
+            res.wall_time_s = time.time() - t0
+            return res
 
     logger.warning("All image generation attempts failed for this page")
-    return None
+    return res
 
 
-def _call_gemini_image_api(api_key: str, enhanced_prompt: str, reference_image_base64: Optional[str] = None) -> Optional[str]:
-    """Call Vertex AI image generation (primary) with Google AI fallback. Returns data URL or None."""
+def _call_gemini_image_api(api_key: str, enhanced_prompt: str, reference_image_base64: Optional[str] = None,
+                           hedge: bool = False, force_fresh: bool = False, deadline=None):
+    """Call Vertex AI image generation. Returns a vertex_client.ImageCallResult."""
+    from vertex_client import ImageCallResult
     try:
-        from vertex_client import call_gemini_image
-        return call_gemini_image(enhanced_prompt, api_key=api_key, reference_image_b64=reference_image_base64)
+        from vertex_client import generate_image
+        return generate_image(enhanced_prompt, reference_image_b64=reference_image_base64, hedge=hedge,
+                              force_fresh=force_fresh, deadline=deadline)
     except Exception as e:
         logger.warning(f"Gemini image API exception: {e}")
-    return None
+        return ImageCallResult(errors=[str(e)])
 
 
-def _call_openrouter_image(openrouter_key: str, prompt: str) -> Optional[str]:
+def _call_openrouter_image(openrouter_key: str, prompt: str, deadline=None) -> Optional[str]:
     """Try to generate an image via OpenRouter using Gemini models (no DALL-E/ChatGPT)."""
+    deadline = deadline or deadlines.NO_DEADLINE
     models = [
         "google/gemini-2.0-flash-exp:free",
         "google/gemini-flash-1.5-8b",
         "google/gemini-flash-1.5",
     ]
     for model in models:
+        if not deadline.can_start():
+            logger.warning(f"OpenRouter fallback stopped: {deadline.describe()}")
+            break
         try:
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
+            response = http_pool.post(
+                f"{OPENROUTER_BASE_URL}/chat/completions",
                 headers={
                     "Authorization": f"Bearer {openrouter_key}",
                     "Content-Type": "application/json",
@@ -2867,7 +2956,7 @@ def _call_openrouter_image(openrouter_key: str, prompt: str) -> Optional[str]:
                     "messages": [{"role": "user", "content": prompt}],
                     "max_tokens": 4096,
                 },
-                timeout=120,
+                timeout=deadline.timeout(120),
             )
             if response.status_code != 200:
                 logger.warning(f"OpenRouter {model} returned {response.status_code}")
@@ -2885,7 +2974,7 @@ def _call_openrouter_image(openrouter_key: str, prompt: str) -> Optional[str]:
                         if img_url.startswith("data:image"):
                             return img_url
                         if img_url:
-                            img_resp = requests.get(img_url, timeout=30)
+                            img_resp = http_pool.get(img_url, timeout=30)
                             if img_resp.status_code == 200:
                                 b64 = base64.b64encode(img_resp.content).decode()
                                 return f"data:image/jpeg;base64,{b64}"
@@ -2929,7 +3018,12 @@ def display_template_book_preview(book_data: Dict, api_key: Optional[str] = None
             ref_b64 = book_data.get("reference_image_base64")
             openrouter_key = st.session_state.get("openrouter_api_key", "")
             with st.spinner(f"Regenerating image for page {idx + 1}..."):
-                new_url = generate_page_image(api_key, edited_prompt, ref_b64, openrouter_key=openrouter_key)
+                # Same prompt as the current image → the user wants a new
+                # picture; an edited (or reverted) prompt may hit the cache.
+                new_url = generate_page_image(
+                    api_key, edited_prompt, ref_b64, openrouter_key=openrouter_key,
+                    force_fresh=edited_prompt == page.get("image_prompt", ""),
+                )
             if new_url:
                 book_data["pages"][idx]["image_url"] = new_url
                 book_data["pages"][idx]["image_prompt"] = edited_prompt
@@ -3068,7 +3162,6 @@ def display_template_book_preview(book_data: Dict, api_key: Optional[str] = None
             st.session_state.generate_remaining_template_pages = True
             st.rerun()
         if st.session_state.get("generate_remaining_template_pages"):
-            import time as _time_rem
             st.session_state.generate_remaining_template_pages = False
             openrouter_key = st.session_state.get("openrouter_api_key", "")
             ref_b64 = book_data.get("reference_image_base64")
@@ -3080,7 +3173,11 @@ def display_template_book_preview(book_data: Dict, api_key: Optional[str] = None
             status = st.empty()
             preview_ctr = st.container()
             _gen_count = 0
+            rem_deadline = deadlines.Deadline.for_book("remaining pages")
             for count, pidx in enumerate(pages_without_images):
+                if not rem_deadline.can_start():
+                    logger.warning(f"Generate remaining: {rem_deadline.describe()}, stopping")
+                    break
                 page = book_data["pages"][pidx]
                 status.text(f"Generating image for page {pidx + 1}...")
 
@@ -3090,13 +3187,18 @@ def display_template_book_preview(book_data: Dict, api_key: Optional[str] = None
                     img_url = get_shared_pool_image(template_id_rem, page.get("page_number", pidx + 1), age_group_rem, gender_rem)
 
                 if not img_url:
+                    page_deadline = rem_deadline.child(label=f"page {pidx + 1}")
                     for _attempt in range(2):
-                        img_url = generate_page_image(api_key, page.get("image_prompt", ""), ref_b64, openrouter_key=openrouter_key)
+                        img_url = generate_page_image(api_key, page.get("image_prompt", ""), ref_b64,
+                                                      openrouter_key=openrouter_key, deadline=page_deadline)
                         if img_url:
                             break
                         if _attempt == 0:
+                            if not retry_budget.try_retry("vertex", what="generate remaining pages"):
+                                break
                             status.text(f"Retrying page {pidx + 1}…")
-                            _time_rem.sleep(8)
+                            if not page_deadline.sleep(8):
+                                break
 
                     if img_url and use_pool_rem:
                         save_to_shared_pool(template_id_rem, page.get("page_number", pidx + 1), age_group_rem, gender_rem, img_url)
@@ -3104,7 +3206,8 @@ def display_template_book_preview(book_data: Dict, api_key: Optional[str] = None
                 if img_url:
                     book_data["pages"][pidx]["image_url"] = img_url
                     with preview_ctr:
-                        st.image(img_url, caption=f"Page {pidx + 1}: {page.get('profession_title', '')}", width=300)
+                        st.image(blob_store.resolve(img_url, role="card"),
+                                 caption=f"Page {pidx + 1}: {page.get('profession_title', '')}", width=300)
 
                 progress.progress((count + 1) / len(pages_without_images))
 
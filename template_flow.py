@@ -21,13 +21,18 @@ from typing import Callable, Optional
 import streamlit as st
 import streamlit.components.v1 as components
 
+import adaptive_concurrency
+import blob_store
+import deadlines
 import template_store
+import vertex_client
 from template_store import (
     build_book_from_assets,
     personalize_book_with_photo,
     template_coverage,
     generate_assets_for_template,
     asset_status,
+    asset_status_all,
     AGE_GROUPS,
     GENDERS,
 )
@@ -113,7 +118,8 @@ def _sample_page_image(template_id: str, page_number: int,
     """
     del remote_cover  # unused — kept for signature stability
     try:
-        return template_store.get_asset(template_id, page_number, gender, age)
+        # Shown in a sneak-peek column, so the card rendition is plenty.
+        return template_store.get_asset(template_id, page_number, gender, age, role="card")
     except Exception:
         return None
 
@@ -546,6 +552,21 @@ def _render_build_screen(build_params: dict, api_key: str,
     )
 
 
+def _fill_missing_page(prompt: str, api_key: str, openrouter_key: str,
+                       deadline: "deadlines.Deadline",
+                       vertex_cfg: Optional[dict] = None) -> Optional[str]:
+    """Scheduler worker for _build_and_show: render one page with no
+    reference photo. Runs off the script thread — no st.* here, so the
+    Vertex settings come in as `vertex_cfg` (vertex_client.session_config())."""
+    from template_book_generator import generate_page_image, compress_image_for_storage
+    if not deadline.can_start():
+        return None
+    with vertex_client.use_config(vertex_cfg):
+        img = generate_page_image(api_key, prompt, None, openrouter_key=openrouter_key,
+                                  hedge=True, deadline=deadline.child(label="missing page"))
+    return compress_image_for_storage(img) if img else None
+
+
 def _build_and_show(template_id: str, child_name: str, gender: str, age: int,
                     tier: str, api_key: str, photo_b64: Optional[str],
                     save_history_cb: Optional[Callable]):
@@ -557,7 +578,12 @@ def _build_and_show(template_id: str, child_name: str, gender: str, age: int,
     photo). To keep the screen warm we render a friendly header, a status
     line, a progress bar, and a live preview row where finished images
     appear as they come in — instead of a blank page with a tiny spinner.
+
+    The whole build shares one deadlines.Deadline: pages still missing when
+    it runs out are left for the preview's regenerate flow, and photo
+    re-renders fall back to the asset image.
     """
+    deadline = deadlines.Deadline.for_book("template build")
     # Status header — same shape for every build so the user always sees
     # something happen the moment they click Generate.
     st.markdown(
@@ -585,51 +611,76 @@ def _build_and_show(template_id: str, child_name: str, gender: str, age: int,
     )
 
     # Fill any missing assets live (rare; only if studio pre-render incomplete).
-    # We render each finished image inline so the screen is never silent for
-    # long while we wait on the image model.
+    # Pages render on the wizard's bounded scheduler; each one has its own
+    # placeholder (in page order) that is filled as soon as it finishes, so
+    # the screen is never silent for long while we wait on the image model.
     if missing and api_key:
-        from template_book_generator import generate_page_image, compress_image_for_storage
+        from image_scheduler import PageImageScheduler
         status_line.info(
             f"🎨 Painting {len(missing)} illustration"
             + ("s" if len(missing) != 1 else "")
             + " — the first one usually shows up in about 15–20 seconds…"
         )
-        prog = st.progress(0.0, text=f"Painting page 1 of {len(missing)}…")
+        prog = st.progress(0.0, text=f"Painting {len(missing)} pages…")
         preview_box = st.container()
-        first_image_done = False
-        for i, page in enumerate(missing):
-            try:
-                img = generate_page_image(api_key, page["image_prompt"], None,
-                                          openrouter_key=openrouter_key)
+        slots = {}
+        with preview_box:
+            for i, page in enumerate(missing):
+                st.markdown(
+                    f"<div style=\"margin-top:8px;font-size:13px;color:#6b5b46;\">"
+                    f"Page {page['page_number']} of {len(book['pages'])} — "
+                    f"{page.get('profession_title','')}</div>",
+                    unsafe_allow_html=True,
+                )
+                slots[i] = st.empty()
+                slots[i].caption("🖌️ Painting…")
+
+        sched = PageImageScheduler(_fill_missing_page, max_workers=adaptive_concurrency.MAX_LIMIT)
+        to_save = []
+        done = 0
+        try:
+            for i, img in sched.as_completed(
+                [(i, p["image_prompt"]) for i, p in enumerate(missing)],
+                api_key, openrouter_key, deadline=deadline, until=deadline,
+                vertex_cfg=vertex_client.session_config(),
+            ):
+                done += 1
+                page = missing[i]
+                if isinstance(img, Exception):
+                    logger.warning(f"_build_and_show: page {page['page_number']} failed: {img}")
+                    img = None
                 if img:
-                    img = compress_image_for_storage(img)
                     page["image_url"] = img
-                    template_store.save_asset(
-                        template_id, page["page_number"], gender,
-                        template_store._age_to_group(age), img,
-                    )
-                    # Live preview of every finished image; first one also
-                    # flips the status line so the user knows we’re moving.
-                    if not first_image_done:
+                    to_save.append((page["page_number"], gender,
+                                    template_store._age_to_group(age), img))
+                    slots[i].image(blob_store.resolve(img, role="card"), use_container_width=True)
+                    # First finished page also flips the status line so the
+                    # user knows we’re moving.
+                    if len(to_save) == 1:
                         status_line.success(
                             "✨ First page is ready — painting the rest now…"
                         )
-                        first_image_done = True
-                    with preview_box:
-                        st.markdown(
-                            f"<div style=\"margin-top:8px;font-size:13px;color:#6b5b46;\">"
-                            f"Page {page['page_number']} of {len(book['pages'])} — "
-                            f"{page.get('profession_title','')}</div>",
-                            unsafe_allow_html=True,
-                        )
-                        st.image(img, use_container_width=True)
-            except Exception:
-                pass
-            done = i + 1
-            prog.progress(
-                done / len(missing),
-                text=f"Painting page {min(done + 1, len(missing))} of {len(missing)}…",
+                else:
+                    slots[i].caption("We couldn’t paint this page just now.")
+                prog.progress(
+                    done / len(missing),
+                    text=f"Painted {done} of {len(missing)} pages…",
+                )
+        finally:
+            sched.shutdown()
+            # One bulk write for everything that finished, even if the
+            # script was interrupted part-way.
+            template_store.save_assets(template_id, to_save)
+        if done < len(missing):
+            logger.warning(f"_build_and_show: {deadline.describe()}, "
+                           f"{len(missing) - done} page(s) left unpainted")
+            status_line.warning(
+                "⏱️ Our illustrator is running slowly right now — we’ll "
+                "show the pages that are ready."
             )
+            for i, page in enumerate(missing):
+                if not page.get("image_url"):
+                    slots[i].caption("We couldn’t paint this page just now.")
         prog.empty()
 
     if tier == "personalized" and photo_b64 and api_key:
@@ -649,17 +700,25 @@ def _build_and_show(template_id: str, child_name: str, gender: str, age: int,
                 )
                 first_photo_done["v"] = True
 
+        # Personalised pages come back in whatever order they finish; the
+        # first few are dropped into the preview the moment they land.
+        shown = {"n": 0}
+
+        def _photo_page_done(_idx, page):
+            if shown["n"] >= 6:
+                return
+            url = blob_store.resolve(page.get("image_url"), role="card")
+            if url:
+                shown["n"] += 1
+                with preview_box:
+                    st.image(url, use_container_width=True,
+                             caption=f"Page {page.get('page_number','?')}")
+
         book = personalize_book_with_photo(
             book, api_key, photo_b64, openrouter_key=openrouter_key,
-            progress_cb=_photo_progress,
+            progress_cb=_photo_progress, hedge=True, deadline=deadline,
+            on_page=_photo_page_done,
         )
-        # After all photo re-renders, drop the finished images into the
-        # preview box so the user can see the result before the page reruns.
-        with preview_box:
-            for page in book.get("pages", [])[:6]:
-                if page.get("image_url"):
-                    st.image(page["image_url"], use_container_width=True,
-                             caption=f"Page {page.get('page_number','?')}")
         prog.empty()
 
     status_line.success("🎉 All done — opening your preview…")
@@ -744,10 +803,12 @@ def render_template_studio(api_key: str):
     SAMPLE_AGE_GROUP = "4-6"
     overview_rows = []
     incomplete_names = []
+    # One keys-only query for every template; no image data is read.
+    all_status = asset_status_all([t["id"] for t in templates])
     for t in templates:
         t_id = t["id"]
         t_pages = get_template_pages(t_id)
-        t_status = asset_status(t_id)
+        t_status = all_status.get(t_id, {})
         total_pages = len(t_pages)
         # Pages backed by a real photo (Legends) never need pre-rendering.
         static_pages = sum(1 for pg in t_pages if pg.get("static_image_url"))
@@ -3,8 +3,9 @@ Pre-rendered template assets — "create once, sell many".
 
 Each template page image is generated ONCE per (gender, age-group) variant
 and stored in Mongo (`template_assets`, one doc per template page with a
-`variants` map). Customer purchases then assemble a book instantly from
-these assets — no per-customer image generation cost for the basic tier.
+`variants` map of blob_store refs). Customer purchases then assemble a
+book instantly from these assets — no per-customer image generation cost
+for the basic tier.
 
 The personalized tier re-renders pages with the child's photo as a
 reference image, falling back to the pre-rendered asset on any failure.
@@ -14,12 +15,17 @@ import logging
 from datetime import datetime, timezone
 from typing import Callable, Dict, List, Optional
 
+import adaptive_concurrency
+import asset_cache
+import blob_store
+import deadlines
 from mongo_client import template_assets_col
 from template_data import personalize_template_text, personalize_template_image_prompt
 from template_book_generator import (
     get_available_templates,
     get_template_pages,
     generate_page_image,
+    iter_page_image_results,
     compress_image_for_storage,
     _age_to_group,
 )
@@ -47,26 +53,120 @@ def _vkey(gender: str, age_group: str) -> str:
 # Asset CRUD
 # ---------------------------------------------------------------------------
 
-def get_asset(template_id: str, page_number: int, gender: str, age: int) -> Optional[str]:
-    """Return the pre-rendered image data-URL for a page variant, or None."""
+def get_asset(template_id: str, page_number: int, gender: str, age: int,
+              role: Optional[str] = None) -> Optional[str]:
+    """Return the pre-rendered image data-URL for a page variant, or None.
+
+    Prefers the exact (gender, age) variant but falls back to another
+    rendered one, so the sneak-peek works regardless of which variant was
+    pre-rendered in Template Studio (see get_assets).
+    """
+    return get_assets(template_id, [page_number], gender, age, role).get(page_number)
+
+
+# Variant Template Studio pre-renders first; the fallback when a page has
+# no render for the exact (gender, age) yet.
+FALLBACK_VARIANT = "boy_4-6"
+
+
+def get_assets(template_id: str, page_numbers: List[int], gender: str, age: int,
+               role: Optional[str] = None) -> Dict[int, str]:
+    """page_number -> image data-URL for one variant of a template. Same
+    preference as get_asset: the exact variant, then FALLBACK_VARIANT,
+    then any rendered variant. Pages with nothing rendered are left out.
+    `role` picks a smaller rendition (image_bytes.ROLES) for display.
+
+    Served from asset_cache where possible; the rest come from a single
+    query."""
+    if not page_numbers:
+        return {}
+    vk = variant_key(gender, age)
+    ver = asset_cache.version(template_id)
+    out: Dict[int, str] = {}
+    todo = []
+    for pn in page_numbers:
+        hit = asset_cache.get(template_id, pn, vk, role)
+        if asset_cache.is_miss(hit):
+            todo.append(pn)
+        elif hit:
+            out[pn] = hit
+    if not todo:
+        return out
     try:
-        doc = template_assets_col().find_one(
-            {"template_id": template_id, "page_number": page_number},
-            {"variants": 1},
-        )
-        if not doc:
-            return None
-        variants = doc.get("variants") or {}
-        # Prefer the exact (gender, age) variant; otherwise show ANY rendered
-        # variant so the sneak-peek still works regardless of which variant
-        # was pre-rendered in Template Studio.
-        exact = variants.get(variant_key(gender, age))
-        if exact:
-            return exact
-        return next((v for v in variants.values() if v), None)
+        docs = _fetch_assets(template_id, todo, vk)
     except Exception as e:
-        logger.warning(f"get_asset failed: {e}")
-        return None
+        logger.warning(f"get_assets failed: {e}")
+        return out
+    docs = [d for d in docs if d.get("image")]
+    images = blob_store.resolve_many([d["image"] for d in docs], role=role)
+    unreadable = set()
+    for d, img in zip(docs, images):
+        if img:
+            out[d["page_number"]] = img
+        else:
+            unreadable.add(d["page_number"])
+    for pn in todo:
+        # A blob that couldn't be read is retried next time, not cached as "none"
+        if pn not in unreadable:
+            asset_cache.put(template_id, pn, vk, out.get(pn), ver, role)
+    return out
+
+
+def _has_image(expr) -> dict:
+    """Aggregation test: `expr` is a non-empty string (missing, null and ""
+    all count as no image)."""
+    return {"$gt": [{"$strLenCP": {"$ifNull": [expr, ""]}}, 0]}
+
+
+def _fetch_assets(template_id: str, page_numbers: List[int], vk: str) -> List[dict]:
+    wanted, fallback = f"$variants.{vk}", f"$variants.{FALLBACK_VARIANT}"
+    return list(template_assets_col().aggregate([
+        {"$match": {"template_id": template_id, "page_number": {"$in": list(page_numbers)}}},
+        {"$project": {
+            "_id": 0,
+            "page_number": 1,
+            # Only one value per page comes back; with blob refs the
+            # "any" fallback is a few dozen bytes of work server-side.
+            # $cond rather than $ifNull: an empty string must fall through.
+            "image": {"$cond": [_has_image(wanted), wanted, {"$cond": [
+                _has_image(fallback), fallback,
+                {"$arrayElemAt": [
+                    {"$map": {
+                        "input": {"$filter": {
+                            "input": {"$objectToArray": {"$ifNull": ["$variants", {}]}},
+                            "cond": _has_image("$$this.v"),
+                        }},
+                        "in": "$$this.v",
+                    }},
+                    0,
+                ]},
+            ]}]},
+        }},
+    ]))
+
+
+def _variant_keys_expr() -> dict:
+    """Aggregation expression listing the keys of `variants` (never the values)."""
+    return {"$map": {
+        "input": {"$objectToArray": {"$ifNull": ["$variants", {}]}},
+        "in": "$$this.k",
+    }}
+
+
+def _asset_update(gender: str, age_group: str, image_data_url: str) -> list:
+    # Pipeline update so `rendered_variants` — the keys-only coverage index
+    # status checks read instead of `variants` — is seeded from the existing
+    # keys the first time a pre-index doc is written to.
+    now = datetime.now(timezone.utc)
+    vk = _vkey(gender, age_group)
+    return [{"$set": {
+        f"variants.{vk}": {"$literal": blob_store.put_data_url(image_data_url)},
+        "rendered_variants": {"$setUnion": [
+            {"$ifNull": ["$rendered_variants", _variant_keys_expr()]}, [vk],
+        ]},
+        "updated_at": now,
+        "created_at": {"$ifNull": ["$created_at", now]},
+    }}]
 
 
 def save_asset(
@@ -75,30 +175,98 @@ def save_asset(
     try:
         template_assets_col().update_one(
             {"template_id": template_id, "page_number": page_number},
-            {
-                "$set": {
-                    f"variants.{_vkey(gender, age_group)}": image_data_url,
-                    "updated_at": datetime.now(timezone.utc),
-                },
-                "$setOnInsert": {"created_at": datetime.now(timezone.utc)},
-            },
+            _asset_update(gender, age_group, image_data_url),
             upsert=True,
         )
     except Exception as e:
         logger.error(f"save_asset failed: {e}")
+    finally:
+        asset_cache.invalidate(template_id)
+
+
+def save_assets(template_id: str, items: List[tuple]) -> int:
+    """Write several variants in one round trip.
+
+    `items` is a list of (page_number, gender, age_group, image_data_url).
+    Returns how many were written; on a bulk failure falls back to
+    save_asset one by one so a single bad page doesn't lose the rest.
+    """
+    if not items:
+        return 0
+    try:
+        from pymongo import UpdateOne
+        template_assets_col().bulk_write(
+            [
+                UpdateOne(
+                    {"template_id": template_id, "page_number": page_number},
+                    _asset_update(gender, age_group, image_data_url),
+                    upsert=True,
+                )
+                for page_number, gender, age_group, image_data_url in items
+            ],
+            ordered=False,
+        )
+        asset_cache.invalidate(template_id)
+        return len(items)
+    except Exception as e:
+        logger.warning(f"save_assets bulk write failed ({e}) — saving one by one")
+    for item in items:
+        save_asset(template_id, *item)
+    return len(items)
+
+
+def _coverage(match: dict) -> Dict[str, Dict[int, List[str]]]:
+    """template_id -> page_number -> rendered variant keys, for every asset
+    doc matching `match`. Served from `rendered_variants`; docs saved before
+    that field existed have their keys listed server-side with
+    $objectToArray (no image data leaves Mongo) and get it backfilled."""
+    col = template_assets_col()
+    out: Dict[str, Dict[int, List[str]]] = {}
+    for doc in col.find(
+        {**match, "rendered_variants": {"$exists": True}},
+        {"template_id": 1, "page_number": 1, "rendered_variants": 1},
+    ):
+        out.setdefault(doc["template_id"], {})[doc["page_number"]] = sorted(
+            doc.get("rendered_variants") or []
+        )
+    legacy = list(col.aggregate([
+        {"$match": {**match, "rendered_variants": {"$exists": False}}},
+        {"$project": {
+            "template_id": 1,
+            "page_number": 1,
+            "keys": _variant_keys_expr(),
+        }},
+    ]))
+    for doc in legacy:
+        keys = sorted(doc.get("keys") or [])
+        out.setdefault(doc["template_id"], {})[doc["page_number"]] = keys
+        try:
+            col.update_one(
+                {"_id": doc["_id"], "rendered_variants": {"$exists": False}},
+                {"$addToSet": {"rendered_variants": {"$each": keys}}},
+            )
+        except Exception as e:
+            logger.debug(f"rendered_variants backfill failed: {e}")
+    return out
 
 
 def asset_status(template_id: str) -> Dict[int, List[str]]:
     """Map page_number -> list of variant keys already rendered."""
-    status: Dict[int, List[str]] = {}
     try:
-        for doc in template_assets_col().find(
-            {"template_id": template_id}, {"page_number": 1, "variants": 1}
-        ):
-            status[doc["page_number"]] = sorted((doc.get("variants") or {}).keys())
+        return _coverage({"template_id": template_id}).get(template_id, {})
     except Exception as e:
         logger.warning(f"asset_status failed: {e}")
-    return status
+        return {}
+
+
+def asset_status_all(template_ids: List[str]) -> Dict[str, Dict[int, List[str]]]:
+    """asset_status for several templates in one query (Studio overview)."""
+    try:
+        out = _coverage({"template_id": {"$in": list(template_ids)}})
+    except Exception as e:
+        logger.warning(f"asset_status_all failed: {e}")
+        out = {}
+    return {tid: out.get(tid, {}) for tid in template_ids}
 
 
 def template_coverage(template_id: str, gender: str, age: int) -> tuple:
@@ -143,30 +311,47 @@ def generate_assets_for_template(
                 if overwrite or _vkey(gender, group) not in existing:
                     jobs.append((page, gender, group))
 
+    prompts = [
+        personalize_template_image_prompt(
+            page["image_prompt_template"], _NEUTRAL_NAME.get(gender, "Aarav"), gender,
+            _GROUP_AGE.get(group, 5),
+        )
+        for page, gender, group in jobs
+    ]
+
+    # Rendered together on vertex_async's event loop; how many actually hit
+    # Vertex at once is up to adaptive_concurrency. Progress and saves stay
+    # on the calling thread.
     rendered, failed = 0, 0
+    render_s, attempts, by_model = 0.0, 0, {}
     total = len(jobs)
-    for i, (page, gender, group) in enumerate(jobs):
-        name = _NEUTRAL_NAME.get(gender, "Aarav")
-        age = _GROUP_AGE.get(group, 5)
-        prompt = personalize_template_image_prompt(
-            page["image_prompt_template"], name, gender, age
-        )
+    results = iter_page_image_results(prompts, None, openrouter_key=openrouter_key)
+    for i, (j, res) in enumerate(results):
+        page, gender, group = jobs[j]
         if progress_cb:
             progress_cb(
-                f"Page {page['page_number']} — {gender}, age {group}", i / max(total, 1)
+                f"Page {page['page_number']} — {gender}, age {group} "
+                f"({adaptive_concurrency.current_limit()} in parallel)",
+                (i + 1) / max(total, 1),
             )
         try:
-            image_url = generate_page_image(api_key, prompt, None, openrouter_key=openrouter_key)
-            if image_url:
+            render_s += res.wall_time_s
+            attempts += len(res.attempts)
+            if res.ok:
                 save_asset(
                     template_id,
                     page["page_number"],
                     gender,
                     group,
-                    compress_image_for_storage(image_url),
+                    compress_image_for_storage(res.data_url),
                 )
                 rendered += 1
+                by_model[res.model] = by_model.get(res.model, 0) + 1
             else:
+                logger.warning(
+                    f"Asset render failed (p{page['page_number']} {gender} {group}): "
+                    f"{res.error_summary() or 'no image'}"
+                )
                 failed += 1
         except Exception as e:
             logger.error(f"Asset render failed (p{page['page_number']} {gender} {group}): {e}")
@@ -174,7 +359,8 @@ def generate_assets_for_template(
     if progress_cb:
         progress_cb("Done", 1.0)
     return {"rendered": rendered, "failed": failed, "skipped": total - rendered - failed,
-            "total_jobs": total}
+            "total_jobs": total, "render_s": round(render_s, 1), "attempts": attempts,
+            "models": by_model}
 
 
 # ---------------------------------------------------------------------------
@@ -196,19 +382,19 @@ def build_book_from_assets(
     template = next(
         (t for t in get_available_templates() if t["id"] == template_id), {}
     )
+    # Templates that ship a real photo (e.g. Legends — Wikipedia Commons
+    # portraits) skip the AI asset lookup entirely. This makes the page
+    # show the actual person instead of a random AI-generated face, and
+    # avoids the cost of pre-rendering for those pages.
+    assets = get_assets(
+        template_id,
+        [p["page_number"] for p in pages if not p.get("static_image_url")],
+        gender, age,
+    )
     book_pages = []
     for page in pages:
-        # Templates that ship a real photo (e.g. Legends — Wikipedia Commons
-        # portraits) skip the AI asset lookup entirely. This makes the page
-        # show the actual person instead of a random AI-generated face, and
-        # avoids the cost of pre-rendering for those pages.
         static_url = page.get("static_image_url")
-        if static_url:
-            page_image_url = static_url
-        else:
-            page_image_url = get_asset(
-                template_id, page["page_number"], gender, age
-            )
+        page_image_url = static_url or assets.get(page["page_number"])
         book_pages.append(
             {
                 "page_number": page["page_number"],
@@ -244,32 +430,55 @@ def personalize_book_with_photo(
     reference_image_base64: str,
     openrouter_key: str = "",
     progress_cb: Optional[Callable[[str, float], None]] = None,
+    hedge: bool = False,
+    deadline=None,
+    on_page: Optional[Callable[[int, dict], None]] = None,
 ) -> dict:
     """Re-render every page with the child's photo as reference.
 
+    Pages are rendered together on vertex_async's event loop
+    (adaptive_concurrency decides how many hit Vertex at once).
+    As each page finishes — in any order — `progress_cb` is called on the
+    calling thread, and so is `on_page(index, page)` for each page that
+    was actually re-rendered with the photo, so a Streamlit caller can
+    draw it straight away.
+
     Falls back to the pre-rendered asset image when generation fails, so the
-    customer always gets a complete book.
+    customer always gets a complete book. hedge=True hedges slow renders.
+    Once `deadline` (deadlines.Deadline) is spent, the remaining pages keep
+    their asset image too.
     """
+    deadline = deadline or deadlines.NO_DEADLINE
     pages = book_data.get("pages", [])
     total = len(pages)
-    for i, page in enumerate(pages):
-        if progress_cb:
-            progress_cb(f"Illustrating page {i + 1} of {total}…", i / max(total, 1))
-        # Pages backed by a real photo (Wikipedia portraits) skip the photo
-        # personalisation — the legend image stays as the real person.
-        if page.get("static_image_url"):
-            continue
+
+    if progress_cb:
+        progress_cb(f"Illustrating {total} pages…", 0.0)
+    # Pages backed by a real photo (Wikipedia portraits) skip the photo
+    # personalisation — the legend image stays as the real person.
+    todo = [(i, p) for i, p in enumerate(pages) if not p.get("static_image_url")]
+    done = total - len(todo)
+    results = iter_page_image_results(
+        [p.get("image_prompt", "") for _, p in todo], reference_image_base64,
+        openrouter_key=openrouter_key, hedge=hedge, deadline=deadline,
+    )
+    for j, res in results:
+        i = todo[j][0]
+        new_url = None
         try:
-            new_url = generate_page_image(
-                api_key,
-                page.get("image_prompt", ""),
-                reference_image_base64,
-                openrouter_key=openrouter_key,
-            )
-            if new_url:
-                page["image_url"] = compress_image_for_storage(new_url)
+            if res.ok:
+                new_url = compress_image_for_storage(res.data_url)
+                pages[i]["image_url"] = new_url
+            elif res.deadline_exceeded:
+                logger.warning(f"Photo personalization: {deadline.describe()}, page {i + 1} keeps its asset image")
         except Exception as e:
             logger.warning(f"Photo personalization failed on page {i + 1}: {e}")
+        done += 1
+        # A failed page still shows the generic asset — nothing new to show
+        if on_page and new_url:
+            on_page(i, pages[i])
+        if progress_cb:
+            progress_cb(f"Illustrated {done} of {total} pages…", done / max(total, 1))
     if progress_cb:
         progress_cb("Done", 1.0)
     book_data["reference_image_base64"] = reference_image_base64
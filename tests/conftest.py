@@ -0,0 +1,69 @@
+import sys
+import threading
+import uuid
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+
+class FakeClock:
+    """Stands in for a module's `time`: monotonic() only moves when sleep()
+    or advance() is called. `on_sleep` runs before each sleep."""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+        self.slept = []
+        self.on_sleep = None
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        if self.on_sleep is not None:
+            self.on_sleep(seconds)
+        self.slept.append(seconds)
+        self.now += max(0.0, seconds)
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """scripts/stub_backends.py on a free local port, with vertex_client
+    pointed at it and the image cache off. Yields its CONFIG to tweak."""
+    pytest.importorskip("requests")
+    pytest.importorskip("dotenv")
+    import image_cache
+    import stub_backends
+    stub_backends._build_images(16, False)
+    monkeypatch.setitem(stub_backends.CONFIG, "latency", {"image": "fixed:0", "text": "fixed:0"})
+    monkeypatch.setitem(stub_backends.CONFIG, "p429", {})
+    monkeypatch.setitem(stub_backends.CONFIG, "p5xx", {})
+    monkeypatch.setitem(stub_backends.CONFIG, "dead_models", [])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub_backends.Handler)
+    server.daemon_threads = True
+    server.verbose = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("VERTEX_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setenv("VERTEX_STUB_TOKEN", "stub")
+    # Fresh project per test: model_registry remembers dead models per project
+    monkeypatch.setenv("VERTEX_PROJECT_ID", f"stub-{uuid.uuid4().hex[:8]}")
+    monkeypatch.setenv("VERTEX_LOCATION", "us-central1")
+    monkeypatch.setattr(image_cache, "ENABLED", False)
+    yield stub_backends.CONFIG
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,126 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import adaptive_concurrency as ac
+
+
+def _attempt(status: str, latency_s: float = 1.0):
+    return SimpleNamespace(status=status, latency_s=latency_s)
+
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+    monkeypatch.setattr(ac, "MIN_LIMIT", 1)
+    monkeypatch.setattr(ac, "MAX_LIMIT", 8)
+    monkeypatch.setattr(ac, "BACKOFF", 0.5)
+    monkeypatch.setattr(ac, "COOLDOWN_S", 10.0)
+    monkeypatch.setattr(ac, "LATENCY_TARGET_S", 60.0)
+    monkeypatch.setattr(ac, "_limit", 2.0)
+    monkeypatch.setattr(ac, "_in_flight", 0)
+    monkeypatch.setattr(ac, "_last_decrease", -1e9)
+    monkeypatch.setattr(ac, "_stats", dict(ac._stats, acquired=0, queued=0, wait_s=0.0, timeouts=0,
+                                           increases=0, decreases=0, peak_in_flight=0))
+
+
+def test_acquire_up_to_limit_then_time_out():
+    assert ac.acquire(timeout=0.01)
+    assert ac.acquire(timeout=0.01)
+    assert not ac.acquire(timeout=0.05)
+    stats = ac.concurrency_stats()
+    assert stats["in_flight"] == 2
+    assert stats["timeouts"] == 1
+    assert stats["peak_in_flight"] == 2
+
+
+def test_release_wakes_a_waiter():
+    ac.acquire()
+    ac.acquire()
+    got = []
+    t = threading.Thread(target=lambda: got.append(ac.acquire(timeout=5)))
+    t.start()
+    ac.release()
+    t.join(5)
+    assert got == [True]
+    assert ac.concurrency_stats()["queued"] == 1
+
+
+def test_release_without_attempt_keeps_limit():
+    ac.acquire()
+    ac.release(None)
+    assert ac.concurrency_stats()["limit_exact"] == 2.0
+    assert ac.concurrency_stats()["in_flight"] == 0
+
+
+def test_429_halves_limit_once_per_cooldown(monkeypatch):
+    monkeypatch.setattr(ac, "_limit", 8.0)
+    for _ in range(3):
+        ac.acquire()
+    ac.release(_attempt("429"))
+    assert ac.current_limit() == 4
+    ac.release(_attempt("429"))
+    assert ac.current_limit() == 4
+    monkeypatch.setattr(ac, "_last_decrease", -1e9)
+    ac.release(_attempt("ReadTimeout"))
+    assert ac.current_limit() == 2
+    stats = ac.concurrency_stats()
+    assert stats["decreases"] == 2
+    assert stats["last_decrease_reason"] == "timeout"
+
+
+def test_never_below_min(monkeypatch):
+    monkeypatch.setattr(ac, "_limit", 1.0)
+    ac.acquire()
+    ac.release(_attempt("429"))
+    assert ac.current_limit() == 1
+
+
+def test_grows_only_when_saturated():
+    ac.acquire()
+    ac.acquire()
+    # The other slot is still busy: we were at the limit
+    ac.release(_attempt("200"))
+    assert ac.concurrency_stats()["limit_exact"] == 2.5
+    # Alone now: an idle limit learns nothing
+    ac.release(_attempt("200"))
+    assert ac.concurrency_stats()["limit_exact"] == 2.5
+
+
+def test_slow_success_does_not_grow():
+    ac.acquire()
+    ac.acquire()
+    ac.release(_attempt("200", latency_s=90))
+    assert ac.concurrency_stats()["limit_exact"] == 2.0
+
+
+def test_growth_capped_at_max(monkeypatch):
+    monkeypatch.setattr(ac, "_limit", 8.0)
+    for _ in range(8):
+        ac.acquire()
+    ac.release(_attempt("200"))
+    assert ac.concurrency_stats()["limit_exact"] == 8.0
+
+
+def test_other_errors_leave_limit_alone():
+    ac.acquire()
+    ac.acquire()
+    ac.release(_attempt("500"))
+    ac.release(_attempt("404"))
+    assert ac.concurrency_stats()["limit_exact"] == 2.0
+
+
+def test_acquire_async_shares_the_slots():
+    import asyncio
+    ac.acquire()
+    ac.acquire()
+    assert not asyncio.run(ac.acquire_async(timeout=0.05))
+
+    async def _freed_later():
+        asyncio.get_running_loop().call_later(0.05, ac.release)
+        return await ac.acquire_async(timeout=2)
+
+    assert asyncio.run(_freed_later())
+    stats = ac.concurrency_stats()
+    assert stats["in_flight"] == 2
+    assert (stats["timeouts"], stats["queued"]) == (1, 1)
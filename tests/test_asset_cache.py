@@ -0,0 +1,117 @@
+import sys
+import types
+from collections import OrderedDict
+
+import pytest
+
+import asset_cache
+
+
+class FakeAssets:
+    """template_assets_col() stand-in: find_one returns the newest
+    updated_at set on it (or raises)."""
+
+    def __init__(self):
+        self.updated_at = None
+        self.fail = False
+        self.queries = 0
+
+    def find_one(self, *args, **kwargs):
+        self.queries += 1
+        if self.fail:
+            raise RuntimeError("mongo down")
+        return None if self.updated_at is None else {"updated_at": self.updated_at}
+
+
+@pytest.fixture
+def assets(monkeypatch, clock):
+    col = FakeAssets()
+    fake = types.ModuleType("mongo_client")
+    fake.template_assets_col = lambda: col
+    monkeypatch.setitem(sys.modules, "mongo_client", fake)
+    monkeypatch.setattr(asset_cache, "time", clock)
+    monkeypatch.setattr(asset_cache, "BUDGET_BYTES", 4000)
+    monkeypatch.setattr(asset_cache, "CHECK_S", 30.0)
+    monkeypatch.setattr(asset_cache, "_entries", OrderedDict())
+    monkeypatch.setattr(asset_cache, "_bytes", 0)
+    monkeypatch.setattr(asset_cache, "_versions", {})
+    monkeypatch.setattr(asset_cache, "_watermarks", {})
+    monkeypatch.setattr(asset_cache, "_stats", dict.fromkeys(asset_cache._stats, 0))
+    return col
+
+
+def test_put_then_get(assets):
+    ver = asset_cache.version("t1")
+    assert asset_cache.is_miss(asset_cache.get("t1", 1, "boy"))
+    asset_cache.put("t1", 1, "boy", "data:image/png;base64,AAA", ver)
+    assert asset_cache.get("t1", 1, "boy") == "data:image/png;base64,AAA"
+    assert asset_cache.is_miss(asset_cache.get("t1", 1, "boy", role="card"))
+    assert asset_cache.is_miss(asset_cache.get("t1", 2, "boy"))
+
+
+def test_no_asset_is_cached_too(assets):
+    asset_cache.put("t1", 1, "girl", None, asset_cache.version("t1"))
+    value = asset_cache.get("t1", 1, "girl")
+    assert value is None and not asset_cache.is_miss(value)
+
+
+def test_invalidate_drops_entries(assets):
+    asset_cache.put("t1", 1, "boy", "a" * 100, asset_cache.version("t1"))
+    asset_cache.put("t2", 1, "boy", "b" * 100, asset_cache.version("t2"))
+    asset_cache.invalidate("t1")
+    assert asset_cache.version("t1") == 1
+    assert asset_cache.is_miss(asset_cache.get("t1", 1, "boy"))
+    assert asset_cache.get("t2", 1, "boy") == "b" * 100
+    assert asset_cache.cache_stats()["bytes"] == 100
+
+
+def test_put_read_before_a_save_is_dropped(assets):
+    ver = asset_cache.version("t1")
+    # save_asset lands between our Mongo read and the put
+    asset_cache.invalidate("t1")
+    asset_cache.put("t1", 1, "boy", "stale", ver)
+    assert asset_cache.is_miss(asset_cache.get("t1", 1, "boy"))
+    asset_cache.put("t1", 1, "boy", "fresh", asset_cache.version("t1"))
+    assert asset_cache.get("t1", 1, "boy") == "fresh"
+
+
+def test_lru_eviction(assets):
+    ver = asset_cache.version("t1")
+    for page in (1, 2, 3):
+        asset_cache.put("t1", page, "boy", str(page) * 900, ver)
+    asset_cache.get("t1", 1, "boy")
+    asset_cache.put("t1", 4, "boy", "4" * 900, ver)
+    asset_cache.put("t1", 5, "boy", "5" * 900, ver)
+    assert asset_cache.is_miss(asset_cache.get("t1", 2, "boy"))
+    assert asset_cache.get("t1", 1, "boy") == "1" * 900
+    assert asset_cache.cache_stats()["evictions"] == 1
+    # Bigger than a quarter of the budget: never cached
+    asset_cache.put("t1", 6, "boy", "6" * 1001, ver)
+    assert asset_cache.is_miss(asset_cache.get("t1", 6, "boy"))
+
+
+def test_save_on_another_server_invalidates(assets, clock):
+    assets.updated_at = "2026-01-01T00:00:00"
+    ver = asset_cache.version("t1")
+    asset_cache.put("t1", 1, "boy", "old", ver)
+    assets.updated_at = "2026-01-02T00:00:00"
+    # Within CHECK_S the watermark isn't re-read
+    assert asset_cache.version("t1") == ver
+    assert asset_cache.get("t1", 1, "boy") == "old"
+    assert assets.queries == 1
+    clock.advance(31)
+    assert asset_cache.version("t1") == ver + 1
+    assert asset_cache.is_miss(asset_cache.get("t1", 1, "boy"))
+    assert asset_cache.cache_stats()["remote_invalidations"] == 1
+    clock.advance(31)
+    assert asset_cache.version("t1") == ver + 1
+
+
+def test_watermark_errors_keep_serving(assets, clock):
+    ver = asset_cache.version("t1")
+    asset_cache.put("t1", 1, "boy", "old", ver)
+    assets.fail = True
+    clock.advance(31)
+    assert asset_cache.version("t1") == ver
+    assert asset_cache.get("t1", 1, "boy") == "old"
+    assert asset_cache.cache_stats()["check_errors"] == 1
@@ -0,0 +1,158 @@
+import base64
+
+import pytest
+
+import blob_store
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"a" * 32
+JPEG = b"\xff\xd8\xff" + b"b" * 32
+
+
+def _url(data: bytes) -> str:
+    return blob_store._data_url(data)
+
+
+class CountingDisk(blob_store._DiskBackend):
+    """Disk backend that records batched reads and can leave keys out of them."""
+
+    def __init__(self):
+        self.batches = []
+        self.omit = set()
+        self.fail = False
+
+    def get_many(self, keys):
+        self.batches.append(list(keys))
+        if self.fail:
+            raise OSError("boom")
+        return {k: v for k, v in super().get_many(keys).items() if k not in self.omit}
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    backend = CountingDisk()
+    monkeypatch.setattr(blob_store, "STORE_DIR", tmp_path)
+    monkeypatch.setattr(blob_store, "BACKEND", "disk")
+    monkeypatch.setattr(blob_store, "_backend", backend)
+    monkeypatch.setattr(blob_store, "_known", set())
+    monkeypatch.setattr(blob_store, "_stats", dict.fromkeys(blob_store._stats, 0))
+    return backend
+
+
+def test_put_is_content_addressed(store, tmp_path):
+    ref = blob_store.put(PNG, renditions=False)
+    assert blob_store.is_ref(ref)
+    assert blob_store.put(PNG, renditions=False) == ref
+    assert blob_store.get(ref) == PNG
+    key = blob_store.key_of(ref)
+    assert (tmp_path / key[:2] / key[2:]).read_bytes() == PNG
+    stats = blob_store.blob_stats()
+    assert (stats["puts"], stats["dedup"], stats["bytes_written"]) == (1, 1, len(PNG))
+
+
+def test_dedup_against_existing_file(store):
+    ref = blob_store.put(PNG, renditions=False)
+    blob_store._known.clear()
+    assert blob_store.put(PNG, renditions=False) == ref
+    assert blob_store.blob_stats()["puts"] == 1
+
+
+def test_put_data_url_and_passthrough(store, monkeypatch):
+    ref = blob_store.put_data_url(_url(JPEG), renditions=False)
+    assert blob_store.get(ref) == JPEG
+    for v in (None, "http://x/y.png", ref):
+        assert blob_store.put_data_url(v) == v
+    monkeypatch.setattr(blob_store, "BACKEND", "off")
+    assert blob_store.put_data_url(_url(PNG)) == _url(PNG)
+
+
+def test_resolve(store):
+    ref = blob_store.put(PNG, renditions=False)
+    assert blob_store.resolve(ref) == _url(PNG)
+    assert blob_store.resolve(_url(JPEG)) == _url(JPEG)
+    assert blob_store.resolve("https://cdn/x.png") == "https://cdn/x.png"
+    assert blob_store.resolve(None) is None
+    assert blob_store.resolve("") is None
+    assert blob_store.resolve(blob_store.REF_PREFIX + "0" * 64) is None
+
+
+def test_resolve_many_keeps_order_in_one_read(store):
+    a = blob_store.put(PNG, renditions=False)
+    b = blob_store.put(JPEG, renditions=False)
+    values = [b, None, _url(JPEG), a, "https://cdn/x.png", b]
+    assert blob_store.resolve_many(values) == [
+        _url(JPEG), None, _url(JPEG), _url(PNG), "https://cdn/x.png", _url(JPEG)]
+    assert store.batches == [sorted({blob_store.key_of(a), blob_store.key_of(b)})]
+
+
+def test_resolve_many_only(store):
+    a = blob_store.put(PNG, renditions=False)
+    b = blob_store.put(JPEG, renditions=False)
+    assert blob_store.resolve_many([a, b, a], only=[1]) == [a, _url(JPEG), a]
+    assert store.batches == [[blob_store.key_of(b)]]
+    assert blob_store.resolve_many([a, b], only=[]) == [a, b]
+    assert len(store.batches) == 1
+
+
+def test_resolve_many_falls_back_for_keys_left_out(store):
+    a = blob_store.put(PNG, renditions=False)
+    b = blob_store.put(JPEG, renditions=False)
+    store.omit.add(blob_store.key_of(b))
+    assert blob_store.resolve_many([a, b]) == [_url(PNG), _url(JPEG)]
+    assert blob_store.blob_stats()["misses"] == 0
+
+
+def test_resolve_many_survives_failed_batch(store):
+    a = blob_store.put(PNG, renditions=False)
+    store.fail = True
+    missing = blob_store.REF_PREFIX + "f" * 64
+    assert blob_store.resolve_many([missing, a]) == [None, _url(PNG)]
+    stats = blob_store.blob_stats()
+    assert stats["errors"] == 1
+    assert stats["misses"] == 1
+
+
+def test_preview_and_print_are_the_original(store):
+    a = blob_store.put(PNG, renditions=False)
+    assert blob_store.resolve_many([a], role="preview") == [_url(PNG)]
+    assert blob_store.resolve(a, role="print") == _url(PNG)
+
+
+def test_scoped_blobs_can_be_deleted(store, tmp_path):
+    ref = blob_store.put(PNG, renditions=False, scope="imgcache")
+    plain = blob_store.put(PNG, renditions=False)
+    assert blob_store.key_of(ref).startswith("imgcache-")
+    assert ref != plain
+    blob_store.delete(ref)
+    assert blob_store.get(ref) is None
+    assert blob_store.get(plain) == PNG
+    # Forgotten as well as removed, so a new put writes it again
+    blob_store.put(PNG, renditions=False, scope="imgcache")
+    assert blob_store.get(ref) == PNG
+    assert blob_store.blob_stats()["puts"] == 3
+
+
+def test_scoped_blob_deleted_by_another_replica_is_rewritten(store):
+    ref = blob_store.put(PNG, renditions=False, scope="imgcache")
+    assert blob_store.key_of(ref) not in blob_store._known
+    # Another replica's delete() never touches this process's state
+    blob_store._backend.delete(blob_store.key_of(ref))
+    assert blob_store.put(PNG, renditions=False, scope="imgcache") == ref
+    assert blob_store.get(ref) == PNG
+    assert blob_store.blob_stats()["puts"] == 2
+
+
+def test_unscoped_blobs_cannot_be_deleted(store):
+    plain = blob_store.put(PNG, renditions=False)
+    with pytest.raises(ValueError):
+        blob_store.delete(plain)
+    with pytest.raises(ValueError):
+        blob_store.delete("not-a-ref")
+    assert blob_store.get(plain) == PNG
+
+
+def test_mime_sniffing():
+    assert blob_store._mime(PNG) == "image/png"
+    assert blob_store._mime(JPEG) == "image/jpeg"
+    assert blob_store._mime(b"RIFF\0\0\0\0WEBPxx") == "image/webp"
+    assert _url(PNG).startswith("data:image/png;base64,")
+    assert base64.b64decode(_url(PNG).split(",", 1)[1]) == PNG
@@ -0,0 +1,104 @@
+import pytest
+
+import circuit_breaker as cb
+
+
+@pytest.fixture(autouse=True)
+def breaker_env(monkeypatch, clock):
+    monkeypatch.setattr(cb, "time", clock)
+    monkeypatch.setattr(cb, "WINDOW_S", 120.0)
+    monkeypatch.setattr(cb, "MIN_REQUESTS", 4)
+    monkeypatch.setattr(cb, "ERROR_RATE", 0.5)
+    monkeypatch.setattr(cb, "OPEN_S", 60.0)
+
+
+def _tripped():
+    b = cb.CircuitBreaker("m", "global")
+    for _ in range(3):
+        assert b.record(False) is None
+    assert b.record(False) == (cb.CLOSED, cb.OPEN)
+    return b
+
+
+def test_needs_min_requests_before_opening():
+    b = cb.CircuitBreaker("m", "global")
+    for _ in range(3):
+        assert b.record(False) is None
+    assert b.state == cb.CLOSED
+    assert b.allow() == (True, None)
+
+
+def test_opens_at_error_rate():
+    b = cb.CircuitBreaker("m", "global")
+    for ok in (True, True, True, False, False):
+        assert b.record(ok) is None
+    # 3 failures out of 6: the failure that crosses the rate trips it
+    assert b.record(False) == (cb.CLOSED, cb.OPEN)
+    assert b.is_open()
+
+
+def test_success_never_opens():
+    b = cb.CircuitBreaker("m", "global")
+    for _ in range(3):
+        b.record(False)
+    # 3 of 4 failed, but only a failure trips the breaker
+    assert b.record(True) is None
+    assert b.state == cb.CLOSED
+
+
+def test_open_rejects_until_cooldown(clock):
+    b = _tripped()
+    assert b.allow() == (False, None)
+    clock.advance(59)
+    assert b.allow() == (False, None)
+    clock.advance(1)
+    assert b.allow() == (True, (cb.OPEN, cb.HALF_OPEN))
+    assert b.state == cb.HALF_OPEN
+
+
+def test_half_open_lets_one_trial_through(clock):
+    b = _tripped()
+    clock.advance(60)
+    assert b.allow()[0]
+    assert b.allow() == (False, None)
+
+
+def test_half_open_success_closes(clock):
+    b = _tripped()
+    clock.advance(60)
+    b.allow()
+    assert b.record(True) == (cb.HALF_OPEN, cb.CLOSED)
+    assert b.snapshot()["window_requests"] == 0
+    assert b.allow() == (True, None)
+
+
+def test_half_open_failure_reopens(clock):
+    b = _tripped()
+    clock.advance(60)
+    b.allow()
+    assert b.record(False) == (cb.HALF_OPEN, cb.OPEN)
+    assert b.allow() == (False, None)
+    clock.advance(60)
+    assert b.allow() == (True, (cb.OPEN, cb.HALF_OPEN))
+
+
+def test_trial_without_verdict_is_replaced(clock):
+    b = _tripped()
+    clock.advance(60)
+    b.allow()
+    clock.advance(30)
+    assert b.allow() == (False, None)
+    clock.advance(30)
+    assert b.allow() == (True, None)
+    assert b.state == cb.HALF_OPEN
+
+
+def test_old_failures_leave_the_window(clock):
+    b = cb.CircuitBreaker("m", "global")
+    for _ in range(3):
+        b.record(False)
+    clock.advance(121)
+    for _ in range(3):
+        assert b.record(True) is None
+    assert b.record(False) is None
+    assert b.snapshot()["error_rate"] == 0.25
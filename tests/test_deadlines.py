@@ -0,0 +1,78 @@
+import math
+
+import pytest
+
+import deadlines
+from deadlines import Deadline
+
+
+@pytest.fixture(autouse=True)
+def deadline_env(monkeypatch, clock):
+    monkeypatch.setattr(deadlines, "time", clock)
+    monkeypatch.setattr(deadlines, "MIN_CALL_S", 15.0)
+    monkeypatch.setattr(deadlines, "PAGE_DEADLINE_S", 240.0)
+
+
+def test_unlimited():
+    for budget in (None, 0, -5):
+        d = Deadline(budget)
+        assert d.budget_s is None
+        assert math.isinf(d.remaining())
+        assert not d.expired()
+        assert d.timeout(180) == 180
+        assert d.wait_budget(30) == 30
+    assert "unlimited" in Deadline(None, "book").describe()
+
+
+def test_remaining_and_expiry(clock):
+    d = Deadline(100, "book")
+    clock.advance(40)
+    assert d.remaining() == pytest.approx(60)
+    assert d.elapsed() == pytest.approx(40)
+    clock.advance(70)
+    assert d.remaining() == 0
+    assert d.expired()
+
+
+def test_child_is_capped_by_parent(clock):
+    book = Deadline(300, "book")
+    assert book.child().budget_s == pytest.approx(240)
+    clock.advance(200)
+    page = book.child(label="page 3")
+    assert page.budget_s == pytest.approx(100)
+    assert page.label == "page 3"
+    clock.advance(100)
+    # A spent parent still hands out a (tiny) positive budget
+    assert book.child().budget_s == pytest.approx(0.001)
+
+
+def test_child_of_unlimited_gets_page_budget():
+    assert Deadline(None).child().budget_s == pytest.approx(240)
+    assert Deadline(None).child(30).budget_s == pytest.approx(30)
+
+
+def test_can_start_leaves_room_for_a_call(clock):
+    d = Deadline(100)
+    assert d.can_start()
+    clock.advance(86)
+    assert not d.can_start()
+    assert d.can_start(min_s=5)
+
+
+def test_timeout_and_wait_budget(clock):
+    d = Deadline(100)
+    assert d.timeout(180) == pytest.approx(100)
+    assert d.wait_budget(180) == pytest.approx(85)
+    clock.advance(99.5)
+    assert d.timeout(180) == 1.0
+    assert d.wait_budget(180) == 0.0
+
+
+def test_sleep_refuses_without_room(clock):
+    d = Deadline(30)
+    assert d.sleep(10)
+    assert clock.slept == [10]
+    assert d.sleep(10)
+    assert clock.slept == [10, 5]
+    assert not d.sleep(10)
+    assert clock.slept == [10, 5]
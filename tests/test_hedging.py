@@ -0,0 +1,137 @@
+import base64
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+import vertex_client as vc  # noqa: E402
+
+URL = "http://stub.invalid/unused"
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(vc, "_hedge_stats", {"image_requests": 100, "hedges_sent": 0, "hedge_wins": 0})
+    monkeypatch.setattr(vc, "_latency_percentile", lambda model, pct: 0.05)
+    monkeypatch.setattr(vc.circuit_breaker, "allow", lambda model, endpoint: True)
+    calls = []
+
+    def install(outcomes):
+        """outcomes: model -> (seconds, data, error)."""
+        def _attempt(project, model, endpoint, url, headers, payload, cancelled, res,
+                     deadline=vc.deadlines.NO_DEADLINE):
+            calls.append((model, endpoint, cancelled))
+            seconds, data, err = outcomes[model]
+            time.sleep(seconds)
+            return data, err
+        monkeypatch.setattr(vc, "_image_attempt", _attempt)
+        return calls
+
+    return install
+
+
+PLAN = [
+    ("m1", [("global", URL), ("us-central1", URL)]),
+    ("m2", [("global", URL)]),
+]
+
+
+def test_fast_primary_sends_no_hedge(hedging):
+    calls = hedging({"m1": (0, "img1", None), "m2": (0, "img2", None)})
+    res = vc.ImageCallResult()
+    won, tried = vc._hedged_image("p", PLAN, {}, {}, res)
+    assert won == ("img1", "m1", "global")
+    assert tried == {"m1"}
+    assert not res.hedged
+    time.sleep(0.1)
+    assert [c[0] for c in calls] == ["m1"]
+    assert vc.hedge_stats()["hedges_sent"] == 0
+
+
+def test_backup_goes_to_another_model_and_wins(hedging):
+    hedging({"m1": (0.3, None, "m1: HTTP 500"), "m2": (0, "img2", None)})
+    res = vc.ImageCallResult()
+    won, tried = vc._hedged_image("p", PLAN, {}, {}, res)
+    assert won == ("img2", "m2", "global")
+    assert tried == {"m1", "m2"}
+    assert res.hedged
+    assert res.errors == ["m1: HTTP 500"]
+    assert vc.hedge_stats()["hedge_wins"] == 1
+
+
+def test_primary_win_cancels_backup(hedging):
+    calls = hedging({"m1": (0.2, "img1", None), "m2": (0.5, "img2", None)})
+    res = vc.ImageCallResult()
+    won, tried = vc._hedged_image("p", PLAN, {}, {}, res)
+    assert won == ("img1", "m1", "global")
+    assert tried == {"m1", "m2"}
+    assert [c[0] for c in calls] == ["m1", "m2"]
+    assert calls[1][2].is_set()
+    assert vc.hedge_stats()["hedge_wins"] == 0
+
+
+def test_both_legs_fail(hedging):
+    hedging({"m1": (0.2, None, "m1: HTTP 500"), "m2": (0, None, "m2: HTTP 503")})
+    res = vc.ImageCallResult()
+    won, tried = vc._hedged_image("p", PLAN, {}, {}, res)
+    assert won is None
+    assert tried == {"m1", "m2"}
+    assert sorted(res.errors) == ["m1: HTTP 500", "m2: HTTP 503"]
+
+
+def test_no_hedge_without_budget(hedging, monkeypatch):
+    monkeypatch.setattr(vc, "_hedge_stats", {"image_requests": 0, "hedges_sent": 0, "hedge_wins": 0})
+    calls = hedging({"m1": (0.2, None, "m1: HTTP 500"), "m2": (0, "img2", None)})
+    res = vc.ImageCallResult()
+    won, tried = vc._hedged_image("p", PLAN, {}, {}, res)
+    assert won is None
+    assert tried == {"m1"}
+    assert [c[0] for c in calls] == ["m1"]
+
+
+# ---------------------------------------------------------------------------
+# Against scripts/stub_backends.py (the `stub` fixture in conftest)
+# ---------------------------------------------------------------------------
+
+def test_generate_image_from_stub(stub):
+    res = vc.generate_image("a fox in a scarf", force_fresh=True)
+    assert res.ok
+    assert res.model == vc._GEMINI_IMAGE_MODELS[0]
+    assert [a.status for a in res.attempts] == ["200"]
+    assert base64.b64decode(res.data_b64).startswith(b"\x89PNG")
+
+
+def test_dead_model_falls_through_to_next(stub):
+    dead = vc._GEMINI_IMAGE_MODELS[0]
+    stub["dead_models"] = [dead]
+    res = vc.generate_image("a fox in a scarf", force_fresh=True)
+    assert res.ok
+    assert res.model != dead
+    assert "404" in [a.status for a in res.attempts if a.model == dead]
+
+
+def test_hedged_call_against_stub(stub):
+    res = vc.generate_image("a fox in a scarf", hedge=True, force_fresh=True)
+    assert res.ok
+    assert res.model == vc._GEMINI_IMAGE_MODELS[0]
+
+
+def test_worker_runs_on_the_callers_config(stub, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    cfg = vc.session_config()
+    # What a worker would see on its own: nothing usable
+    monkeypatch.setenv("VERTEX_BASE_URL", "http://127.0.0.1:9")
+
+    def _render():
+        with vc.use_config(cfg):
+            assert vc._cfg() is cfg
+            return vc.generate_image("a fox in a scarf", force_fresh=True)
+
+    with ThreadPoolExecutor(1) as pool:
+        res = pool.submit(_render).result()
+    assert res.ok
+    assert vc._cfg()["base_url"] == "http://127.0.0.1:9"
+    with vc.use_config(None):
+        assert vc._cfg()["base_url"] == "http://127.0.0.1:9"
@@ -0,0 +1,74 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+import http_pool  # noqa: E402
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    """Sets a cookie on every response and echoes the Cookie header back."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({"cookie": self.headers.get("Cookie")}).encode()
+        self.send_response(200)
+        self.send_header("Set-Cookie", "session=customer-a; Path=/")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    monkeypatch.setattr(http_pool, "_sessions", {})
+    monkeypatch.setattr(http_pool, "_requests_by_host", {})
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), CookieHandler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_one_session_per_host():
+    a = http_pool.get_session("https://aiplatform.googleapis.com/v1/x")
+    assert http_pool.get_session("https://aiplatform.googleapis.com/v1/y") is a
+    assert http_pool.get_session("https://openrouter.ai/api/v1") is not a
+    assert http_pool.get_session("http://aiplatform.googleapis.com/v1/x") is not a
+
+
+def test_timeout_normalisation():
+    assert http_pool._timeout(None) == (http_pool.CONNECT_TIMEOUT, http_pool.READ_TIMEOUT)
+    assert http_pool._timeout((3, 7)) == (3, 7)
+    assert http_pool._timeout(180) == (min(http_pool.CONNECT_TIMEOUT, 180.0), 180.0)
+    assert http_pool._timeout(2) == (2.0, 2.0)
+
+
+def test_cookies_are_never_stored(server):
+    first = http_pool.get(f"{server}/orders/1", timeout=5)
+    assert "session" in first.headers["Set-Cookie"]
+    second = http_pool.get(f"{server}/orders/2", timeout=5)
+    assert second.json() == {"cookie": None}
+    assert len(http_pool.get_session(server).cookies) == 0
+
+
+def test_connection_reused(server):
+    for i in range(3):
+        assert http_pool.get(f"{server}/ping/{i}", timeout=5).status_code == 200
+    stats = http_pool.pool_stats()[server]
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["reused"] == 2
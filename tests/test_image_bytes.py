@@ -0,0 +1,109 @@
+import io
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image  # noqa: E402
+
+import image_bytes  # noqa: E402
+from image_bytes import EncodedImage  # noqa: E402
+
+
+def _encoded(size, format="PNG", **kw) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 40, 90)).save(buf, format=format, **kw)
+    return buf.getvalue()
+
+
+def test_header_only_probe():
+    enc = EncodedImage(_encoded((320, 200)))
+    assert (enc.format, enc.size, enc.mime_type) == ("PNG", (320, 200), "image/png")
+    assert enc._pil is None
+
+
+def test_b64_and_data_url_round_trip():
+    data = _encoded((10, 10), "JPEG")
+    enc = EncodedImage(data)
+    again = EncodedImage.from_data_url(enc.data_url)
+    assert again.data == data
+    assert again.mime_type == "image/jpeg"
+    assert EncodedImage.from_b64(enc.b64).b64 is enc.b64
+    assert EncodedImage.from_data_url("https://cdn/x.png") is None
+    assert EncodedImage.from_data_url(None) is None
+
+
+def test_pil_is_decoded_once_and_pinned():
+    enc = EncodedImage(_encoded((40, 30)))
+    img = enc.pil
+    assert enc.pil is img
+    assert image_bytes.encoded_of(img) is enc
+    # Derived images carry nothing, so a stale encoding is never reused
+    assert image_bytes.encoded_of(img.copy()) is None
+    assert image_bytes.encoded_of(img.convert("L")) is None
+
+
+def test_ensure_encoded_encodes_once():
+    img = Image.new("RGB", (50, 50), (1, 2, 3))
+    enc = image_bytes.ensure_encoded(img)
+    assert getattr(img, image_bytes._ATTR) is enc
+    assert image_bytes.ensure_encoded(img) is enc
+    assert enc.format == "JPEG"
+
+
+def test_compact_jpeg_passes_through_storage():
+    data = _encoded((700, 500), "JPEG", quality=75)
+    img = image_bytes.decode_data_url(EncodedImage(data).data_url)
+    # Loaded from storage and saved again: the stored bytes, not a re-encode
+    assert image_bytes.storage_data_url(img) == EncodedImage(data).data_url
+
+
+def test_storage_rendition_is_computed_once():
+    enc = EncodedImage(_encoded((1600, 1200)))
+    small = enc.rendition(768, 75)
+    assert small.format == "JPEG"
+    assert max(small.size) == 768
+    assert enc.rendition(768, 75) is small
+    assert small.rendition(768, 75) is small
+
+
+def test_storage_data_url_for_large_png():
+    img = EncodedImage(_encoded((1024, 1024))).pil
+    url = image_bytes.storage_data_url(img)
+    assert url.startswith("data:image/jpeg;base64,")
+    assert EncodedImage.from_data_url(url).size == (768, 768)
+    assert image_bytes.storage_data_url(img) == url
+    assert image_bytes.storage_data_url(None) is None
+
+
+# ---------------------------------------------------------------------------
+# Display renditions (ROLES)
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("role", ["thumb", "card", "preview"])
+def test_role_sizes(role):
+    max_size, _ = image_bytes.ROLES[role]
+    img = EncodedImage(_encoded((1800, 1200))).pil
+    enc = image_bytes.for_role(img, role)
+    assert enc.format == "JPEG"
+    assert enc.size == (max_size, round(max_size * 2 / 3))
+    assert image_bytes.for_role(img, role) is enc
+
+
+def test_print_is_the_full_encoding():
+    img = EncodedImage(_encoded((1800, 1200))).pil
+    enc = image_bytes.for_role(img, "print")
+    assert enc is image_bytes.encoded_of(img)
+    assert enc.size == (1800, 1200)
+
+
+def test_compact_jpeg_is_its_own_rendition():
+    enc = EncodedImage(_encoded((400, 300), "JPEG", quality=75))
+    assert image_bytes.for_role(enc, "card") is enc
+    assert image_bytes.for_role(enc, "preview") is enc
+    assert image_bytes.for_role(enc, "thumb") is not enc
+
+
+def test_role_data_url():
+    assert image_bytes.role_data_url(None, "card") is None
+    url = image_bytes.role_data_url(EncodedImage(_encoded((1000, 1000))), "thumb")
+    assert EncodedImage.from_data_url(url).size == (160, 160)
@@ -0,0 +1,118 @@
+import base64
+from collections import OrderedDict
+
+import pytest
+
+import image_cache
+
+
+def _b64(n: int, fill: bytes = b"x") -> str:
+    return base64.b64encode(fill * n).decode()
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch, clock):
+    monkeypatch.setattr(image_cache, "time", clock)
+    monkeypatch.setattr(image_cache, "ENABLED", True)
+    monkeypatch.setattr(image_cache, "USE_MONGO", False)
+    monkeypatch.setattr(image_cache, "MEM_BUDGET", 1000)
+    monkeypatch.setattr(image_cache, "MEM_TTL_S", 3600.0)
+    monkeypatch.setattr(image_cache, "_mem", OrderedDict())
+    monkeypatch.setattr(image_cache, "_mem_bytes", 0)
+    monkeypatch.setattr(image_cache, "_puts_since_trim", 0)
+    monkeypatch.setattr(image_cache, "_stats", dict.fromkeys(image_cache._stats, 0))
+
+
+def test_key_covers_prompt_models_and_references():
+    k = image_cache.cache_key("fox", "m1,m2", None)
+    assert k == image_cache.cache_key("fox", "m1,m2", "")
+    assert k != image_cache.cache_key("owl", "m1,m2", None)
+    assert k != image_cache.cache_key("fox", "m1", None)
+    assert k != image_cache.cache_key("fox", "m1,m2", "photo")
+    assert (image_cache.cache_key("fox", "m", ["a", "b"])
+            != image_cache.cache_key("fox", "m", ["b", "a"]))
+    assert image_cache.cache_key("fox", "m", "a") == image_cache.cache_key("fox", "m", ["a"])
+
+
+def test_put_then_get():
+    image_cache.put("k", _b64(100), "image/jpeg", "m1")
+    hit = image_cache.get("k")
+    assert hit == {"data_b64": _b64(100), "mime_type": "image/jpeg", "model": "m1", "size": 100}
+    assert image_cache.get("other") is None
+    stats = image_cache.cache_stats()
+    assert (stats["mem_hits"], stats["misses"], stats["puts"]) == (1, 1, 1)
+    assert stats["bytes_served"] == 100
+    assert stats["hit_rate"] == 0.5
+    assert stats["mode"] == "memory"
+
+
+def test_lru_eviction_by_bytes():
+    for k in "abc":
+        image_cache.put(k, _b64(400))
+    assert image_cache.get("a") is None
+    assert image_cache.get("b") and image_cache.get("c")
+    # "b" was used more recently than "c", so "c" goes next
+    image_cache.get("b")
+    image_cache.put("d", _b64(400))
+    assert image_cache.get("c") is None
+    assert image_cache.get("b") is not None
+    assert image_cache.cache_stats()["evictions"] == 2
+    assert image_cache._mem_bytes == 800
+
+
+def test_oversized_entry_not_kept():
+    image_cache.put("big", _b64(2000))
+    assert image_cache.get("big") is None
+    assert image_cache._mem_bytes == 0
+
+
+def test_replacing_a_key_keeps_byte_count():
+    image_cache.put("k", _b64(300))
+    image_cache.put("k", _b64(200, b"y"))
+    assert image_cache._mem_bytes == 200
+    assert image_cache.get("k")["data_b64"] == _b64(200, b"y")
+
+
+def test_memory_ttl(clock):
+    image_cache.put("k", _b64(10))
+    clock.advance(3599)
+    assert image_cache.get("k") is not None
+    clock.advance(2)
+    assert image_cache.get("k") is None
+    assert image_cache._mem_bytes == 0
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(image_cache, "ENABLED", False)
+    image_cache.put("k", _b64(10))
+    assert image_cache.get("k") is None
+    assert image_cache.cache_stats()["mode"] == "off"
+
+
+def test_bypass_counter():
+    image_cache.note_bypass()
+    assert image_cache.cache_stats()["bypassed"] == 1
+
+
+# ---------------------------------------------------------------------------
+# generate_image against scripts/stub_backends.py
+# ---------------------------------------------------------------------------
+
+def test_regenerate_bypasses_cache(stub, monkeypatch):
+    import stub_backends
+    import vertex_client as vc
+    monkeypatch.setattr(image_cache, "ENABLED", True)
+    monkeypatch.setattr(image_cache, "MEM_BUDGET", 10_000_000)
+
+    def _renders():
+        return stub_backends._stats.get("image_requests", 0)
+
+    prompt = "edited: the fox wears a red scarf"
+    first = vc.generate_image(prompt)
+    before = _renders()
+    assert vc.generate_image(prompt).data_b64 == first.data_b64
+    assert _renders() == before
+    # The wizard's regenerate button (edited page or not) passes force_fresh
+    again = vc.generate_image(prompt, force_fresh=True)
+    assert again.ok
+    assert _renders() == before + 1
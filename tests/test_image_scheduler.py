@@ -0,0 +1,176 @@
+import threading
+import time
+
+import pytest
+
+import deadlines
+from image_scheduler import JobCancelled, PageImageScheduler, job_key
+
+
+class Worker:
+    """Renders "img:<prompt>" once `gate` is open; prompts starting with
+    "fail" raise."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, *args, **kwargs):
+        with self.lock:
+            self.calls.append((prompt, args, kwargs))
+        assert self.gate.wait(5)
+        if prompt.startswith("fail"):
+            raise RuntimeError(prompt)
+        return f"img:{prompt}"
+
+
+@pytest.fixture
+def worker():
+    w = Worker()
+    yield w
+    w.gate.set()
+
+
+@pytest.fixture
+def make(worker):
+    made = []
+
+    def _make(**kw):
+        s = PageImageScheduler(worker, **kw)
+        made.append(s)
+        return s
+
+    yield _make
+    worker.gate.set()
+    for s in made:
+        s.shutdown()
+
+
+def _wait_done(sched):
+    for _ in range(500):
+        if not sched.pending():
+            return
+        time.sleep(0.01)
+    raise AssertionError("jobs never finished")
+
+
+def test_job_key():
+    assert job_key("p", "ref") == job_key("p", "ref")
+    assert job_key("p", "ref") != job_key("p", "other")
+    assert job_key("p", ["a", "b"]) != job_key("p", ["ab"])
+    assert job_key("p", None) == job_key("p", "")
+
+
+def test_same_prompt_is_reused(make, worker):
+    s = make()
+    assert s.submit(0, "fox", "ref")
+    assert not s.submit(0, "fox", "ref")
+    worker.gate.set()
+    _wait_done(s)
+    assert len(worker.calls) == 1
+    assert s.stats()["reused"] == 1
+    assert s.take(0, "fox", "ref") == "img:fox"
+    assert s.take(0, "fox", "ref") is None
+
+
+def test_kwargs_are_not_part_of_the_key(make):
+    s = make()
+    assert s.submit(0, "fox", deadline=1)
+    assert not s.submit(0, "fox", deadline=2)
+
+
+def test_changed_prompt_or_args_reissue(make, worker):
+    s = make(max_workers=1)
+    s.submit(0, "fox")
+    assert s.submit(0, "owl")
+    assert s.submit(0, "owl", "new-ref")
+    worker.gate.set()
+    _wait_done(s)
+    assert s.stats()["reissued"] == 2
+    assert s.take(0, "fox") is None
+    assert s.take(0, "owl", "new-ref") == "img:owl"
+
+
+def test_take_before_done_returns_none(make, worker):
+    s = make()
+    s.submit(0, "fox")
+    assert s.take(0, "fox") is None
+    worker.gate.set()
+    _wait_done(s)
+    assert s.take(0, "fox") == "img:fox"
+
+
+def test_speculative_cap(make, worker):
+    s = make(max_workers=3, max_speculative=1)
+    assert s.submit(0, "a", speculative=True)
+    assert not s.submit(1, "b", speculative=True)
+    assert s.submit(1, "b")
+    assert s.stats()["speculative_skipped"] == 1
+    worker.gate.set()
+    _wait_done(s)
+    assert s.submit(2, "c", speculative=True)
+
+
+def test_as_completed_yields_results_and_errors(make, worker):
+    s = make()
+    worker.gate.set()
+    got = dict(s.as_completed([(0, "a"), (1, "fail-b"), (2, "c")], "ref"))
+    assert got[0] == "img:a" and got[2] == "img:c"
+    assert isinstance(got[1], RuntimeError)
+    assert all(args == ("ref",) for _, args, _ in worker.calls)
+    assert s.pending() == 0
+
+
+def test_as_completed_reports_cancelled_page(make, worker):
+    s = make(max_workers=1)
+
+    def _cancel_then_release():
+        time.sleep(0.05)
+        s.cancel(1)
+        worker.gate.set()
+
+    threading.Thread(target=_cancel_then_release).start()
+    got = dict(s.as_completed([(0, "a"), (1, "b")]))
+    assert got[0] == "img:a"
+    assert isinstance(got[1], JobCancelled)
+    assert got[1].idx == 1 and got[1].reason == "was cancelled"
+    assert str(got[1]) == "page 2 was cancelled before it finished"
+
+
+def test_as_completed_reports_reissued_page(make, worker):
+    s = make(max_workers=1)
+
+    def _reissue_then_release():
+        time.sleep(0.05)
+        s.submit(0, "owl")
+        worker.gate.set()
+
+    threading.Thread(target=_reissue_then_release).start()
+    got = list(s.as_completed([(0, "fox")]))
+    assert len(got) == 1
+    assert isinstance(got[0][1], JobCancelled)
+    assert got[0][1].reason == "was reissued with a new prompt"
+    _wait_done(s)
+    assert s.take(0, "owl") == "img:owl"
+
+
+def test_as_completed_stops_at_deadline(make, worker):
+    s = make()
+    got = list(s.as_completed([(0, "a")], until=deadlines.Deadline(0.05)))
+    assert got == []
+    assert s.pending() == 1
+    worker.gate.set()
+    _wait_done(s)
+    assert s.take(0, "a") == "img:a"
+
+
+def test_retain_and_reset(make, worker):
+    s = make(max_workers=1)
+    for i in range(4):
+        s.submit(i, f"p{i}")
+    s.retain([0, 1])
+    assert s.stats()["cancelled"] == 2
+    s.reset()
+    assert s.stats()["cancelled"] == 4
+    assert s.pending() == 0
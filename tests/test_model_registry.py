@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+import model_registry as mr
+
+P = "proj"
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch, clock):
+    monkeypatch.setattr(mr, "time", clock)
+    monkeypatch.setattr(mr, "USE_MONGO", False)
+    monkeypatch.setattr(mr, "DEAD_TTL_S", 600)
+    monkeypatch.setattr(mr, "_entries", {})
+    monkeypatch.setattr(mr, "_probing", set())
+
+
+def _wait_probes():
+    for _ in range(500):
+        with mr._lock:
+            if not mr._probing:
+                return
+        time.sleep(0.01)
+    raise AssertionError("probe never finished")
+
+
+class Probe:
+    def __init__(self, status=200, gate=None):
+        self.status = status
+        self.gate = gate
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if isinstance(self.status, Exception):
+            raise self.status
+        return self.status
+
+
+def test_unknown_and_healthy_pairs_are_live():
+    assert not mr.is_dead(P, "m", "global")
+    mr.record_success(P, "m", "global")
+    assert not mr.is_dead(P, "m", "global")
+
+
+def test_dead_until_ttl(clock):
+    mr.record_unavailable(P, "m", "global", 404)
+    assert mr.is_dead(P, "m", "global")
+    assert not mr.is_dead(P, "m", "us-central1")
+    assert not mr.is_dead("other", "m", "global")
+    clock.advance(599)
+    assert mr.is_dead(P, "m", "global")
+    clock.advance(2)
+    # Lapsed and nothing to probe with: hand it back to the caller
+    assert not mr.is_dead(P, "m", "global")
+
+
+def test_forbidden_status():
+    mr.record_unavailable(P, "m", "global", 403, "permission denied")
+    row = mr.snapshot()[0]
+    assert row["status"] == mr.STATUS_FORBIDDEN
+    assert row["detail"] == "permission denied"
+    assert row["skip_for_s"] == 600
+
+
+def test_reprobe_brings_pair_back(clock):
+    mr.record_unavailable(P, "m", "global", 404)
+    clock.advance(601)
+    gate = threading.Event()
+    probe = Probe(200, gate)
+    # Skipped while the background probe runs, and probed only once
+    assert mr.is_dead(P, "m", "global", probe=probe)
+    assert mr.is_dead(P, "m", "global", probe=probe)
+    assert "(probing)" in mr.snapshot()[0]["status"]
+    gate.set()
+    _wait_probes()
+    assert probe.calls == 1
+    assert not mr.is_dead(P, "m", "global", probe=probe)
+
+
+def test_reprobe_still_dead_renews_ttl(clock):
+    mr.record_unavailable(P, "m", "global", 404)
+    clock.advance(601)
+    probe = Probe(404)
+    assert mr.is_dead(P, "m", "global", probe=probe)
+    _wait_probes()
+    assert mr.snapshot()[0]["skip_for_s"] == 600
+    assert mr.snapshot()[0]["detail"] == "re-probe: HTTP 404"
+
+
+def test_reprobe_network_error_backs_off(clock):
+    mr.record_unavailable(P, "m", "global", 404)
+    clock.advance(601)
+    assert mr.is_dead(P, "m", "global", probe=Probe(OSError("reset")))
+    _wait_probes()
+    assert mr.snapshot()[0]["skip_for_s"] == 300
+    assert mr.snapshot()[0]["status"] == mr.STATUS_NOT_FOUND
+
+
+def test_success_revives_dead_pair():
+    mr.record_unavailable(P, "m", "global", 404)
+    mr.record_success(P, "m", "global")
+    assert not mr.is_dead(P, "m", "global")
+
+
+# ---------------------------------------------------------------------------
+# vertex_client._image_plan
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def vc(monkeypatch):
+    pytest.importorskip("requests")
+    pytest.importorskip("dotenv")
+    import vertex_client
+    monkeypatch.setattr(vertex_client, "_cfg", lambda: {
+        "project": P, "location": "us-central1", "sa_json": "",
+        "base_url": "http://stub", "stub_token": "stub"})
+    return vertex_client
+
+
+def _pairs(plan):
+    return [(m, ep) for m, eps in plan for ep, _ in eps]
+
+
+def test_image_plan_skips_dead_pairs(vc):
+    first = vc._GEMINI_IMAGE_MODELS[0]
+    imagen = vc._IMAGEN_MODELS[0]
+    mr.record_unavailable(P, first, "global", 404)
+    mr.record_unavailable(P, imagen, "predict:us-central1", 404)
+    gemini, imagen_plan = vc._image_plan({})
+    assert (first, "global") not in _pairs(gemini)
+    assert (first, "us-central1") in _pairs(gemini)
+    assert imagen not in [m for m, eps in imagen_plan if eps]
+    # Model order is kept, dead pairs just drop out
+    assert [m for m, _ in gemini] == vc._GEMINI_IMAGE_MODELS
+
+
+def test_image_plan_tries_everything_when_all_dead(vc):
+    gemini, imagen = vc._image_plan({})
+    for m, ep in _pairs(gemini) + _pairs(imagen):
+        mr.record_unavailable(P, m, ep, 404)
+    assert _pairs(vc._image_plan({})[0]) == _pairs(gemini)
+    assert _pairs(vc._image_plan({})[1]) == _pairs(imagen)
@@ -0,0 +1,131 @@
+import pytest
+
+import rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch, clock):
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    monkeypatch.setattr(rate_limiter, "_buckets", {})
+    monkeypatch.setattr(rate_limiter, "_stats", dict.fromkeys(rate_limiter._stats, 0))
+    monkeypatch.setattr(rate_limiter, "_RPM_OVERRIDES", {})
+    monkeypatch.setattr(rate_limiter, "DEFAULT_RPM", 60)
+    monkeypatch.setattr(rate_limiter, "BURST", 3)
+    monkeypatch.setattr(rate_limiter, "STAGGER_S", 2.0)
+    monkeypatch.setattr(rate_limiter, "USE_MONGO", False)
+    return rate_limiter
+
+
+def test_burst_then_queue():
+    b = rate_limiter.TokenBucket(60, 3)
+    assert [b.reserve() for _ in range(5)] == [0, 0, 0, pytest.approx(1), pytest.approx(2)]
+
+
+def test_refill_over_time(clock):
+    b = rate_limiter.TokenBucket(60, 3)
+    for _ in range(3):
+        b.reserve()
+    clock.advance(2)
+    assert [b.reserve() for _ in range(3)] == [0, 0, pytest.approx(1)]
+
+
+def test_refill_capped_at_burst(clock):
+    b = rate_limiter.TokenBucket(60, 3)
+    clock.advance(600)
+    assert [b.reserve() for _ in range(4)] == [0, 0, 0, pytest.approx(1)]
+
+
+def test_cancel_returns_token():
+    b = rate_limiter.TokenBucket(60, 1)
+    b.reserve()
+    assert b.reserve() == pytest.approx(1)
+    b.cancel()
+    assert b.reserve() == pytest.approx(1)
+
+
+def test_penalty_staggers_queued_callers(clock):
+    b = rate_limiter.TokenBucket(60, 3)
+    b.penalize(1)
+    assert [b.reserve() for _ in range(3)] == [pytest.approx(1), pytest.approx(2), pytest.approx(3)]
+
+
+def test_bucket_refills_from_empty_after_penalty_queue(clock):
+    b = rate_limiter.TokenBucket(60, 3)
+    b.penalize(1)
+    b.reserve()
+    b.reserve()
+    # Once the queue has drained there is no banked burst behind it.
+    clock.advance(3)
+    assert b.reserve() == pytest.approx(1)
+
+
+def test_unlimited_bucket_only_enforces_penalties(clock):
+    b = rate_limiter.TokenBucket(0, 3)
+    assert [b.reserve() for _ in range(10)] == [0] * 10
+    b.penalize(1)
+    assert [b.reserve() for _ in range(3)] == [pytest.approx(1), pytest.approx(3), pytest.approx(5)]
+    clock.advance(10)
+    assert b.reserve() == 0
+
+
+def test_rpm_overrides(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_RPM_OVERRIDES", {"fast": 600, "neg": -5})
+    assert rate_limiter.rpm_for("fast") == 600
+    assert rate_limiter.rpm_for("neg") == 0
+    assert rate_limiter.rpm_for("other") == 60
+
+
+def test_acquire_waits_for_token(clock):
+    for _ in range(3):
+        assert rate_limiter.acquire("m")
+    assert rate_limiter.acquire("m")
+    assert clock.slept == [pytest.approx(1)]
+    stats = rate_limiter.limiter_stats()
+    assert stats["acquired"] == 4
+    assert stats["queued"] == 1
+
+
+def test_acquire_timeout_hands_token_back(clock):
+    for _ in range(3):
+        rate_limiter.acquire("m")
+    assert not rate_limiter.acquire("m", timeout=0.5)
+    assert clock.slept == []
+    assert rate_limiter.limiter_stats()["timeouts"] == 1
+    # The refused caller didn't keep its place in the queue.
+    assert rate_limiter._bucket("m").reserve() == pytest.approx(1)
+
+
+def test_acquire_requeues_after_penalty_while_sleeping(clock):
+    for _ in range(3):
+        rate_limiter.acquire("m")
+
+    def _penalty_once(seconds):
+        clock.on_sleep = None
+        clock.advance(0.5)
+        rate_limiter.penalize("m", 5)
+
+    clock.on_sleep = _penalty_once
+    assert rate_limiter.acquire("m")
+    # Slept for its slot, then queued again behind the 5s penalty.
+    assert len(clock.slept) == 2
+    assert clock.now >= 1000.5 + 5
+    assert rate_limiter.limiter_stats()["penalties"] == 1
+
+
+def test_acquire_async_shares_the_bucket(clock):
+    import asyncio
+    for _ in range(3):
+        rate_limiter.acquire("m")
+    assert not asyncio.run(rate_limiter.acquire_async("m", timeout=0.5))
+
+    async def _cancel_while_queued():
+        task = asyncio.create_task(rate_limiter.acquire_async("m", timeout=30))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(_cancel_while_queued())
+    # Neither the refused nor the cancelled caller kept its place.
+    assert rate_limiter._bucket("m").reserve() == pytest.approx(1)
+    assert rate_limiter.limiter_stats()["timeouts"] == 1
@@ -0,0 +1,69 @@
+import pytest
+
+import retry_budget
+
+
+@pytest.fixture(autouse=True)
+def budget(monkeypatch, clock):
+    monkeypatch.setattr(retry_budget, "time", clock)
+    monkeypatch.setattr(retry_budget, "RATIO", 0.2)
+    monkeypatch.setattr(retry_budget, "MIN_RETRIES", 10)
+    monkeypatch.setattr(retry_budget, "WINDOW_S", 60.0)
+    monkeypatch.setattr(retry_budget, "USE_MONGO", False)
+    monkeypatch.setattr(retry_budget, "_windows", {})
+    monkeypatch.setattr(retry_budget, "_last_event", {})
+    monkeypatch.setattr(retry_budget, "_stats", dict.fromkeys(retry_budget._stats, 0))
+    events = []
+    monkeypatch.setattr(retry_budget, "_emit_exhausted",
+                        lambda scope, ok, retries, what: events.append((scope, ok, retries, what)))
+    return events
+
+
+def test_allowance_grows_with_successes():
+    assert retry_budget.allowance("s") == 10
+    for _ in range(25):
+        retry_budget.record_success("s")
+    assert retry_budget.allowance("s") == 15
+
+
+def test_exhausted_after_floor():
+    assert all(retry_budget.try_retry("s") for _ in range(10))
+    assert not retry_budget.try_retry("s")
+    for _ in range(5):
+        retry_budget.record_success("s")
+    assert retry_budget.try_retry("s")
+    assert not retry_budget.try_retry("s")
+    stats = retry_budget._stats
+    assert stats["retries"] == 11
+    assert stats["exhausted"] == 2
+
+
+def test_scopes_are_independent():
+    for _ in range(10):
+        retry_budget.try_retry("a")
+    assert not retry_budget.try_retry("a")
+    assert retry_budget.try_retry("b")
+
+
+def test_window_slides(clock):
+    for _ in range(10):
+        retry_budget.try_retry("s")
+    assert not retry_budget.try_retry("s")
+    clock.advance(61)
+    assert retry_budget.try_retry("s")
+
+
+def test_exhaustion_event_once_per_window(clock, budget):
+    for _ in range(10):
+        retry_budget.try_retry("s")
+    for _ in range(3):
+        retry_budget.try_retry("s", what="gemini")
+    assert budget == [("s", 0, 10, "gemini")]
+    clock.advance(30)
+    for _ in range(10):
+        retry_budget.try_retry("s")
+    assert len(budget) == 1
+    clock.advance(31)
+    for _ in range(11):
+        retry_budget.try_retry("s")
+    assert len(budget) == 2
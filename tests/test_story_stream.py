@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from story_stream import StoryStreamParser, strip_fences
+
+STORY = {
+    "title": "The Brave Fox",
+    "visual_anchor": "A small red fox in a blue scarf",
+    "secondary_characters": [{"name": "Owl", "look": "grey {wise} owl"}],
+    "pages": [
+        {"page_number": 1, "text": "Fox said \"hi\" } and left.", "tags": ["a", "b"]},
+        {"page_number": 2, "text": "A [bracket] and a \\ slash", "meta": {"n": {"m": 1}}},
+        {"page_number": 3, "text": "The end."},
+    ],
+}
+
+
+def _feed_all(parser, text, size):
+    out = []
+    for i in range(0, len(text), size):
+        out.extend(parser.feed(text[i:i + size]))
+    return out
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 100000])
+def test_pages_arrive_with_positions(size):
+    text = json.dumps(STORY)
+    p = StoryStreamParser()
+    got = _feed_all(p, text, size)
+    assert got == list(enumerate(STORY["pages"]))
+    assert p.finish() == STORY
+
+
+def test_page_yielded_as_soon_as_it_closes():
+    text = json.dumps(STORY)
+    close = text.index('}, {"page_number": 2')
+    p = StoryStreamParser()
+    assert p.feed(text[:close]) == []
+    assert p.feed(text[close:close + 1]) == [(0, STORY["pages"][0])]
+
+
+def test_unparsable_page_keeps_its_slot():
+    text = '{"title": "T", "pages": [{"page_number": 1}, {"page_number": 2,}, {"page_number": 3}]}'
+    p = StoryStreamParser()
+    assert p.feed(text) == [(0, {"page_number": 1}), (2, {"page_number": 3})]
+    assert len(p.pages) == 2
+
+
+def test_header_once_pages_start():
+    text = json.dumps(STORY)
+    p = StoryStreamParser()
+    p.feed(text[:text.index('"pages"') - 3])
+    assert p.header() == {}
+    p.feed(text[text.index('"pages"') - 3:text.index('"pages"') + 12])
+    head = p.header()
+    assert head["title"] == "The Brave Fox"
+    assert head["secondary_characters"] == STORY["secondary_characters"]
+    assert "pages" not in head
+
+
+def test_fenced_response():
+    text = "```json\n" + json.dumps(STORY) + "\n```"
+    p = StoryStreamParser()
+    assert [i for i, _ in _feed_all(p, text, 5)] == [0, 1, 2]
+    assert p.header()["title"] == "The Brave Fox"
+    assert p.finish() == STORY
+
+
+def test_nothing_after_pages_array_closes():
+    p = StoryStreamParser()
+    p.feed('{"pages": [{"a": 1}], "extra": {"b": 2}')
+    assert p.feed('}') == []
+    assert p.finish() == {"pages": [{"a": 1}], "extra": {"b": 2}}
+
+
+def test_finish_raises_on_truncated_response():
+    p = StoryStreamParser()
+    p.feed('{"pages": [{"a": 1}, {"b"')
+    with pytest.raises(ValueError):
+        p.finish()
+
+
+def test_strip_fences():
+    assert strip_fences('```json\n{"a": 1}\n```') == '{"a": 1}'
+    assert strip_fences('```\n{"a": 1}\n```') == '{"a": 1}'
+    assert strip_fences('  {"a": 1} ') == '{"a": 1}'
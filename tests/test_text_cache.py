@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+import pytest
+
+import text_cache
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch, clock):
+    monkeypatch.setattr(text_cache, "time", clock)
+    monkeypatch.setattr(text_cache, "TTL_S", 600.0)
+    monkeypatch.setattr(text_cache, "MAX_ENTRIES", 3)
+    monkeypatch.setattr(text_cache, "_entries", OrderedDict())
+    monkeypatch.setattr(text_cache, "_stats", dict.fromkeys(text_cache._stats, 0))
+
+
+def _key(scope="user-a", models="m", prompt="write a story", temperature=0.7, max_tokens=8192):
+    return text_cache.cache_key(scope, models, prompt, temperature, max_tokens)
+
+
+def test_key_covers_every_request_field():
+    k = _key()
+    assert k == _key()
+    assert k == _key(temperature=0.70001)
+    for other in (_key(scope="user-b"), _key(models="m2"), _key(prompt="write a poem"),
+                  _key(temperature=0.9), _key(max_tokens=4096)):
+        assert other != k
+
+
+def test_scopes_are_isolated():
+    text_cache.put(_key(scope="user-a"), '{"title": "A"}', tokens=1200)
+    assert text_cache.get(_key(scope="user-a")) == '{"title": "A"}'
+    assert text_cache.get(_key(scope="user-b")) is None
+    stats = text_cache.cache_stats()
+    assert (stats["hits"], stats["misses"], stats["tokens_saved"]) == (1, 1, 1200)
+
+
+def test_ttl(clock):
+    text_cache.put(_key(), "story")
+    clock.advance(599)
+    assert text_cache.get(_key()) == "story"
+    clock.advance(2)
+    assert text_cache.get(_key()) is None
+    assert text_cache.cache_stats()["entries"] == 0
+
+
+def test_disabled_and_empty(monkeypatch):
+    text_cache.put(_key(), "")
+    assert text_cache.get(_key()) is None
+    monkeypatch.setattr(text_cache, "TTL_S", 0.0)
+    text_cache.put(_key(), "story")
+    assert text_cache.get(_key()) is None
+    assert text_cache.cache_stats()["stores"] == 0
+
+
+def test_lru_size():
+    for p in "abc":
+        text_cache.put(_key(prompt=p), p)
+    text_cache.get(_key(prompt="a"))
+    text_cache.put(_key(prompt="d"), "d")
+    assert text_cache.get(_key(prompt="b")) is None
+    assert text_cache.get(_key(prompt="a")) == "a"
+    assert text_cache.cache_stats()["entries"] == 3
+
+
+# ---------------------------------------------------------------------------
+# call_gemini_text against scripts/stub_backends.py
+# ---------------------------------------------------------------------------
+
+def _text_requests(stub_stats):
+    return stub_stats.get("text_requests", 0)
+
+
+def test_call_gemini_text_caches_per_user(stub):
+    import stub_backends
+    import vertex_client as vc
+    before = _text_requests(stub_backends._stats)
+    a1 = vc.call_gemini_text("write a story", cache_scope="user-a")
+    a2 = vc.call_gemini_text("write a story", cache_scope="user-a")
+    assert a1 and a1 == a2
+    assert _text_requests(stub_backends._stats) == before + 1
+    assert vc.call_gemini_text("write a story", cache_scope="user-b") == a1
+    assert _text_requests(stub_backends._stats) == before + 2
+    # No scope: never cached
+    vc.call_gemini_text("write a story")
+    vc.call_gemini_text("write a story")
+    assert _text_requests(stub_backends._stats) == before + 4
@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+import adaptive_concurrency  # noqa: E402
+import deadlines  # noqa: E402
+import image_cache  # noqa: E402
+import vertex_async  # noqa: E402
+import vertex_client as vc  # noqa: E402
+
+
+def _renders() -> int:
+    import stub_backends
+    return stub_backends._stats.get("image_requests", 0)
+
+
+def test_generate_image_async_from_stub(stub):
+    res = asyncio.run(vertex_async.generate_image_async("a fox in a scarf", force_fresh=True))
+    assert res.ok
+    assert res.model == vc._GEMINI_IMAGE_MODELS[0]
+    assert [a.status for a in res.attempts] == ["200"]
+    assert base64.b64decode(res.data_b64).startswith(b"\x89PNG")
+
+
+def test_dead_model_falls_through_to_next(stub):
+    dead = vc._GEMINI_IMAGE_MODELS[0]
+    stub["dead_models"] = [dead]
+    res = asyncio.run(vertex_async.generate_image_async("a fox in a scarf", force_fresh=True))
+    assert res.ok
+    assert res.model != dead
+    assert "404" in [a.status for a in res.attempts if a.model == dead]
+
+
+def test_shares_the_image_cache_with_the_sync_client(stub, monkeypatch):
+    monkeypatch.setattr(image_cache, "ENABLED", True)
+    monkeypatch.setattr(image_cache, "USE_MONGO", False)
+    monkeypatch.setattr(image_cache, "_mem", OrderedDict())
+    monkeypatch.setattr(image_cache, "_mem_bytes", 0)
+    first = vc.generate_image("an owl reading")
+    before = _renders()
+    res = asyncio.run(vertex_async.generate_image_async("an owl reading"))
+    assert res.cached and res.data_b64 == first.data_b64
+    assert _renders() == before
+
+
+def test_gather_keeps_order_and_limit(stub, monkeypatch):
+    monkeypatch.setitem(stub["latency"], "image", "fixed:0.2")
+    monkeypatch.setattr(adaptive_concurrency, "_limit", 8.0)
+    monkeypatch.setattr(adaptive_concurrency, "_stats", dict(adaptive_concurrency._stats, peak_in_flight=0))
+    seen = []
+    prompts = [f"page {i}" for i in range(5)]
+    results = asyncio.run(vertex_async.gather_images(
+        prompts, limit=2, on_result=lambda i, res: seen.append(i)))
+    assert all(r.ok for r in results)
+    assert sorted(seen) == list(range(5))
+    assert adaptive_concurrency.concurrency_stats()["peak_in_flight"] == 2
+
+
+def test_spent_deadline_starts_nothing(stub):
+    before = _renders()
+    results = vertex_async.generate_images(["a", "b"], deadline=deadlines.Deadline(1))
+    assert [r.deadline_exceeded for r in results] == [True, True]
+    assert not any(r.ok for r in results)
+    assert _renders() == before
+
+
+def test_closing_iter_images_cancels_the_rest(stub, monkeypatch):
+    monkeypatch.setitem(stub["latency"], "image", "fixed:0.3")
+    before = _renders()
+    it = vertex_async.iter_images([f"page {i}" for i in range(4)], limit=1)
+    idx, res = next(it)
+    assert res.ok
+    it.close()
+    time.sleep(0.4)
+    assert _renders() - before <= 2
+
+
+def test_loop_thread_runs_on_the_callers_config(stub, monkeypatch):
+    cfg = vc.session_config()
+    monkeypatch.setenv("VERTEX_BASE_URL", "http://127.0.0.1:9")
+    box = {}
+
+    def _caller():
+        with vc.use_config(cfg):
+            box["results"] = vertex_async.generate_images(["a fox"], limit=1)
+
+    t = threading.Thread(target=_caller)
+    t.start()
+    t.join()
+    assert box["results"][0].ok
+
+
+def test_text_async_and_cache(stub):
+    import stub_backends
+    before = stub_backends._stats.get("text_requests", 0)
+    a = vertex_async.generate_text("write a story, asynchronously", cache_scope="user-a")
+    b = asyncio.run(vertex_async.call_gemini_text_async("write a story, asynchronously", cache_scope="user-a"))
+    assert a and a == b
+    assert stub_backends._stats.get("text_requests", 0) == before + 1
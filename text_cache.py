@@ -0,0 +1,89 @@
+"""
+Short-lived response cache for call_gemini_text.
+
+Story generation, refine and regenerate-from-page each send a prompt of
+several thousand tokens and get a multi-thousand-token JSON back. A
+Streamlit rerun or a double-click used to pay for the whole generation
+again. This cache remembers a response for a few minutes, keyed on a
+hash of the exact request:
+
+  scope (user id), model list, temperature, max_tokens and the prompt.
+
+Entries are scoped per user, so one customer never sees another's story,
+and callers opt in by passing a scope — calls without one (health checks,
+admin tools) always go to Vertex. The TTL is short on purpose: it is
+there to absorb repeats, not to replace deliberate "try again" requests,
+which change the prompt or come minutes later.
+
+In-process only; a repeat always lands on the same server as the first
+request.
+
+Tunables (env vars):
+  TEXT_CACHE_TTL          — seconds an entry lives (default 600, 0 disables)
+  TEXT_CACHE_MAX_ENTRIES  — LRU size (default 256)
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TTL_S = float(os.environ.get("TEXT_CACHE_TTL", "600"))
+MAX_ENTRIES = int(os.environ.get("TEXT_CACHE_MAX_ENTRIES", "256"))
+
+_entries: "OrderedDict[str, dict]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "tokens_saved": 0}
+
+
+def cache_key(scope: str, models: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    h = hashlib.sha256()
+    for part in (scope, models, f"{float(temperature):.3f}", str(int(max_tokens)), prompt):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    if TTL_S <= 0:
+        return None
+    with _lock:
+        e = _entries.get(key)
+        if e is not None and time.monotonic() - e["at"] > TTL_S:
+            del _entries[key]
+            e = None
+        if e is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        _stats["tokens_saved"] += e["tokens"]
+    logger.info(f"text_cache hit ({e['tokens']} tokens saved)")
+    return e["text"]
+
+
+def put(key: str, text: str, tokens: int = 0) -> None:
+    """Store a response. `tokens` is its total token count (usageMetadata)."""
+    if TTL_S <= 0 or not text:
+        return
+    with _lock:
+        _entries[key] = {"text": text, "tokens": int(tokens or 0), "at": time.monotonic()}
+        _entries.move_to_end(key)
+        _stats["stores"] += 1
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def cache_stats() -> dict:
+    """Counters for the admin panel."""
+    with _lock:
+        out = dict(_stats)
+        out["entries"] = len(_entries)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = round(out["hits"] / lookups, 2) if lookups else 0.0
+    return out
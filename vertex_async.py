@@ -0,0 +1,319 @@
+"""
+asyncio counterpart to vertex_client's image and text calls.
+
+The sync client gets concurrency from thread pools, with every worker
+parked on a request for up to 180s. This module runs the very same calls
+on one event loop with an async HTTP client (httpx), so a worker process
+can keep many renders going without an OS thread per request.
+
+There is no second copy of the request logic: vertex_client writes
+generate_image and call_gemini_text as flows that yield their blocking
+steps, and this module awaits them instead of running them inline. So an
+async call gets everything a sync one does — image_cache and text_cache,
+deadlines, the retry budget, rate_limiter buckets, circuit breakers, the
+model registry and its adaptive_concurrency slot — and the two paths share
+one quota and health picture. Steps with no async version (token refresh,
+the model plan, Mongo-backed bookkeeping, hedged legs) run on the default
+executor's threads, briefly.
+
+How many requests are actually out at once is still adaptive_concurrency's
+call; raising IMAGE_CONCURRENCY_MAX no longer costs a thread per slot here.
+
+  gather_images() — render N prompts, at most `limit` at a time; cancellable
+  iter_images()   — the same for sync callers: yields (index, result) as
+                    each finishes, from a loop on a background thread
+  generate_images(), generate_text() — blocking wrappers
+
+Tunables (env vars):
+  VERTEX_ASYNC_FANOUT — renders gather_images runs at once by default (default 32)
+"""
+
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Callable, Iterator, List, Optional
+
+import httpx
+import requests
+
+import adaptive_concurrency
+import deadlines
+import rate_limiter
+import vertex_client
+from vertex_client import ImageCallResult, ConcurrencyQueueTimeout
+
+logger = logging.getLogger(__name__)
+
+FANOUT = max(1, int(os.environ.get("VERTEX_ASYNC_FANOUT", "32")))
+
+_CONNECT_TIMEOUT_S = 10
+
+
+def make_client(max_connections: int = FANOUT) -> httpx.AsyncClient:
+    """AsyncClient sized for `max_connections` concurrent Vertex requests.
+    Like http_pool's sessions, it never stores a cookie."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections,
+                            max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(180, connect=_CONNECT_TIMEOUT_S),
+        cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+    )
+
+
+async def _post(client: httpx.AsyncClient, url: str, headers: dict, payload: dict,
+                timeout: float) -> httpx.Response:
+    # Flows catch requests' exceptions (the sync path's), so httpx's are
+    # raised as their requests equivalents.
+    try:
+        return await client.post(url, headers=headers, json=payload,
+                                 timeout=httpx.Timeout(timeout, connect=min(timeout, _CONNECT_TIMEOUT_S)))
+    except httpx.ConnectTimeout as e:
+        raise requests.ConnectTimeout(str(e) or "connect timeout") from e
+    except httpx.ReadTimeout as e:
+        raise requests.ReadTimeout(str(e) or "read timeout") from e
+    except httpx.TimeoutException as e:
+        raise requests.Timeout(str(e) or "timeout") from e
+    except httpx.TransportError as e:
+        raise requests.ConnectionError(str(e) or type(e).__name__) from e
+
+
+async def _timed_post(client: httpx.AsyncClient, step) -> tuple:
+    """vertex_client._timed_post on the event loop."""
+    if not await adaptive_concurrency.acquire_async(timeout=step.slot_timeout):
+        raise ConcurrencyQueueTimeout("image concurrency queue timeout — too many renders in flight")
+    t0 = time.monotonic()
+    attempt = None
+    try:
+        try:
+            r = await _post(client, step.url, step.headers, step.payload, step.timeout)
+        except Exception as e:
+            attempt = vertex_client._record_attempt(step.res, step.model, step.endpoint, t0, exc=e)
+            raise
+        attempt = vertex_client._record_attempt(step.res, step.model, step.endpoint, t0, r)
+        return r, attempt.latency_s
+    finally:
+        adaptive_concurrency.release(attempt)
+
+
+async def _step(client: httpx.AsyncClient, step):
+    if isinstance(step, vertex_client._ImagePost):
+        return await _timed_post(client, step)
+    if isinstance(step, vertex_client._Post):
+        return await _post(client, step.url, step.headers, step.payload, step.timeout)
+    if isinstance(step, vertex_client._Acquire):
+        return await rate_limiter.acquire_async(step.model, timeout=step.timeout)
+    if isinstance(step, vertex_client._Sleep):
+        return await step.deadline.sleep_async(step.seconds)
+    return await asyncio.to_thread(step.run)
+
+
+async def _run(flow, client: Optional[httpx.AsyncClient]):
+    """vertex_client._run, awaiting each step. Cancelling the task closes
+    the flow at its current step."""
+    own = client is None
+    client = client or make_client(4)
+    value, error = None, None
+    try:
+        while True:
+            try:
+                step = flow.throw(error) if error is not None else flow.send(value)
+            except StopIteration as done:
+                return done.value
+            value, error = None, None
+            try:
+                value = await _step(client, step)
+            except Exception as e:
+                error = e
+    finally:
+        flow.close()
+        if own:
+            await client.aclose()
+
+
+async def generate_image_async(
+    prompt: str,
+    reference_image_b64=None,
+    hedge: bool = False,
+    force_fresh: bool = False,
+    deadline=None,
+    client: Optional[httpx.AsyncClient] = None,
+) -> ImageCallResult:
+    """vertex_client.generate_image on the event loop. Pass `client` to
+    share connections across calls."""
+    flow = vertex_client._image_flow(prompt, reference_image_b64, hedge, force_fresh,
+                                     deadline or deadlines.NO_DEADLINE)
+    return await _run(flow, client)
+
+
+async def call_gemini_text_async(
+    prompt: str,
+    temperature: float = 0.7,
+    max_tokens: int = 8192,
+    cache_scope: str = "",
+    client: Optional[httpx.AsyncClient] = None,
+) -> Optional[str]:
+    """vertex_client.call_gemini_text on the event loop."""
+    return await _run(vertex_client._text_flow(prompt, temperature, max_tokens, cache_scope), client)
+
+
+def _cancelled(reason: str) -> ImageCallResult:
+    return ImageCallResult(errors=[f"Cancelled: {reason}"])
+
+
+async def gather_images(
+    prompts: List[str],
+    reference_image_b64=None,
+    hedge: bool = False,
+    deadline=None,
+    limit: Optional[int] = None,
+    cancel: Optional[asyncio.Event] = None,
+    on_result: Optional[Callable[[int, ImageCallResult], None]] = None,
+) -> List[ImageCallResult]:
+    """Render every prompt, at most `limit` (default FANOUT) at a time.
+
+    Results come back in prompt order; `on_result(index, result)` fires as
+    each one finishes. `deadline` is the whole batch's: each render gets a
+    child of it when it starts, and renders that can't start any more
+    come back with deadline_exceeded set. Setting `cancel` stops renders
+    that haven't started and cancels the ones in flight (their requests
+    are closed, not left to finish); those come back as failed results.
+    """
+    deadline = deadline or deadlines.NO_DEADLINE
+    limit = max(1, limit or FANOUT)
+    sem = asyncio.Semaphore(limit)
+    results: List[ImageCallResult] = [_cancelled("not started") for _ in prompts]
+
+    async with make_client(min(limit, 2 * adaptive_concurrency.MAX_LIMIT)) as client:
+        async def _one(i: int, prompt: str) -> None:
+            async with sem:
+                if not deadline.can_start():
+                    res = ImageCallResult(deadline_exceeded=True,
+                                          errors=[f"Gave up: {deadline.describe()}"])
+                else:
+                    res = await generate_image_async(
+                        prompt, reference_image_b64, hedge=hedge,
+                        deadline=deadline.child(label=f"image {i + 1}"), client=client,
+                    )
+            results[i] = res
+            if on_result:
+                on_result(i, res)
+
+        tasks = [asyncio.create_task(_one(i, p)) for i, p in enumerate(prompts)]
+        watcher = None
+        if cancel is not None:
+            async def _watch() -> None:
+                await cancel.wait()
+                for t in tasks:
+                    t.cancel()
+            watcher = asyncio.create_task(_watch())
+        try:
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+    for i, out in enumerate(outcomes):
+        if isinstance(out, asyncio.CancelledError):
+            results[i] = _cancelled("batch cancelled")
+        elif isinstance(out, BaseException):
+            logger.warning(f"vertex_async: image {i + 1} failed: {out}")
+            results[i] = ImageCallResult(errors=[str(out)])
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Sync callers
+# ---------------------------------------------------------------------------
+
+_DONE = object()
+
+
+def iter_images(
+    prompts: List[str],
+    reference_image_b64=None,
+    hedge: bool = False,
+    deadline=None,
+    limit: Optional[int] = None,
+) -> Iterator[tuple]:
+    """gather_images for sync callers: yields (index, ImageCallResult) in
+    the order they finish, on the calling thread (Streamlit-safe).
+
+    The event loop runs on a background thread with the caller's Vertex
+    settings (see vertex_client.use_config). Closing the iterator early
+    cancels whatever is still rendering."""
+    out: queue.Queue = queue.Queue()
+    cfg = vertex_client.session_config()
+    state: dict = {}
+    started = threading.Event()
+
+    async def _main() -> None:
+        state["loop"] = asyncio.get_running_loop()
+        state["cancel"] = asyncio.Event()
+        started.set()
+        await gather_images(prompts, reference_image_b64, hedge=hedge, deadline=deadline,
+                            limit=limit, cancel=state["cancel"],
+                            on_result=lambda i, res: out.put((i, res)))
+
+    def _thread() -> None:
+        try:
+            with vertex_client.use_config(cfg):
+                asyncio.run(_main())
+        except BaseException as e:
+            out.put(e)
+        finally:
+            started.set()
+            out.put(_DONE)
+
+    t = threading.Thread(target=_thread, daemon=True, name="vertex-async")
+    t.start()
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        started.wait()
+        loop, cancel = state.get("loop"), state.get("cancel")
+        if t.is_alive() and loop is not None:
+            try:
+                loop.call_soon_threadsafe(cancel.set)
+            except RuntimeError:
+                pass    # loop already closed
+        t.join()
+
+
+def generate_images(prompts: List[str], reference_image_b64=None, hedge: bool = False,
+                    deadline=None, limit: Optional[int] = None) -> List[ImageCallResult]:
+    """Blocking gather_images; results in prompt order."""
+    results = [_cancelled("not started") for _ in prompts]
+    for i, res in iter_images(prompts, reference_image_b64, hedge=hedge, deadline=deadline, limit=limit):
+        results[i] = res
+    return results
+
+
+def generate_text(prompt: str, temperature: float = 0.7, max_tokens: int = 8192,
+                  cache_scope: str = "") -> Optional[str]:
+    """Blocking call_gemini_text_async, on its own loop thread."""
+    cfg = vertex_client.session_config()
+    box: dict = {}
+
+    def _thread() -> None:
+        try:
+            with vertex_client.use_config(cfg):
+                box["text"] = asyncio.run(
+                    call_gemini_text_async(prompt, temperature, max_tokens, cache_scope))
+        except BaseException as e:
+            box["error"] = e
+
+    t = threading.Thread(target=_thread, daemon=True, name="vertex-async-text")
+    t.start()
+    t.join()
+    if "error" in box:
+        raise box["error"]
+    return box.get("text")
@@ -13,13 +13,29 @@ the Gemini models for your project.
 
 import os
 import json
+import contextvars
+import hashlib
 import logging
 import time
 import requests
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
 from dotenv import load_dotenv
 
+import deadlines
+import http_pool
+import image_cache
+import text_cache
+import adaptive_concurrency
+import circuit_breaker
+import model_registry
+import rate_limiter
+import retry_budget
+
 env_path = Path(__file__).parent / ".env"
 if env_path.exists():
     load_dotenv(env_path)
@@ -71,6 +87,10 @@ _IMAGEN_MODELS = [
 
 import threading as _threading
 _last_image_errors = _threading.local()
+# Settings handed over by use_config() (see below). A ContextVar rather
+# than a thread-local so asyncio tasks and their to_thread() helpers
+# (vertex_async) inherit it too.
+_cfg_override = contextvars.ContextVar("vertex_cfg", default=None)
 
 
 def get_last_image_errors() -> list:
@@ -87,6 +107,11 @@ def get_last_image_errors() -> list:
 # ---------------------------------------------------------------------------
 
 def _cfg() -> dict:
+    # A worker thread runs on the settings its caller handed it (use_config)
+    override = _cfg_override.get()
+    if override is not None:
+        return override
+
     # Session state (sidebar UI) takes highest priority, then env vars, then st.secrets
     project = ""
     location = ""
@@ -115,45 +140,180 @@ def _cfg() -> dict:
         except Exception:
             pass
 
-    return {"project": project, "location": location or "us-central1", "sa_json": sa_json}
+    # Offline stand-in (scripts/stub_backends.py): VERTEX_BASE_URL replaces
+    # the googleapis hosts and VERTEX_STUB_TOKEN replaces the OAuth token.
+    base_url = os.getenv("VERTEX_BASE_URL", "").rstrip("/")
+    stub_token = os.getenv("VERTEX_STUB_TOKEN", "") if base_url else ""
+
+    return {"project": project, "location": location or "us-central1", "sa_json": sa_json,
+            "base_url": base_url, "stub_token": stub_token}
+
+
+def session_config() -> dict:
+    """Vertex settings as this thread sees them. st.session_state (the
+    sidebar) is only visible on the Streamlit script thread, so resolve
+    this there and hand it to worker threads with use_config()."""
+    return dict(_cfg())
+
+
+@contextmanager
+def use_config(cfg: Optional[dict]):
+    """Run the block with `cfg` (from session_config()) as this thread's
+    Vertex settings. None leaves the thread's own settings in place."""
+    if cfg is None:
+        yield
+        return
+    token = _cfg_override.set(cfg)
+    try:
+        yield
+    finally:
+        _cfg_override.reset(token)
 
 
 def is_vertex_configured() -> bool:
     c = _cfg()
-    return bool(c["project"] and c["sa_json"])
+    return bool(c["project"] and (c["sa_json"] or c["stub_token"]))
+
+
+# ---------------------------------------------------------------------------
+# Access-token cache
+# ---------------------------------------------------------------------------
+# Minting a token is a full OAuth round-trip to Google. With 3 parallel
+# image workers and 12–28 pages per book that added dozens of round-trips
+# per book, so credentials are cached process-wide, keyed by a fingerprint
+# of the SA JSON, and reused until shortly before expiry. Each entry has
+# its own lock: the first thread to find a stale token refreshes it while
+# the others wait and then pick up the fresh one (single-flight).
+
+# Refresh this many seconds before the token's real expiry so a request
+# that starts just before the deadline never goes out with a dead token.
+_TOKEN_REFRESH_MARGIN_S = 300
+
+_token_cache: dict = {}          # sa fingerprint -> {"creds", "lock"}
+_token_cache_lock = _threading.Lock()
+_token_stats = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+
+def _sa_fingerprint(sa_json: str) -> str:
+    return hashlib.sha256(sa_json.encode("utf-8")).hexdigest()[:16]
+
+
+def _token_entry(sa_json: str) -> dict:
+    fp = _sa_fingerprint(sa_json)
+    with _token_cache_lock:
+        entry = _token_cache.get(fp)
+        if entry is None:
+            entry = {"creds": None, "lock": _threading.Lock()}
+            _token_cache[fp] = entry
+        return entry
+
+
+def _token_fresh(creds) -> bool:
+    if creds is None or not creds.token or creds.expiry is None:
+        return False
+    # google-auth stores expiry as a naive UTC datetime
+    remaining = (creds.expiry - datetime.utcnow()).total_seconds()
+    return remaining > _TOKEN_REFRESH_MARGIN_S
+
+
+def token_cache_stats() -> dict:
+    """Hit/miss counters for the access-token cache (admin panel)."""
+    with _token_cache_lock:
+        stats = dict(_token_stats)
+        stats["cached_credentials"] = len(_token_cache)
+    return stats
 
 
 def _token(raise_on_error: bool = False) -> Optional[str]:
-    sa = _cfg()["sa_json"]
+    c = _cfg()
+    if c["stub_token"]:
+        return c["stub_token"]
+    sa = c["sa_json"]
     if not sa:
         return None
-    try:
-        from google.oauth2 import service_account
-        from google.auth.transport.requests import Request as R
-        creds = service_account.Credentials.from_service_account_info(
-            json.loads(sa),
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
-        )
-        creds.refresh(R())
+    entry = _token_entry(sa)
+    creds = entry["creds"]
+    if _token_fresh(creds):
+        with _token_cache_lock:
+            _token_stats["hits"] += 1
         return creds.token
-    except json.JSONDecodeError as e:
-        msg = f"Service Account JSON is not valid JSON: {e}"
-        logger.error(f"Vertex SA JSON parse error: {e}")
-        if raise_on_error:
-            raise ValueError(msg) from e
-        return None
-    except Exception as e:
-        logger.warning(f"Vertex auth failed: {e}")
-        if raise_on_error:
-            raise
-        return None
+    with entry["lock"]:
+        # Another worker may have refreshed while we waited for the lock.
+        creds = entry["creds"]
+        if _token_fresh(creds):
+            with _token_cache_lock:
+                _token_stats["hits"] += 1
+            return creds.token
+        with _token_cache_lock:
+            _token_stats["misses"] += 1
+        try:
+            from google.oauth2 import service_account
+            from google.auth.transport.requests import Request as R
+            if creds is None:
+                creds = service_account.Credentials.from_service_account_info(
+                    json.loads(sa),
+                    scopes=["https://www.googleapis.com/auth/cloud-platform"],
+                )
+            creds.refresh(R())
+            entry["creds"] = creds
+            with _token_cache_lock:
+                _token_stats["refreshes"] += 1
+            return creds.token
+        except json.JSONDecodeError as e:
+            msg = f"Service Account JSON is not valid JSON: {e}"
+            logger.error(f"Vertex SA JSON parse error: {e}")
+            if raise_on_error:
+                raise ValueError(msg) from e
+            return None
+        except Exception as e:
+            with _token_cache_lock:
+                _token_stats["refresh_errors"] += 1
+            logger.warning(f"Vertex auth failed: {e}")
+            if raise_on_error:
+                raise
+            return None
+
+
+def vertex_diagnostics() -> dict:
+    """Admin-facing health of the Vertex client (no secret values)."""
+    c = _cfg()
+    diag = {
+        "project": c["project"] or "(not set)",
+        "location": c["location"],
+        "sa_json_set": bool(c["sa_json"]),
+    }
+    if c["base_url"]:
+        diag["base_url"] = c["base_url"]
+    for k, v in token_cache_stats().items():
+        diag[f"token_{k}"] = v
+    for k, v in rate_limiter.limiter_stats().items():
+        diag[f"ratelimit_{k}"] = v
+    for k, v in hedge_stats().items():
+        diag[f"hedge_{k}"] = v
+    for k, v in image_cache.cache_stats().items():
+        diag[f"imgcache_{k}"] = v
+    for k, v in text_cache.cache_stats().items():
+        diag[f"textcache_{k}"] = v
+    for k, v in adaptive_concurrency.concurrency_stats().items():
+        diag[f"concurrency_{k}"] = v
+    for k, v in retry_budget.budget_stats().items():
+        if k != "scopes":
+            diag[f"retrybudget_{k}"] = v
+    diag["breakers_open"] = sum(1 for b in circuit_breaker.states() if b["state"] != circuit_breaker.CLOSED)
+    return diag
+
+
+def _vertex_host(c: dict, location: str = "") -> str:
+    if c["base_url"]:
+        return c["base_url"]
+    return f"https://{location}-aiplatform.googleapis.com" if location else "https://aiplatform.googleapis.com"
 
 
 def _vertex_url(model: str) -> str:
     c = _cfg()
     p, l = c["project"], c["location"]
     return (
-        f"https://{l}-aiplatform.googleapis.com/v1/projects/{p}"
+        f"{_vertex_host(c, l)}/v1/projects/{p}"
         f"/locations/{l}/publishers/google/models/{model}:generateContent"
     )
 
@@ -163,7 +323,7 @@ def _vertex_global_url(model: str) -> str:
     c = _cfg()
     p = c["project"]
     return (
-        f"https://aiplatform.googleapis.com/v1/projects/{p}"
+        f"{_vertex_host(c)}/v1/projects/{p}"
         f"/locations/global/publishers/google/models/{model}:generateContent"
     )
 
@@ -173,11 +333,413 @@ def _vertex_predict_url(model: str) -> str:
     c = _cfg()
     p, l = c["project"], c["location"]
     return (
-        f"https://{l}-aiplatform.googleapis.com/v1/projects/{p}"
+        f"{_vertex_host(c, l)}/v1/projects/{p}"
         f"/locations/{l}/publishers/google/models/{model}:predict"
     )
 
 
+def _image_endpoints(model: str) -> list:
+    """(endpoint label, URL) pairs for a Gemini image model, in try order."""
+    return [("global", _vertex_global_url(model)), (_cfg()["location"], _vertex_url(model))]
+
+
+# Cheapest request that still tells us whether a model exists for the
+# project: a one-token text generation. 404/403 mean "still not enabled".
+_PROBE_PAYLOAD = {
+    "contents": [{"role": "user", "parts": [{"text": "ping"}]}],
+    "generationConfig": {"maxOutputTokens": 1},
+}
+
+
+def _probe(url: str, headers: dict):
+    def _run() -> int:
+        if url.endswith(":predict"):
+            body = {"instances": [{"prompt": "ping"}], "parameters": {"sampleCount": 1}}
+        else:
+            body = _PROBE_PAYLOAD
+        return http_pool.post(url, headers=headers, json=body, timeout=30).status_code
+    return _run
+
+
+def _image_plan(headers: dict) -> tuple:
+    """Gemini and Imagen (model, [(endpoint, url), ...]) lists with
+    known-dead pairs removed (see model_registry). If the registry would
+    leave nothing to try, every pair is tried inline instead."""
+    c = _cfg()
+    project = c["project"]
+    gemini = [(m, _image_endpoints(m)) for m in _GEMINI_IMAGE_MODELS]
+    imagen = [(m, [(f"predict:{c['location']}", _vertex_predict_url(m))]) for m in _IMAGEN_MODELS]
+
+    def _live(plan):
+        return [
+            (m, [(ep, url) for ep, url in eps
+                 if not model_registry.is_dead(project, m, ep, probe=_probe(url, headers))])
+            for m, eps in plan
+        ]
+
+    live_gemini, live_imagen = _live(gemini), _live(imagen)
+    if not any(eps for _, eps in live_gemini + live_imagen):
+        logger.warning("model_registry: every image model is marked dead — probing all inline")
+        return gemini, imagen
+    return live_gemini, live_imagen
+
+
+def _image_parts(prompt: str, reference_image_b64=None) -> list:
+    """Request parts for a Gemini image call: reference photo(s) + prompt."""
+    if reference_image_b64:
+        refs = reference_image_b64 if isinstance(reference_image_b64, list) else [reference_image_b64]
+        n = len(refs)
+        parts = [{"inlineData": {"mimeType": "image/jpeg", "data": r}} for r in refs]
+        likeness_instruction = (
+            "CRITICAL LIKENESS REQUIREMENT: The child in this illustration MUST closely match the reference photo(s). "
+            "Preserve the EXACT same face shape, skin tone, hair color, hair texture, hair length, eye shape, "
+            "eye color, nose shape, and facial proportions. The child should be immediately recognizable as "
+            "the same person in the reference photo. Do NOT change any facial features."
+        )
+        note = (
+            f"Use all {n} reference photos together to build a complete picture of the child's appearance. {likeness_instruction}"
+            if n > 1
+            else f"Make the child look EXACTLY like the person in the reference photo. {likeness_instruction}"
+        )
+        parts.append({"text": f"{prompt}. {note}"})
+        return parts
+    return [{"text": prompt}]
+
+
+def _image_payload(prompt: str, reference_image_b64=None) -> dict:
+    return {
+        "contents": [{"role": "user", "parts": _image_parts(prompt, reference_image_b64)}],
+        "generationConfig": {
+            "responseModalities": ["TEXT", "IMAGE"],
+            "temperature": 0.4,
+        },
+    }
+
+
+def _imagen_payload(prompt: str, reference_image_b64=None) -> dict:
+    if reference_image_b64:
+        prompt = f"{prompt}. Make the child look like the person in the reference photo."
+    return {
+        "instances": [{"prompt": prompt}],
+        "parameters": {
+            "sampleCount": 1,
+            "aspectRatio": "3:4",
+        },
+    }
+
+
+def _text_payload(prompt: str, temperature: float, max_tokens: int) -> dict:
+    return {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": temperature,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": max_tokens,
+        },
+    }
+
+
+def _extract_text(resp_json: dict) -> Optional[str]:
+    parts = resp_json.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+    text = "".join(p.get("text", "") for p in parts).strip()
+    return text or None
+
+
+def _extract_image(resp_json: dict) -> Optional[str]:
+    """Base64 image data from a generateContent or :predict response."""
+    for part in resp_json.get("candidates", [{}])[0].get("content", {}).get("parts", []):
+        if "inlineData" in part:
+            return part["inlineData"]["data"]
+    predictions = resp_json.get("predictions") or []
+    if predictions and predictions[0].get("bytesBase64Encoded"):
+        return predictions[0]["bytesBase64Encoded"]
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Latency tracking + hedged requests
+# ---------------------------------------------------------------------------
+# Image latency has a long tail (180s timeout, retries, model fall-through).
+# Customer-facing builds can opt in to hedging: if the primary model hasn't
+# answered by the HEDGE_PERCENTILE of its recent successful latencies, a
+# second request goes to the next model / endpoint and the first success
+# wins. Hedges are capped at HEDGE_MAX_PCT of image requests so a slow
+# spell can't double our Vertex traffic.
+#
+# Tunables (env vars):
+#   VERTEX_HEDGING          — "0" disables hedging even for opted-in callers
+#   VERTEX_HEDGE_PERCENTILE — latency percentile that triggers a hedge (default 0.9)
+#   VERTEX_HEDGE_MAX_PCT    — max hedges as % of image requests (default 10)
+#   VERTEX_HEDGE_DEFAULT_S  — hedge delay before we have latency samples (default 45)
+
+HEDGING_ENABLED = os.environ.get("VERTEX_HEDGING", "1").lower() not in ("0", "false", "no")
+HEDGE_PERCENTILE = float(os.environ.get("VERTEX_HEDGE_PERCENTILE", "0.9"))
+HEDGE_MAX_PCT = float(os.environ.get("VERTEX_HEDGE_MAX_PCT", "10"))
+HEDGE_DEFAULT_S = float(os.environ.get("VERTEX_HEDGE_DEFAULT_S", "45"))
+_LATENCY_SAMPLES = 50
+_MIN_LATENCY_SAMPLES = 5
+
+_latencies: dict = {}      # model -> deque of recent successful latencies (s)
+_hedge_lock = _threading.Lock()
+_hedge_stats = {"image_requests": 0, "hedges_sent": 0, "hedge_wins": 0}
+_hedge_pool = None
+
+
+def _record_latency(model: str, seconds: float) -> None:
+    with _hedge_lock:
+        dq = _latencies.get(model)
+        if dq is None:
+            dq = deque(maxlen=_LATENCY_SAMPLES)
+            _latencies[model] = dq
+        dq.append(seconds)
+
+
+def _latency_percentile(model: str, pct: float) -> Optional[float]:
+    with _hedge_lock:
+        samples = sorted(_latencies.get(model) or [])
+    if len(samples) < _MIN_LATENCY_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(pct * len(samples)))]
+
+
+def _take_hedge_budget() -> bool:
+    with _hedge_lock:
+        budget = _hedge_stats["image_requests"] * HEDGE_MAX_PCT / 100.0
+        if _hedge_stats["hedges_sent"] + 1 > budget:
+            return False
+        _hedge_stats["hedges_sent"] += 1
+        return True
+
+
+def hedge_stats() -> dict:
+    with _hedge_lock:
+        return dict(_hedge_stats)
+
+
+def _get_hedge_pool():
+    # Runs backup legs only — the primary leg stays on the caller's thread.
+    # Sized so every call that adaptive_concurrency can admit has room for
+    # its backup even when hedges bunch up.
+    global _hedge_pool
+    with _hedge_lock:
+        if _hedge_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _hedge_pool = ThreadPoolExecutor(max_workers=2 * adaptive_concurrency.MAX_LIMIT,
+                                             thread_name_prefix="vertex-hedge")
+        return _hedge_pool
+
+
+def _image_attempt(project: str, model: str, endpoint: str, url: str,
+                   headers: dict, payload: dict, cancelled, res,
+                   deadline=deadlines.NO_DEADLINE) -> tuple:
+    """One Gemini image request with breaker/registry/latency bookkeeping.
+
+    Returns (base64 image | None, error message | None). Skips the call if
+    `cancelled` is already set (the other hedge leg won first)."""
+    if cancelled.is_set() or not deadline.can_start():
+        return None, None
+    if not rate_limiter.acquire(model, timeout=deadline.wait_budget(rate_limiter.MAX_WAIT_S)):
+        return None, f"{model}: rate-limit queue timeout"
+    if cancelled.is_set():
+        return None, None
+    try:
+        r, latency = _timed_post(res, model, endpoint, url, headers, payload,
+                                 timeout=deadline.timeout(180),
+                                 slot_timeout=deadline.wait_budget(rate_limiter.MAX_WAIT_S))
+    except ConcurrencyQueueTimeout as e:
+        return None, f"{model}: {e}"
+    except (requests.Timeout, requests.ConnectionError) as e:
+        circuit_breaker.record_failure(model, endpoint)
+        return None, f"{model}: {e}"
+    if r.status_code == 200:
+        circuit_breaker.record_success(model, endpoint)
+        data = _extract_image(r.json())
+        if data:
+            _record_latency(model, latency)
+            model_registry.record_success(project, model, endpoint)
+            return data, None
+        return None, f"{model}: 200 but no image in response"
+    if r.status_code in (403, 404):
+        model_registry.record_unavailable(project, model, endpoint, r.status_code, r.text[:200])
+    elif r.status_code == 429:
+        rate_limiter.penalize(model, 8)
+    elif r.status_code >= 500:
+        circuit_breaker.record_failure(model, endpoint)
+    return None, f"{model}: HTTP {r.status_code} — {r.text[:200]}"
+
+
+def _hedged_image(project: str, gemini_plan: list, headers: dict,
+                  payload: dict, res, deadline=deadlines.NO_DEADLINE) -> tuple:
+    """First round of a hedged image call. Returns ((base64 data, model,
+    endpoint) | None, models tried); on None the caller continues with the
+    normal sequential fallback, skipping the models tried here. Attempts
+    and errors are recorded on `res`.
+
+    The primary leg runs on the caller's thread. A timer fires after the
+    hedge delay and, if the primary is still out, hands a backup leg to
+    the hedge pool; whichever succeeds first wins."""
+    flat = [(m, ep, url) for m, eps in gemini_plan for ep, url in eps]
+    # Breakers are consulted only for the legs we actually send, so a
+    # half-open trial isn't spent on a candidate we then ignore.
+    primary = next((c for c in flat if circuit_breaker.allow(c[0], c[1])), None)
+    if primary is None:
+        return None, set()
+    rest = flat[flat.index(primary) + 1:]
+    # Prefer hedging onto a different model; else the other endpoint.
+    backups = [c for c in rest if c[0] != primary[0]] + [c for c in rest if c[0] == primary[0]]
+    delay = _latency_percentile(primary[0], HEDGE_PERCENTILE) or HEDGE_DEFAULT_S
+
+    cancelled = _threading.Event()
+    state = {"primary_done": False, "backup": None, "future": None}
+    state_lock = _threading.Lock()
+
+    def _launch_backup():
+        with state_lock:
+            if state["primary_done"] or not backups or not deadline.can_start():
+                return
+            if not _take_hedge_budget():
+                return
+            backup = next((c for c in backups if circuit_breaker.allow(c[0], c[1])), None)
+            if backup is None:
+                return
+            logger.info(
+                f"Vertex hedge: {primary[0]} slower than {delay:.0f}s, "
+                f"hedging to {backup[0]} @ {backup[1]}"
+            )
+            res.hedged = True
+            state["backup"] = backup
+            state["future"] = _get_hedge_pool().submit(
+                _image_attempt, project, *backup, headers, payload, cancelled, res, deadline)
+
+    timer = _threading.Timer(delay, _launch_backup)
+    timer.daemon = True
+    timer.start()
+    try:
+        data, err = _image_attempt(project, *primary, headers, payload, cancelled, res, deadline)
+    except Exception as e:
+        data, err = None, f"{primary[0]}: {e}"
+    timer.cancel()
+    with state_lock:
+        state["primary_done"] = True
+        backup, fut = state["backup"], state["future"]
+    tried = {primary[0]} | ({backup[0]} if backup else set())
+    if data:
+        # The backup can't be aborted mid-request; flag it so it is
+        # skipped if not yet sent, and its answer is dropped.
+        cancelled.set()
+        if fut is not None:
+            fut.cancel()
+        logger.info(f"Vertex Gemini image OK (hedged): {primary[0]} @ {primary[1]}")
+        return (data, primary[0], primary[1]), tried
+    if err:
+        res.errors.append(err)
+    if fut is None:
+        return None, tried
+    try:
+        data, err = fut.result()
+    except Exception as e:
+        data, err = None, f"{backup[0]}: {e}"
+    if data:
+        with _hedge_lock:
+            _hedge_stats["hedge_wins"] += 1
+        logger.info(f"Vertex Gemini image OK (hedged): {backup[0]} @ {backup[1]}")
+        return (data, backup[0], backup[1]), tried
+    if err:
+        res.errors.append(err)
+    return None, tried
+
+
+# ---------------------------------------------------------------------------
+# Flow steps
+# ---------------------------------------------------------------------------
+# call_gemini_text and generate_image are written as generators ("flows")
+# that yield the blocking steps below instead of doing them, so one copy
+# of the retry/fallback logic runs both on a thread (`_run`, here) and on
+# an event loop (vertex_async, which awaits each step). Every step's run()
+# is the blocking version; a step's exception is thrown back into the flow
+# at its yield, so the flow's except clauses work the same either way.
+
+@dataclass
+class _Call:
+    """Blocking work with no async version — token refresh, the model
+    plan, hedged legs, anything that may touch Mongo. vertex_async runs
+    it on a worker thread."""
+    fn: Callable
+    args: tuple = ()
+
+    def run(self):
+        return self.fn(*self.args)
+
+
+@dataclass
+class _Acquire:
+    """Queue for a rate_limiter token."""
+    model: str
+    timeout: float
+
+    def run(self) -> bool:
+        return rate_limiter.acquire(self.model, timeout=self.timeout)
+
+
+@dataclass
+class _Sleep:
+    """Back off within a deadline."""
+    deadline: deadlines.Deadline
+    seconds: float
+
+    def run(self) -> bool:
+        return self.deadline.sleep(self.seconds)
+
+
+@dataclass
+class _Post:
+    """Plain POST (text). Returns the response."""
+    url: str
+    headers: dict
+    payload: dict
+    timeout: float
+
+    def run(self):
+        return http_pool.post(self.url, headers=self.headers, json=self.payload, timeout=self.timeout)
+
+
+@dataclass
+class _ImagePost:
+    """Image POST inside an adaptive-concurrency slot, recorded on `res`
+    (see _timed_post). Returns (response, latency)."""
+    res: "ImageCallResult"
+    model: str
+    endpoint: str
+    url: str
+    headers: dict
+    payload: dict
+    timeout: float
+    slot_timeout: Optional[float]
+
+    def run(self) -> tuple:
+        return _timed_post(self.res, self.model, self.endpoint, self.url, self.headers,
+                           self.payload, timeout=self.timeout, slot_timeout=self.slot_timeout)
+
+
+def _run(flow):
+    """Drive a flow on this thread; returns what the flow returns."""
+    value, error = None, None
+    try:
+        while True:
+            try:
+                step = flow.throw(error) if error is not None else flow.send(value)
+            except StopIteration as done:
+                return done.value
+            value, error = None, None
+            try:
+                value = step.run()
+            except Exception as e:
+                error = e
+    finally:
+        flow.close()
+
+
 # ---------------------------------------------------------------------------
 # Text generation
 # ---------------------------------------------------------------------------
@@ -187,40 +749,47 @@ def call_gemini_text(
     api_key: str = "",
     temperature: float = 0.7,
     max_tokens: int = 8192,
+    cache_scope: str = "",
 ) -> Optional[str]:
-    """Generate text. Vertex AI first, then Google AI API fallback."""
+    """Generate text. Vertex AI first, then Google AI API fallback.
+
+    Pass cache_scope (the user id) to let an identical repeat of this
+    request within a few minutes be answered from text_cache.
+    """
+    return _run(_text_flow(prompt, temperature, max_tokens, cache_scope))
+
 
-    def _extract(resp_json: dict) -> Optional[str]:
-        parts = resp_json.get("candidates", [{}])[0].get("content", {}).get("parts", [])
-        text = "".join(p.get("text", "") for p in parts).strip()
-        return text or None
+def _text_flow(prompt: str, temperature: float, max_tokens: int, cache_scope: str):
+    """call_gemini_text as a flow (see "Flow steps")."""
+    cache_key = None
+    if cache_scope:
+        cache_key = text_cache.cache_key(cache_scope, ",".join(_TEXT_MODELS), prompt, temperature, max_tokens)
+        cached = text_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
     # --- Vertex AI ---
     vertex_errors = []
     if is_vertex_configured():
         try:
-            tok = _token(raise_on_error=True)
+            tok = yield _Call(_token, (True,))
         except Exception as e:
             tok = None
             vertex_errors.append(f"Auth failed: {e}")
         if tok:
             headers = {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
-            payload = {
-                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-                "generationConfig": {
-                    "temperature": temperature,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": max_tokens,
-                },
-            }
+            payload = _text_payload(prompt, temperature, max_tokens)
             for model in _TEXT_MODELS:
                 try:
-                    r = requests.post(_vertex_url(model), headers=headers, json=payload, timeout=120)
+                    r = yield _Post(_vertex_url(model), headers, payload, 120)
                     if r.status_code == 200:
-                        text = _extract(r.json())
+                        body = r.json()
+                        text = _extract_text(body)
                         if text:
                             logger.info(f"Vertex text OK: {model}")
+                            if cache_key:
+                                usage = body.get("usageMetadata") or {}
+                                text_cache.put(cache_key, text, usage.get("totalTokenCount", 0))
                             return text
                         vertex_errors.append(f"{model}: 200 but no text in response")
                     else:
@@ -250,109 +819,406 @@ def call_gemini_text(
     return None
 
 
+def _vertex_stream_url(model: str) -> str:
+    return _vertex_url(model).replace(":generateContent", ":streamGenerateContent") + "?alt=sse"
+
+
+def stream_gemini_text(
+    prompt: str,
+    temperature: float = 0.7,
+    max_tokens: int = 8192,
+    cache_scope: str = "",
+) -> Iterator[str]:
+    """Stream text via streamGenerateContent, yielding chunks as they arrive.
+
+    Falls through the text models like call_gemini_text, but only until the
+    first chunk has been yielded — after that a mid-stream failure raises
+    so the caller can fall back to a blocking call. Cache hits (see
+    call_gemini_text's cache_scope) come back as a single chunk.
+    """
+    cache_key = None
+    if cache_scope:
+        cache_key = text_cache.cache_key(cache_scope, ",".join(_TEXT_MODELS), prompt, temperature, max_tokens)
+        cached = text_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    if not is_vertex_configured():
+        raise RuntimeError("Vertex AI not configured")
+    tok = _token(raise_on_error=True)
+    headers = {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
+    payload = _text_payload(prompt, temperature, max_tokens)
+    errors = []
+    for model in _TEXT_MODELS:
+        try:
+            r = http_pool.post(_vertex_stream_url(model), headers=headers, json=payload,
+                               timeout=120, stream=True)
+        except Exception as e:
+            errors.append(f"{model}: {e}")
+            continue
+        if r.status_code != 200:
+            errors.append(f"{model}: HTTP {r.status_code} — {r.text[:200]}")
+            logger.warning(f"Vertex stream {model} → {r.status_code}: {r.text[:150]}")
+            r.close()
+            continue
+        parts, tokens = [], 0
+        try:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                try:
+                    event = json.loads(line[5:].strip())
+                except ValueError:
+                    continue
+                tokens = (event.get("usageMetadata") or {}).get("totalTokenCount", tokens)
+                for part in (event.get("candidates") or [{}])[0].get("content", {}).get("parts", []):
+                    chunk = part.get("text", "")
+                    if chunk:
+                        parts.append(chunk)
+                        yield chunk
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if parts:
+                raise
+            errors.append(f"{model}: {e}")
+            continue
+        finally:
+            r.close()
+        if parts:
+            logger.info(f"Vertex text stream OK: {model}")
+            if cache_key:
+                text_cache.put(cache_key, "".join(parts), tokens)
+            return
+        errors.append(f"{model}: empty stream")
+    raise RuntimeError("; ".join(errors[:2]) or "No text returned")
+
+
 # ---------------------------------------------------------------------------
 # Image generation
 # ---------------------------------------------------------------------------
 
+@dataclass
+class ImageAttempt:
+    """One HTTP request made while generating an image."""
+    model: str
+    endpoint: str
+    status: str            # HTTP status code, or the exception name
+    latency_s: float
+    error: str = ""
+
+
+@dataclass
+class ImageCallResult:
+    """Outcome of one generate_image call.
+
+    Replaces the old `_last_image_errors` thread-local as the way callers
+    learn what happened: which model/endpoint produced the image, every
+    attempt with its status and latency, and the total wall time. Hedge
+    legs that lose the race may append their attempt after the call has
+    returned.
+    """
+    data_b64: Optional[str] = None
+    mime_type: str = "image/png"
+    model: str = ""
+    endpoint: str = ""
+    attempts: List[ImageAttempt] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    wall_time_s: float = 0.0
+    hedged: bool = False
+    cached: bool = False
+    deadline_exceeded: bool = False
+    _image: object = field(default=None, repr=False, compare=False)
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.data_b64)
+
+    @property
+    def bytes_returned(self) -> int:
+        if not self.data_b64:
+            return 0
+        return len(self.data_b64) * 3 // 4 - self.data_b64[-2:].count("=")
+
+    @property
+    def data_url(self) -> Optional[str]:
+        if not self.data_b64:
+            return None
+        return f"data:{self.mime_type};base64,{self.data_b64}"
+
+    @property
+    def image(self):
+        """The image as an image_bytes.EncodedImage (decoded once), or None."""
+        if not self.data_b64:
+            return None
+        if self._image is None:
+            from image_bytes import EncodedImage
+            self._image = EncodedImage.from_b64(self.data_b64)
+        return self._image
+
+    def error_summary(self, n: int = 2, width: int = 160) -> str:
+        return " | ".join(str(e)[:width] for e in self.errors[:n])
+
+    def as_log_dict(self) -> dict:
+        return {
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "attempts": len(self.attempts),
+            "wall_time_s": round(self.wall_time_s, 2),
+            "bytes": self.bytes_returned,
+            "hedged": self.hedged,
+            "cached": self.cached,
+            "deadline_exceeded": self.deadline_exceeded,
+        }
+
+
+class ConcurrencyQueueTimeout(Exception):
+    """No adaptive-concurrency slot freed up in time for a request."""
+
+
+def _timed_post(res: ImageCallResult, model: str, endpoint: str, url: str,
+                headers: dict, payload: dict, timeout: float = 180,
+                slot_timeout: Optional[float] = None):
+    """POST and record the attempt on `res`. Network errors are recorded
+    and re-raised so the caller's retry logic still sees them.
+
+    The adaptive-concurrency slot is held for this request only — not
+    while the caller queues on the rate limiter or sleeps between
+    attempts — and raises ConcurrencyQueueTimeout if none frees up within
+    `slot_timeout` seconds."""
+    if not adaptive_concurrency.acquire(timeout=slot_timeout):
+        raise ConcurrencyQueueTimeout("image concurrency queue timeout — too many renders in flight")
+    t0 = time.monotonic()
+    attempt = None
+    try:
+        try:
+            r = http_pool.post(url, headers=headers, json=payload, timeout=timeout)
+        except Exception as e:
+            attempt = _record_attempt(res, model, endpoint, t0, exc=e)
+            raise
+        attempt = _record_attempt(res, model, endpoint, t0, r)
+        return r, attempt.latency_s
+    finally:
+        adaptive_concurrency.release(attempt)
+
+
+def _record_attempt(res: ImageCallResult, model: str, endpoint: str, t0: float,
+                    r=None, exc: Optional[BaseException] = None) -> ImageAttempt:
+    """Add one request's outcome (its response, or the exception it
+    raised) to `res`."""
+    if exc is not None:
+        attempt = ImageAttempt(model, endpoint, type(exc).__name__,
+                               time.monotonic() - t0, str(exc)[:200])
+    else:
+        attempt = ImageAttempt(model, endpoint, str(r.status_code), time.monotonic() - t0,
+                               "" if r.status_code == 200 else r.text[:200])
+    res.attempts.append(attempt)
+    return attempt
+
+
 def call_gemini_image(
     prompt: str,
     api_key: str = "",
     reference_image_b64: Optional[str] = None,
+    hedge: bool = False,
+    force_fresh: bool = False,
+    deadline=None,
 ) -> Optional[str]:
-    """Generate an image. Vertex AI first, then Google AI API fallback. Returns data URL or None."""
-
-    def _build_parts(include_ref: bool) -> list:
-        if include_ref and reference_image_b64:
-            refs = reference_image_b64 if isinstance(reference_image_b64, list) else [reference_image_b64]
-            n = len(refs)
-            parts = [{"inlineData": {"mimeType": "image/jpeg", "data": r}} for r in refs]
-            likeness_instruction = (
-                "CRITICAL LIKENESS REQUIREMENT: The child in this illustration MUST closely match the reference photo(s). "
-                "Preserve the EXACT same face shape, skin tone, hair color, hair texture, hair length, eye shape, "
-                "eye color, nose shape, and facial proportions. The child should be immediately recognizable as "
-                "the same person in the reference photo. Do NOT change any facial features."
-            )
-            note = (
-                f"Use all {n} reference photos together to build a complete picture of the child's appearance. {likeness_instruction}"
-                if n > 1
-                else f"Make the child look EXACTLY like the person in the reference photo. {likeness_instruction}"
-            )
-            parts.append({"text": f"{prompt}. {note}"})
-            return parts
-        return [{"text": prompt}]
+    """Generate an image. Returns a data URL or None.
 
-    # --- Vertex AI ---
-    vertex_img_errors = []
-    # Reset thread-local error list so callers can read it after this
-    # invocation returns None / falls through.
+    Thin wrapper over generate_image() for callers that only want the
+    image; failure detail stays readable via get_last_image_errors().
+    """
+    res = generate_image(prompt, reference_image_b64=reference_image_b64, hedge=hedge,
+                         force_fresh=force_fresh, deadline=deadline)
+    return res.data_url
+
+
+# Part of the image cache key: changing the model list invalidates old entries
+_IMAGE_MODELS_TAG = ",".join(_GEMINI_IMAGE_MODELS + _IMAGEN_MODELS)
+
+
+def generate_image(
+    prompt: str,
+    reference_image_b64: Optional[str] = None,
+    hedge: bool = False,
+    force_fresh: bool = False,
+    deadline=None,
+) -> ImageCallResult:
+    """Generate an image via Vertex AI and describe how it went.
+
+    hedge=True opts a customer-facing call into hedged requests (see above).
+    Identical requests are served from image_cache unless force_fresh=True
+    (deliberate regenerations), in which case the new image replaces the
+    cached one.
+
+    deadline (a deadlines.Deadline) bounds the whole call: request
+    timeouts and back-offs shrink to the time left, and no new attempt is
+    started once it is spent — the result then has deadline_exceeded set.
+    vertex_async.generate_image_async runs the same flow on an event loop.
+    """
+    return _run(_image_flow(prompt, reference_image_b64, hedge, force_fresh, deadline))
+
+
+def _image_flow(prompt: str, reference_image_b64, hedge: bool, force_fresh: bool, deadline):
+    """generate_image as a flow (see "Flow steps")."""
+    res = ImageCallResult()
+    deadline = deadline or deadlines.NO_DEADLINE
+    t_start = time.monotonic()
+    # Kept in step with res.errors for legacy get_last_image_errors() callers
+    vertex_img_errors = res.errors
     _last_image_errors.errors = vertex_img_errors
+    cache_key = image_cache.cache_key(prompt, _IMAGE_MODELS_TAG, reference_image_b64)
+
+    def _done(data_b64: Optional[str] = None, model: str = "", endpoint: str = ""):
+        res.data_b64 = data_b64
+        res.model, res.endpoint = model, endpoint
+        res.wall_time_s = time.monotonic() - t_start
+        if data_b64:
+            if not res.cached:
+                yield _Call(retry_budget.record_success, ("vertex",))
+                yield _Call(image_cache.put, (cache_key, data_b64, res.mime_type, model))
+            logger.info(f"Vertex image result: {res.as_log_dict()}")
+        return res
+
+    def _out_of_time() -> bool:
+        if deadline.can_start():
+            return False
+        if not res.deadline_exceeded:
+            res.deadline_exceeded = True
+            vertex_img_errors.append(f"Gave up: {deadline.describe()}")
+            logger.warning(f"Vertex image: {deadline.describe()} — not starting another attempt")
+        return True
+
+    def _retry_allowed(model: str):
+        # Shared across sessions: under a Vertex brown-out, retries stop
+        # and we fall through to the next model instead of piling on.
+        if (yield _Call(retry_budget.try_retry, ("vertex", model))):
+            return True
+        vertex_img_errors.append(f"{model}: retry budget exhausted")
+        return False
+
+    if force_fresh:
+        image_cache.note_bypass()
+    else:
+        hit = yield _Call(image_cache.get, (cache_key,))
+        if hit:
+            res.cached = True
+            res.mime_type = hit["mime_type"]
+            return (yield from _done(hit["data_b64"], hit["model"], "cache"))
+
     if is_vertex_configured():
         try:
-            tok = _token(raise_on_error=True)
+            tok = yield _Call(_token, (True,))
         except Exception as e:
             tok = None
             vertex_img_errors.append(f"Auth failed: {e}")
         if tok:
             headers = {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
+            project = _cfg()["project"]
 
             # Try Gemini image models (generateContent API with responseModalities)
             # Global endpoint is tried first as gemini-2.5-flash-image requires it;
             # regional endpoint is the fallback for older models.
-            payload = {
-                "contents": [{"role": "user", "parts": _build_parts(True)}],
-                "generationConfig": {
-                    "responseModalities": ["TEXT", "IMAGE"],
-                    "temperature": 0.4,
-                },
-            }
-            for model in _GEMINI_IMAGE_MODELS:
-                urls_to_try = [_vertex_global_url(model), _vertex_url(model)]
+            payload = _image_payload(prompt, reference_image_b64)
+            gemini_plan, imagen_plan = yield _Call(_image_plan, (headers,))
+            with _hedge_lock:
+                _hedge_stats["image_requests"] += 1
+            if hedge and HEDGING_ENABLED:
+                won, tried = yield _Call(_hedged_image, (project, gemini_plan, headers, payload, res, deadline))
+                if won:
+                    data, model, endpoint = won
+                    return (yield from _done(data, model, endpoint))
+                # Those models just failed; fall through to the next ones.
+                gemini_plan = [(m, eps) for m, eps in gemini_plan if m not in tried]
+            for model, urls_to_try in gemini_plan:
+                if not urls_to_try:
+                    continue
                 model_success = False
-                for url in urls_to_try:
+                for endpoint, url in urls_to_try:
+                    # Sick pair (recent 5xx storm): go straight to the next
+                    # endpoint / fallback model instead of sleeping on it.
+                    if not circuit_breaker.allow(model, endpoint):
+                        vertex_img_errors.append(f"{model}: circuit open at {endpoint}")
+                        continue
                     for _attempt in range(3):
+                        if _out_of_time():
+                            return (yield from _done())
                         try:
-                            r = requests.post(url, headers=headers, json=payload, timeout=180)
+                            # Queue for quota on this model's shared bucket
+                            # instead of discovering the limit via a 429.
+                            if not (yield _Acquire(model, deadline.wait_budget(rate_limiter.MAX_WAIT_S))):
+                                vertex_img_errors.append(f"{model}: rate-limit queue timeout")
+                                model_success = True
+                                break
+                            r, latency = yield _ImagePost(res, model, endpoint, url, headers, payload,
+                                                          deadline.timeout(180),
+                                                          deadline.wait_budget(rate_limiter.MAX_WAIT_S))
                             if r.status_code == 200:
-                                for part in r.json().get("candidates", [{}])[0].get("content", {}).get("parts", []):
-                                    if "inlineData" in part:
-                                        logger.info(f"Vertex Gemini image OK: {model} ({url})")
-                                        return f"data:image/png;base64,{part['inlineData']['data']}"
+                                circuit_breaker.record_success(model, endpoint)
+                                data = _extract_image(r.json())
+                                if data:
+                                    _record_latency(model, latency)
+                                    logger.info(f"Vertex Gemini image OK: {model} ({url})")
+                                    yield _Call(model_registry.record_success, (project, model, endpoint))
+                                    return (yield from _done(data, model, endpoint))
                                 vertex_img_errors.append(f"{model}: 200 but no image in response")
                                 model_success = True
                                 break
                             elif r.status_code == 429:
-                                # Honour Retry-After if Cashfree sends it,
+                                # Honour Retry-After if Vertex sends it,
                                 # else exponential backoff (8s, 20s, 45s).
+                                # The back-off is applied to the model's
+                                # shared bucket so every thread waits it out,
+                                # not just this one; the next acquire()
+                                # blocks until it has passed.
                                 _ra = r.headers.get("Retry-After", "")
                                 try:
                                     wait = int(_ra) if _ra else [8, 20, 45][_attempt]
                                 except ValueError:
                                     wait = [8, 20, 45][_attempt]
-                                logger.warning(f"Vertex Gemini image {model} rate limited (429), waiting {wait}s (attempt {_attempt+1}/3)")
-                                time.sleep(wait)
+                                logger.warning(f"Vertex Gemini image {model} rate limited (429), backing off {wait}s (attempt {_attempt+1}/3)")
+                                rate_limiter.penalize(model, wait)
+                                if _attempt < 2 and not (yield from _retry_allowed(model)):
+                                    break
                                 continue
                             elif r.status_code == 404:
                                 logger.warning(f"Vertex Gemini image {model} 404 at {url}, trying next")
+                                yield _Call(model_registry.record_unavailable, (project, model, endpoint, 404, r.text[:200]))
                                 break
                             elif r.status_code in (500, 502, 503, 504):
                                 # Transient server error — retry with backoff.
                                 # These are common during Vertex hot-pathing.
+                                # If this tips the breaker open, stop retrying
+                                # and fall through to the next model now.
+                                circuit_breaker.record_failure(model, endpoint)
+                                if circuit_breaker.is_open(model, endpoint):
+                                    vertex_img_errors.append(f"{model}: circuit opened after HTTP {r.status_code}")
+                                    break
+                                if _attempt < 2 and not (yield from _retry_allowed(model)):
+                                    break
                                 wait = [5, 15, 40][_attempt]
                                 logger.warning(f"Vertex Gemini image {model} server error ({r.status_code}), waiting {wait}s (attempt {_attempt+1}/3)")
-                                time.sleep(wait)
+                                yield _Sleep(deadline, wait)
                                 continue
                             else:
                                 # Real 4xx (400 bad request, 401 auth, 403 perm) — not retryable
+                                if r.status_code == 403:
+                                    yield _Call(model_registry.record_unavailable, (project, model, endpoint, 403, r.text[:200]))
                                 vertex_img_errors.append(f"{model}: HTTP {r.status_code} — {r.text[:200]}")
                                 logger.warning(f"Vertex Gemini image {model} → {r.status_code}: {r.text[:150]}")
                                 model_success = True
                                 break
+                        except ConcurrencyQueueTimeout as e:
+                            # Every model shares the slots; trying the next won't help.
+                            vertex_img_errors.append(str(e))
+                            return (yield from _done())
                         except (requests.Timeout, requests.ConnectionError) as e:
                             # Network glitch — retry. Last attempt falls through to next model.
-                            if _attempt < 2:
+                            circuit_breaker.record_failure(model, endpoint)
+                            if (_attempt < 2 and not circuit_breaker.is_open(model, endpoint)
+                                    and (yield from _retry_allowed(model))):
                                 wait = [2, 5, 10][_attempt]
                                 logger.warning(f"Vertex Gemini image {model} network error, waiting {wait}s (attempt {_attempt+1}/3): {e}")
-                                time.sleep(wait)
+                                yield _Sleep(deadline, wait)
                                 continue
                             vertex_img_errors.append(f"{model}: {e}")
                             model_success = True
@@ -368,29 +1234,32 @@ def call_gemini_image(
                     vertex_img_errors.append(f"{model}: 404 on all endpoints")
 
             # Try Imagen models (predict API — different payload and response format)
-            for model in _IMAGEN_MODELS:
-                imagen_prompt = prompt
-                if reference_image_b64:
-                    imagen_prompt = f"{prompt}. Make the child look like the person in the reference photo."
+            for model, endpoints in imagen_plan:
+                if not endpoints:
+                    continue
+                endpoint, predict_url = endpoints[0]
+                if not circuit_breaker.allow(model, endpoint):
+                    vertex_img_errors.append(f"{model}: circuit open at {endpoint}")
+                    continue
+                imagen_payload = _imagen_payload(prompt, reference_image_b64)
                 for _attempt in range(3):
+                    if _out_of_time():
+                        return (yield from _done())
                     try:
-                        r = requests.post(
-                            _vertex_predict_url(model),
-                            headers=headers,
-                            json={
-                                "instances": [{"prompt": imagen_prompt}],
-                                "parameters": {
-                                    "sampleCount": 1,
-                                    "aspectRatio": "3:4",
-                                },
-                            },
-                            timeout=180,
-                        )
+                        if not (yield _Acquire(model, deadline.wait_budget(rate_limiter.MAX_WAIT_S))):
+                            vertex_img_errors.append(f"{model}: rate-limit queue timeout")
+                            break
+                        r, latency = yield _ImagePost(res, model, endpoint, predict_url, headers, imagen_payload,
+                                                      deadline.timeout(180),
+                                                      deadline.wait_budget(rate_limiter.MAX_WAIT_S))
                         if r.status_code == 200:
-                            predictions = r.json().get("predictions", [])
-                            if predictions and predictions[0].get("bytesBase64Encoded"):
+                            circuit_breaker.record_success(model, endpoint)
+                            data = _extract_image(r.json())
+                            if data:
+                                _record_latency(model, latency)
                                 logger.info(f"Vertex Imagen OK: {model}")
-                                return f"data:image/png;base64,{predictions[0]['bytesBase64Encoded']}"
+                                yield _Call(model_registry.record_success, (project, model, endpoint))
+                                return (yield from _done(data, model, endpoint))
                             vertex_img_errors.append(f"{model}: 200 but no image in response")
                             break
                         elif r.status_code == 429:
@@ -399,23 +1268,39 @@ def call_gemini_image(
                                 wait = int(_ra) if _ra else [8, 20, 45][_attempt]
                             except ValueError:
                                 wait = [8, 20, 45][_attempt]
-                            logger.warning(f"Vertex Imagen {model} rate limited (429), waiting {wait}s (attempt {_attempt+1}/3)")
-                            time.sleep(wait)
+                            logger.warning(f"Vertex Imagen {model} rate limited (429), backing off {wait}s (attempt {_attempt+1}/3)")
+                            rate_limiter.penalize(model, wait)
+                            if _attempt < 2 and not (yield from _retry_allowed(model)):
+                                break
                             continue
                         elif r.status_code in (500, 502, 503, 504):
+                            circuit_breaker.record_failure(model, endpoint)
+                            if circuit_breaker.is_open(model, endpoint):
+                                vertex_img_errors.append(f"{model}: circuit opened after HTTP {r.status_code}")
+                                break
+                            if _attempt < 2 and not (yield from _retry_allowed(model)):
+                                break
                             wait = [5, 15, 40][_attempt]
                             logger.warning(f"Vertex Imagen {model} server error ({r.status_code}), waiting {wait}s (attempt {_attempt+1}/3)")
-                            time.sleep(wait)
+                            yield _Sleep(deadline, wait)
                             continue
                         else:
+                            if r.status_code in (403, 404):
+                                yield _Call(model_registry.record_unavailable, (project, model, endpoint, r.status_code, r.text[:200]))
                             vertex_img_errors.append(f"{model}: HTTP {r.status_code} — {r.text[:200]}")
                             logger.warning(f"Vertex Imagen {model} → {r.status_code}: {r.text[:150]}")
                             break
+                    except ConcurrencyQueueTimeout as e:
+                        # Every model shares the slots; trying the next won't help.
+                        vertex_img_errors.append(str(e))
+                        return (yield from _done())
                     except (requests.Timeout, requests.ConnectionError) as e:
-                        if _attempt < 2:
+                        circuit_breaker.record_failure(model, endpoint)
+                        if (_attempt < 2 and not circuit_breaker.is_open(model, endpoint)
+                                and (yield from _retry_allowed(model))):
                             wait = [2, 5, 10][_attempt]
                             logger.warning(f"Vertex Imagen {model} network error, waiting {wait}s (attempt {_attempt+1}/3): {e}")
-                            time.sleep(wait)
+                            yield _Sleep(deadline, wait)
                             continue
                         vertex_img_errors.append(f"{model}: {e}")
                         break
@@ -448,5 +1333,4 @@ def call_gemini_image(
             "GOOGLE_SERVICE_ACCOUNT_JSON in Streamlit secrets, or paste "
             "them into the admin sidebar's Vertex AI panel."
         )
-    _last_image_errors.errors = vertex_img_errors
-    return None
+    return (yield from _done())